@@ -1,7 +1,87 @@
 import requests
+import base64
 import json
 import os
-from typing import Dict, List, Optional, Any
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Any
+
+from probes import FFmpegOutputParser, FFmpegProgressMonitor, HLSProbe, ProbeError, TSProbe, is_hls_url, measure_connect_time
+from probes.ffmpeg_output import STREAM_TEST_OUTPUT_TAIL_LINES
+from stream_health import record_stream_test
+from tool_supervisor import ToolCancelled, tool_supervisor
+from toolchain import get_toolchain
+from api.http_cache import CACHEABLE_ENDPOINTS, check_probe_ordering, get_http_cache, listing_fingerprint, request_key
+from api.reference_cache import ReferenceCache
+from api.single_flight import SingleFlight
+from api.transport import DispatcharrTransport
+
+# Try the in-process HLS probe before ffprobe/ffmpeg for .m3u8 streams in 'auto' probe mode
+STREAM_TEST_HLS_FAST_PATH = os.getenv('STREAM_TEST_HLS_FAST_PATH', 'true').lower() == 'true'
+
+# Stream test probe modes: 'auto' (HLS fast path only), 'fast' (in-process HLS and
+# MPEG-TS probes with ffprobe/ffmpeg as fallback), 'full' (always ffprobe/ffmpeg)
+PROBE_MODES = ('auto', 'fast', 'full')
+
+# Probe mode of tests that don't come from a rule (e.g. the stats refresher)
+STREAM_TEST_PROBE_MODE = os.getenv('STREAM_TEST_PROBE_MODE', 'auto')
+
+# Seconds between ffmpeg progress reports during the bitrate test (ffmpeg -stats_period,
+# ffmpeg 4.4+; 0 = ffmpeg's default of 0.5), which bounds the resolution of the startup/stall metrics
+STREAM_TEST_PROGRESS_PERIOD = float(os.getenv('STREAM_TEST_PROGRESS_PERIOD', '0.25'))
+
+# Seconds before the access token expires at which it is refreshed ahead of requests
+DISPATCHARR_TOKEN_REFRESH_MARGIN = float(os.getenv('DISPATCHARR_TOKEN_REFRESH_MARGIN', '60'))
+
+
+def decode_jwt_expiry(token: Optional[str]) -> Optional[float]:
+    """
+    Expiry of a JWT (its 'exp' claim, a Unix timestamp)
+
+    The token isn't verified; the expiry is only used to refresh it in time.
+
+    Returns:
+        The expiry, or None if the token isn't a JWT with an 'exp' claim
+    """
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+# Cancellation event of the job running in the current thread (see set_cancel_event)
+_cancel_scope = threading.local()
+
+# Resource usage of the tools run by the test in the current thread (see test_stream)
+_tool_usage = threading.local()
+
+
+class OperationCancelled(BaseException):
+    """
+    Raised when the job running in the current thread is cancelled
+
+    Derives from BaseException so the broad `except Exception` handlers of the
+    stream test loops don't swallow it and the whole execution stops.
+    """
+
+
+def set_cancel_event(event: Optional[threading.Event]):
+    """
+    Sets the cancellation event for operations run by the current thread
+
+    While the event is set, running ffprobe/ffmpeg processes started from this
+    thread are killed and OperationCancelled is raised.
+    """
+    _cancel_scope.event = event
+
+
+def get_cancel_event() -> Optional[threading.Event]:
+    """Gets the cancellation event of the current thread, if any"""
+    return getattr(_cancel_scope, 'event', None)
+
 
 class DispatcharrClient:
     """Client to interact with the dispatcharr API"""
@@ -15,17 +95,39 @@ class DispatcharrClient:
             password: Password for login
         """
         self.base_url = base_url.rstrip('/')
-        self.session = requests.Session()
+        # Timeouts, retries, rate limits and connection pool of all API calls
+        self.transport = DispatcharrTransport()
+        self.session = self.transport.session
+        # M3U accounts, profiles, channel groups and logos (see api/reference_cache.py)
+        self.reference_cache = ReferenceCache()
+        # Concurrent identical GETs share one request (see api/single_flight.py)
+        self.single_flight = SingleFlight()
+        # Validated pages and probed listings of the large list endpoints (see api/http_cache.py)
+        self.http_cache = get_http_cache()
         self.token = None
         self.refresh_token = None
+        # Expiry of the tokens (None if unknown), see decode_jwt_expiry
+        self.token_expires_at: Optional[float] = None
+        self.refresh_token_expires_at: Optional[float] = None
+        # Held while the tokens are renewed, so concurrent callers wait for one renewal
+        self._auth_lock = threading.Lock()
         self.username = username
         self.password = password
+        # Number of HTTP requests sent to Dispatcharr (reported in run summaries)
+        self.request_count = 0
+        self._request_count_lock = threading.Lock()
         self.session.headers.update({
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
         if self.username and self.password:
-            self.login()
+            with self._auth_lock:
+                self.login()
+
+    def _count_request(self):
+        """Counts an HTTP request sent to Dispatcharr"""
+        with self._request_count_lock:
+            self.request_count += 1
 
     def login(self):
         """
@@ -33,23 +135,29 @@ class DispatcharrClient:
         """
         url = f"{self.base_url}/api/accounts/token/"
         data = {"username": self.username, "password": self.password}
-        response = self.session.post(url, json=data)
+        self._count_request()
+        response = self.transport.request('POST', url, json=data)
         response.raise_for_status()
         result = response.json()
         token = result.get('access')
         if not token:
             raise Exception(f"No JWT token received when authenticating. Response: {result}")
-        self.token = token
+        self._set_access_token(token)
         self.refresh_token = result.get('refresh')
-        self.session.headers.update({
-            'Authorization': f'Bearer {self.token}'
-        })
+        self.refresh_token_expires_at = decode_jwt_expiry(self.refresh_token)
+
+    def _set_access_token(self, token: str):
+        self.token = token
+        self.token_expires_at = decode_jwt_expiry(token)
     
     def refresh_access_token(self):
         """
         Refresh the access token using the refresh token
+
+        Falls back to a full login if there is no (valid) refresh token or the
+        refresh fails. Callers should hold _auth_lock (see _ensure_token).
         """
-        if not self.refresh_token:
+        if not self.refresh_token or self._expires_within(self.refresh_token_expires_at, 0):
             # If no refresh token, do a full login
             self.login()
             return
@@ -57,7 +165,8 @@ class DispatcharrClient:
         url = f"{self.base_url}/api/accounts/token/refresh/"
         data = {"refresh": self.refresh_token}
         try:
-            response = self.session.post(url, json=data)
+            self._count_request()
+            response = self.transport.request('POST', url, json=data)
             response.raise_for_status()
             result = response.json()
             token = result.get('access')
@@ -65,13 +174,44 @@ class DispatcharrClient:
                 # If refresh fails, do a full login
                 self.login()
                 return
-            self.token = token
-            self.session.headers.update({
-                'Authorization': f'Bearer {self.token}'
-            })
+            self._set_access_token(token)
+            if result.get('refresh'):
+                # Rotated refresh token
+                self.refresh_token = result['refresh']
+                self.refresh_token_expires_at = decode_jwt_expiry(self.refresh_token)
         except requests.RequestException:
             # If refresh fails, do a full login
             self.login()
+
+    @staticmethod
+    def _expires_within(expires_at: Optional[float], seconds: float) -> bool:
+        """True if a token with this expiry expires within the given seconds (False if unknown)"""
+        return expires_at is not None and expires_at - time.time() <= seconds
+
+    def _ensure_token(self, rejected_token: Optional[str] = None) -> Optional[str]:
+        """
+        Gets a valid access token, renewing it first if needed
+
+        The token is renewed ahead of its expiry (DISPATCHARR_TOKEN_REFRESH_MARGIN)
+        or after the server rejected it. Only one thread renews at a time; the
+        others wait and use the renewed token.
+
+        Args:
+            rejected_token: Token the server answered 401 to (renewed unless
+                another thread already replaced it)
+
+        Returns:
+            The access token, or None without credentials
+        """
+        if not (self.username and self.password):
+            return self.token
+        with self._auth_lock:
+            if self.token is None:
+                self.login()
+            elif (rejected_token is not None and rejected_token == self.token) or \
+                    self._expires_within(self.token_expires_at, DISPATCHARR_TOKEN_REFRESH_MARGIN):
+                self.refresh_access_token()
+            return self.token
     
     def _make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, params: Optional[Dict] = None) -> Dict[str, Any]:
         """
@@ -89,38 +229,75 @@ class DispatcharrClient:
         Raises:
             requests.RequestException: If there's an error in the request
         """
+        if method.upper() == 'GET':
+            # Concurrent identical GETs share one request and its parsed result
+            key = ('GET', endpoint, json.dumps(params or {}, sort_keys=True, default=str))
+            return self.single_flight.do(key, lambda: self._send_request(method, endpoint, data, params),
+                                         label=endpoint)
+        try:
+            return self._send_request(method, endpoint, data, params)
+        finally:
+            self._invalidate_listings(endpoint)
+
+    def _invalidate_listings(self, endpoint: str):
+        """Drops the cached full listings of the list endpoint a write went to (see _get_listing)"""
+        if self.http_cache is None:
+            return
+        for list_endpoint in CACHEABLE_ENDPOINTS:
+            if endpoint.startswith(list_endpoint):
+                self.http_cache.invalidate_listings(self.base_url, list_endpoint)
+
+    def _send_request(self, method: str, endpoint: str, data: Optional[Dict] = None,
+                      params: Optional[Dict] = None) -> Dict[str, Any]:
+        """Sends a request to the API (see _make_request)"""
         url = f"{self.base_url}{endpoint}"
+        # Large list pages are revalidated with the validators of their cached copy
+        cache_key = None
+        if method.upper() == 'GET' and self.http_cache is not None and endpoint in CACHEABLE_ENDPOINTS:
+            cache_key = request_key(self.base_url, endpoint, params)
+        conditional = self.http_cache.conditional_headers(cache_key) if cache_key else {}
         
-        def make_http_request():
+        def make_http_request(token: Optional[str], conditional: Optional[Dict[str, str]] = None):
             """Internal function to make the actual HTTP request"""
-            if method.upper() == 'GET':
-                return self.session.get(url, params=params)
-            elif method.upper() == 'POST':
-                return self.session.post(url, json=data, params=params)
-            elif method.upper() == 'PUT':
-                return self.session.put(url, json=data, params=params)
-            elif method.upper() == 'PATCH':
-                return self.session.patch(url, json=data, params=params)
-            elif method.upper() == 'DELETE':
-                return self.session.delete(url, params=params)
-            else:
+            # Auth goes in the headers of each request: the shared session isn't modified
+            headers = dict(conditional or {})
+            if token:
+                headers['Authorization'] = f'Bearer {token}'
+            headers = headers or None
+            if method.upper() not in ('GET', 'POST', 'PUT', 'PATCH', 'DELETE'):
                 raise ValueError(f"Unsupported HTTP method: {method}")
+            self._count_request()
+            # Retried with backoff on connection errors and 5xx answers (see api/transport.py)
+            if method.upper() in ('GET', 'DELETE'):
+                return self.transport.request(method, url, params=params, headers=headers)
+            return self.transport.request(method, url, json=data, params=params, headers=headers)
         
         try:
-            response = make_http_request()
+            token = self._ensure_token()
+            response = make_http_request(token, conditional)
             
-            # If we get 401, try to refresh the token and retry once
+            # If we get 401, renew the token (unless another thread already did) and retry once
             if response.status_code == 401 and self.username and self.password:
-                self.refresh_access_token()
-                response = make_http_request()
+                token = self._ensure_token(rejected_token=token)
+                response = make_http_request(token, conditional)
+            
+            if response.status_code == 304 and cache_key:
+                payload = self.http_cache.not_modified(cache_key)
+                if payload is not None:
+                    return payload
+                # The cached copy is gone (e.g. cleared meanwhile): download the page again
+                response = make_http_request(token)
             
             response.raise_for_status()
             
             # Try to decode JSON, if it fails return text
             try:
-                return response.json()
+                payload = response.json()
             except json.JSONDecodeError:
                 return {'message': response.text}
+            if cache_key:
+                self.http_cache.store_response(cache_key, endpoint, response.headers, payload)
+            return payload
                 
         except requests.RequestException as e:
             raise requests.RequestException(f"Error in request to {url}: {str(e)}")
@@ -154,7 +331,16 @@ class DispatcharrClient:
                 return result
             return result.get('results', [])
         
-        # Automatic pagination to get ALL channels
+        # Concurrent downloads of all channels with the same arguments share one download
+        return self.single_flight.do(
+            ('get_channels', search, ordering, page_size),
+            lambda: self._get_listing('/api/channels/channels/', search, ordering, page_size,
+                                      lambda: self._get_all_channels(search, ordering, page_size)),
+            label='get_channels')
+
+    def _get_all_channels(self, search: Optional[str], ordering: Optional[str],
+                          page_size: Optional[int]) -> List[Dict[str, Any]]:
+        """Downloads all channels page by page"""
         all_channels = []
         current_page = 1
         params = {}
@@ -187,6 +373,78 @@ class DispatcharrClient:
         
         return all_channels
     
+    def _get_listing(self, endpoint: str, search: Optional[str], ordering: Optional[str],
+                     page_size: Optional[int], download: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Downloads a whole list endpoint, or reuses its cached copy if a change probe shows it unchanged
+
+        Endpoints that send ETag/Last-Modified are downloaded with conditional
+        requests per page instead (see _send_request). For the others, page 1
+        ordered by -updated_at gives the item count and the newest change; while
+        those match the cached listing's, nothing else is requested. Listings are
+        only reused if the endpoint honors that ordering (checked once), and
+        writes of this client to the endpoint drop them (see _invalidate_listings).
+
+        Args:
+            endpoint: List endpoint
+            search, ordering, page_size: Arguments of the listing (part of its cache key)
+            download: Downloads all pages
+
+        Returns:
+            All items of the endpoint
+        """
+        cache = self.http_cache
+        if cache is None or cache.emits_validators(endpoint) or cache.probe_ordering(endpoint) is False:
+            return download()
+
+        generation = cache.listing_generation(endpoint)
+        # Two items, so the ordering can be checked
+        probe_params = {'page': 1, 'page_size': 2, 'ordering': '-updated_at'}
+        if search:
+            probe_params['search'] = search
+        try:
+            probe = self._make_request('GET', endpoint, params=probe_params)
+            fingerprint = listing_fingerprint(probe)
+            # The probe itself shows whether the endpoint sends validators
+            if fingerprint is None or cache.emits_validators(endpoint):
+                return download()
+            if cache.probe_ordering(endpoint) is None and not self._check_probe_ordering(endpoint, probe):
+                return download()
+        except requests.RequestException as e:
+            print(f"⚠️  Change probe of {endpoint} failed, downloading it: {e}")
+            return download()
+
+        key = request_key(self.base_url, endpoint, {'search': search, 'ordering': ordering, 'page_size': page_size})
+        cached = cache.cached_listing(key, fingerprint)
+        if cached is not None:
+            return cached
+        # Probed before downloading: a change made during the download is seen by the next probe
+        items = download()
+        cache.store_listing(key, endpoint, fingerprint, items, generation)
+        return items
+
+    def _check_probe_ordering(self, endpoint: str, probe: Dict[str, Any]) -> bool:
+        """
+        Checks once whether an endpoint honors ordering by updated_at (DRF ignores fields it doesn't allow)
+
+        Args:
+            endpoint: List endpoint
+            probe: Its page 1 ordered by -updated_at
+
+        Returns:
+            Whether its listings can be reused by change probe
+        """
+        cache = self.http_cache
+        if probe.get('count', 0) < 2:
+            # Nothing to compare yet: check again on a later probe
+            return True
+        ascending = self._make_request('GET', endpoint, params={'page': 1, 'page_size': 2, 'ordering': 'updated_at'})
+        honored = check_probe_ordering(probe, ascending)
+        cache.set_probe_ordering(endpoint, honored)
+        if not honored:
+            print(f"⚠️  {endpoint} doesn't order by updated_at: its listings are always downloaded in full")
+        return honored
+
     def get_channel(self, channel_id: str) -> Dict[str, Any]:
         """
         Get information from a specific channel
@@ -282,7 +540,16 @@ class DispatcharrClient:
                 return result
             return result.get('results', [])
         
-        # Automatic pagination to get ALL streams
+        # Concurrent downloads of all streams with the same arguments share one download
+        return self.single_flight.do(
+            ('get_streams', search, ordering, page_size),
+            lambda: self._get_listing('/api/channels/streams/', search, ordering, page_size,
+                                      lambda: self._get_all_streams(search, ordering, page_size)),
+            label='get_streams')
+
+    def _get_all_streams(self, search: Optional[str], ordering: Optional[str],
+                         page_size: Optional[int]) -> List[Dict[str, Any]]:
+        """Downloads all streams page by page"""
         all_streams = []
         current_page = 1
         params = {}
@@ -504,18 +771,44 @@ class DispatcharrClient:
         except Exception:
             return False
     
-    def get_m3u_accounts(self) -> List[Dict[str, Any]]:
+    def get_m3u_accounts(self, fresh: bool = False) -> List[Dict[str, Any]]:
         """
-        Get all M3U accounts
+        Get all M3U accounts (cached, see REFERENCE_TTLS)
+        
+        Args:
+            fresh: Load them from Dispatcharr even if cached (e.g. to follow a refresh)
         
         Returns:
             List of M3U accounts
         """
+        return list(self.reference_cache.get('m3u_accounts', self._load_m3u_accounts, fresh).items)
+
+    def get_m3u_account_by_id(self, account_id: int) -> Optional[Dict[str, Any]]:
+        """Get an M3U account by ID from the cached accounts (None if not found)"""
+        return self.reference_cache.get('m3u_accounts', self._load_m3u_accounts).by_id.get(account_id)
+
+    def _load_m3u_accounts(self) -> List[Dict[str, Any]]:
         result = self._make_request('GET', '/api/m3u/accounts/')
         # API may return direct list or paginated object
         if isinstance(result, list):
             return result
         return result.get('results', [])
+
+    def invalidate_reference_data(self, resource: Optional[str] = None):
+        """
+        Forget cached reference data, so it is loaded again on next use
+
+        Invalidating everything also clears the on-disk HTTP cache (see api/http_cache.py).
+
+        Args:
+            resource: 'm3u_accounts', 'profiles', 'channel_groups', 'logos' or None for all
+        """
+        self.reference_cache.invalidate(resource)
+        if self.http_cache is not None:
+            if resource is None:
+                self.http_cache.clear()
+            elif resource == 'logos':
+                self.http_cache.invalidate_listings(self.base_url, '/api/channels/logos/')
     
     def refresh_m3u_sources(self) -> Dict[str, Any]:
         """
@@ -524,7 +817,10 @@ class DispatcharrClient:
         Returns:
             Response from the API
         """
-        return self._make_request('POST', '/api/m3u/refresh/')
+        result = self._make_request('POST', '/api/m3u/refresh/')
+        # Refreshing updates the accounts (status, updated_at)
+        self.invalidate_reference_data('m3u_accounts')
+        return result
     
     def get_last_m3u_refresh_time(self) -> Optional[str]:
         """
@@ -575,13 +871,23 @@ class DispatcharrClient:
             from datetime import datetime
             return datetime.now().isoformat() + 'Z'
     
-    def get_channel_groups(self) -> List[Dict[str, Any]]:
+    def get_channel_groups(self, fresh: bool = False) -> List[Dict[str, Any]]:
         """
-        Get all channel groups
+        Get all channel groups (cached, see REFERENCE_TTLS)
+        
+        Args:
+            fresh: Load them from Dispatcharr even if cached
         
         Returns:
             List of channel groups
         """
+        return list(self.reference_cache.get('channel_groups', self._load_channel_groups, fresh).items)
+
+    def get_channel_group_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Get a channel group by name from the cached groups (None if not found)"""
+        return self.reference_cache.get('channel_groups', self._load_channel_groups).by_name.get(name)
+
+    def _load_channel_groups(self) -> List[Dict[str, Any]]:
         result = self._make_request('GET', '/api/channels/groups/')
         # API may return direct list or paginated object
         if isinstance(result, list):
@@ -593,12 +899,20 @@ class DispatcharrClient:
         Get all logos
         
         Args:
-            page: Page number for pagination (if None, gets all pages)
+            page: Page number for pagination (if None, gets all pages, cached
+                when page_size isn't given either, see REFERENCE_TTLS)
             page_size: Number of results per page
             
         Returns:
             List of logos
         """
+        if page is None and page_size is None:
+            return list(self.reference_cache.get(
+                'logos', lambda: self._get_listing('/api/channels/logos/', None, None, None,
+                                                   lambda: self._load_logos(None, None))).items)
+        return self._load_logos(page, page_size)
+
+    def _load_logos(self, page: Optional[int], page_size: Optional[int]) -> List[Dict[str, Any]]:
         if page is not None:
             # Single page request
             params = {}
@@ -640,20 +954,202 @@ class DispatcharrClient:
                 
             return all_logos
     
-    def test_stream(self, stream_id: int, test_duration: int = None) -> Dict[str, Any]:
+    def _run_tool(self, cmd: List[str], timeout: float,
+                  on_stdout_line: Optional[Callable[[str], None]] = None,
+                  on_stderr_line: Optional[Callable[[str], None]] = None) -> subprocess.CompletedProcess:
+        """
+        Run an external tool (ffprobe/ffmpeg) honoring the current cancellation event
+
+        Behaves like subprocess.run(cmd, capture_output=True, text=True, timeout=timeout),
+        but the tool runs under the process-wide ToolSupervisor (concurrency cap,
+        priority and resource limits) and the process (and its children) is killed
+        as soon as the job running in this thread is cancelled. The resource usage
+        of the tool is added to the usage of the current test (see test_stream).
+
+        Args:
+            cmd: Command line
+            timeout: Seconds the tool may run
+            on_stdout_line: Called with every stdout line as soon as it is written
+                (e.g. ffmpeg -progress output); only the last lines are then returned
+            on_stderr_line: Called with every stderr line as soon as it is written
+
+        Only the last STREAM_TEST_OUTPUT_TAIL_LINES lines of stderr are returned,
+        for error reporting; stdout is returned in full unless on_stdout_line
+        consumes it.
+
+        Raises:
+            subprocess.TimeoutExpired: If the tool runs longer than timeout
+            OperationCancelled: If the current job was cancelled
+        """
+        cancel_event = get_cancel_event()
+        if cancel_event is not None and cancel_event.is_set():
+            raise OperationCancelled()
+
+        try:
+            completed = tool_supervisor.run(cmd, timeout, cancel_event, on_stdout_line, on_stderr_line,
+                                            tail_lines=STREAM_TEST_OUTPUT_TAIL_LINES)
+        except ToolCancelled:
+            raise OperationCancelled()
+        usage = getattr(_tool_usage, 'runs', None)
+        if usage is not None:
+            usage.append(completed.usage)
+        return completed
+
+    def _save_test_stats(self, stream_id: int, stream_obj: Dict[str, Any], stream: Optional[Dict[str, Any]],
+                         stats_buffer=None) -> Dict[str, Any]:
+        """
+        Save the stats set on stream_obj by a stream test
+
+        With a stats buffer (see stats_buffer.StatsWriteBuffer) the write is queued
+        and the caller's stream dictionary is updated right away; otherwise the
+        whole stream object is PUT.
+
+        Returns:
+            The updated stream
+        """
+        if stats_buffer is not None:
+            stats_buffer.record(stream if stream is not None else stream_obj,
+                                stream_obj['stream_stats'], stream_obj.get('stream_stats_updated_at'))
+            return stream_obj
+        updated_stream = self.update_stream(stream_id, stream_obj)
+        if stream is not None:
+            stream['stream_stats'] = stream_obj['stream_stats']
+            stream['stream_stats_updated_at'] = stream_obj.get('stream_stats_updated_at')
+        return updated_stream
+
+    def _test_stream_fast(self, stream_id: int, stream_obj: Dict[str, Any], stream_url: str,
+                          user_agent: str, probe_mode: str, stream: Optional[Dict[str, Any]] = None,
+                          stats_buffer=None, startup_stats: Optional[Dict[str, Any]] = None
+                          ) -> Optional[Dict[str, Any]]:
+        """
+        Test a stream with the in-process probes, without ffprobe/ffmpeg
+
+        HLS streams are analyzed from their playlists (in 'auto' mode unless
+        STREAM_TEST_HLS_FAST_PATH is disabled, and in 'fast' mode); other streams
+        are read as MPEG-TS in 'fast' mode only. startup_stats (e.g. the connect
+        time) are added to the stats; the MPEG-TS probe also measures ttfb_ms.
+
+        Returns:
+            Dict with test results (same format as test_stream), or None if the
+            probe doesn't apply or couldn't replace the ffprobe/ffmpeg test
+        """
+        if is_hls_url(stream_url):
+            if probe_mode == 'full' or (probe_mode == 'auto' and not STREAM_TEST_HLS_FAST_PATH):
+                return None
+            probe, method = HLSProbe(user_agent=user_agent), 'hls'
+        elif probe_mode == 'fast':
+            probe, method = TSProbe(user_agent=user_agent), 'mpegts'
+        else:
+            return None
+
+        cancel_event = get_cancel_event()
+        if cancel_event is not None and cancel_event.is_set():
+            raise OperationCancelled()
+
+        started = time.time()
+        try:
+            result = probe.probe(stream_url)
+        except (ProbeError, ValueError) as e:
+            # A malformed playlist or stream is a probe failure, not a failed stream
+            print(f"   ⚠️  {method.upper()} probe failed ({e}), falling back to ffprobe/ffmpeg")
+            return None
+        if not result['complete']:
+            missing = [key for key in ('resolution', 'video_codec', 'ffmpeg_output_bitrate')
+                       if key not in result['stats']]
+            print(f"   ⚠️  {method.upper()} probe could not find {', '.join(missing)}, "
+                  f"falling back to ffprobe/ffmpeg")
+            return None
+
+        stats = dict(result['stats'])
+        stats.update(startup_stats or {})
+        if method == 'mpegts' and result.get('startup_ms') is not None:
+            stats['ttfb_ms'] = round(result['startup_ms'])
+        print(f"   ⚡ {method.upper()} probe SUCCESS in {(time.time() - started) * 1000:.0f} ms")
+        print(f"📊 Final Statistics Collected:")
+        for key, value in stats.items():
+            print(f"   {key}: {value}")
+
+        from datetime import datetime, timezone
+        stream_obj['stream_stats'] = stats
+        stream_obj['stream_stats_updated_at'] = datetime.now(timezone.utc).isoformat()
+        try:
+            updated_stream = self._save_test_stats(stream_id, stream_obj, stream, stats_buffer)
+            print(f"Successfully saved statistics to Dispatcharr for stream {stream_id}")
+            return {
+                'success': True,
+                'message': f'Stream {stream_id} analyzed successfully and statistics saved to Dispatcharr',
+                'stream_id': stream_id,
+                'stream_url': stream_url,
+                'statistics': stats,
+                'probe_method': method,
+                'startup_ms': result.get('startup_ms'),
+                'updated_stream': updated_stream
+            }
+        except Exception as e:
+            print(f"Failed to save statistics to Dispatcharr: {str(e)}")
+            return {
+                'success': True,
+                'message': f'Stream {stream_id} analyzed successfully but failed to save to Dispatcharr: {str(e)}',
+                'stream_id': stream_id,
+                'stream_url': stream_url,
+                'statistics': stats,
+                'probe_method': method,
+                'startup_ms': result.get('startup_ms'),
+                'save_error': str(e)
+            }
+
+    def test_stream(self, stream_id: int, test_duration: int = None, probe_mode: Optional[str] = None,
+                    stream: Optional[Dict[str, Any]] = None, stats_buffer=None) -> Dict[str, Any]:
+        """
+        Test a stream (see _test_stream) and record the result in the stream health store
+
+        Cancelled tests are not recorded.
+
+        Returns:
+            Dict with test results, including 'duration_ms' (whole test), for
+            successful tests 'startup_ms' (time until the stream delivered data),
+            and 'resource_usage' of the ffprobe/ffmpeg processes ('cpu_seconds',
+            'peak_rss_mb', 'processes'; None when no tool ran)
+        """
+        started = time.time()
+        _tool_usage.runs = []
+        try:
+            result = self._test_stream(stream_id, test_duration, probe_mode, stream, stats_buffer)
+        finally:
+            runs, _tool_usage.runs = _tool_usage.runs, None
+        result['duration_ms'] = (time.time() - started) * 1000
+        result['resource_usage'] = {
+            'cpu_seconds': round(sum(run.get('cpu_seconds') or 0.0 for run in runs), 3),
+            'peak_rss_mb': max((run.get('peak_rss_mb') or 0.0 for run in runs), default=0.0),
+            'processes': len(runs)
+        } if runs else None
+        record_stream_test(stream_id, result, result['duration_ms'])
+        return result
+
+    def _test_stream(self, stream_id: int, test_duration: int = None, probe_mode: Optional[str] = None,
+                     stream: Optional[Dict[str, Any]] = None, stats_buffer=None) -> Dict[str, Any]:
         """
         Test a stream using ffprobe to analyze its properties and quality.
         Uses the stream's direct URL. Updates the stream in Dispatcharr with the analyzed statistics.
+        Depending on the probe mode, the stream is first analyzed in-process (see
+        _test_stream_fast) and ffprobe/ffmpeg only run when that probe can't find the
+        resolution, video codec or bitrate.
         
         Args:
             stream_id: ID of the stream to test
             test_duration: How long to analyze the stream (in seconds). If None, uses STREAM_TEST_DURATION env var or default 10
+            probe_mode: 'auto', 'fast' or 'full' (see PROBE_MODES). If None, uses STREAM_TEST_PROBE_MODE
+            stream: The stream as already loaded by the caller (saves fetching it again); its
+                stats are updated in place with the test result
+            stats_buffer: StatsWriteBuffer collecting the result instead of writing it right away
             
         Returns:
             Dict with test results
             
         Environment Variables:
             STREAM_TEST_USER_AGENT: User-Agent string to use for ffmpeg/ffprobe requests (default: Chrome 132 user agent)
+            STREAM_TEST_HLS_FAST_PATH: Analyze .m3u8 streams from their playlists first in 'auto' mode (default: true)
+            STREAM_TEST_PROBE_MODE: Probe mode when none is given (default: auto)
         """
         # Get configurable parameters from environment
         if test_duration is None:
@@ -661,12 +1157,14 @@ class DispatcharrClient:
         
         timeout_buffer = int(os.getenv('STREAM_TEST_TIMEOUT_BUFFER', '30'))
         user_agent = os.getenv('STREAM_TEST_USER_AGENT', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.3')
+        if probe_mode not in PROBE_MODES:
+            probe_mode = STREAM_TEST_PROBE_MODE if STREAM_TEST_PROBE_MODE in PROBE_MODES else 'auto'
         import subprocess
         import time
         
         try:
-            # Get the stream object from Dispatcharr
-            stream_obj = self.get_stream(stream_id)
+            # Get the stream object from Dispatcharr (unless the caller already has it)
+            stream_obj = dict(stream) if stream and stream.get('url') else self.get_stream(stream_id)
             stream_url = stream_obj.get('url')
             stream_name = stream_obj.get('name', f'Stream {stream_id}')
             
@@ -679,64 +1177,32 @@ class DispatcharrClient:
                     'success': False,
                     'message': f'Stream {stream_id} does not have a URL'
                 }
-            
-            # Try to find ffprobe executable
-            import os as os_module
-            ffprobe_executable = 'ffprobe'
-
-            # First, check for Docker-specific ffprobe path file
-            ffprobe_path_file = os_module.path.join(
-                os_module.path.dirname(os_module.path.dirname(os_module.path.abspath(__file__))),
-                'tools', 'ffprobe_path.txt'
-            )
-            
-            # Check for local installations (development environment)
-            local_ffprobe = os_module.path.join(
-                os_module.path.dirname(os_module.path.dirname(os_module.path.abspath(__file__))),
-                'tools', 'ffmpeg', 'ffmpeg-7.1-essentials_build', 'bin', 'ffprobe.exe'
-            )
-            local_ffmpeg = os_module.path.join(
-                os_module.path.dirname(os_module.path.dirname(os_module.path.abspath(__file__))),
-                'tools', 'ffmpeg', 'ffmpeg-7.1-essentials_build', 'bin', 'ffmpeg.exe'
-            )
-
-            if os_module.path.exists(ffprobe_path_file):
-                try:
-                    with open(ffprobe_path_file, 'r') as f:
-                        docker_ffprobe_path = f.read().strip()
-                        if os_module.path.exists(docker_ffprobe_path):
-                            ffprobe_executable = docker_ffprobe_path
-                            print(f"Using Docker ffprobe: {docker_ffprobe_path}")
-                        else:
-                            print(f"Docker ffprobe path {docker_ffprobe_path} does not exist, using system ffprobe")
-                except Exception as e:
-                    print(f"Error reading ffprobe path file: {e}, using system ffprobe")
-            else:
-                if os_module.path.exists(local_ffprobe):
-                    ffprobe_executable = local_ffprobe
-                    print(f"Using local ffprobe: {local_ffprobe}")
-                else:
-                    print(f"Local ffprobe not found at {local_ffprobe}, using system ffprobe")
 
-            if os_module.path.exists(local_ffmpeg):
-                ffmpeg_executable = local_ffmpeg
-                print(f"Using local ffmpeg: {local_ffmpeg}")
-            else:
-                ffmpeg_executable = 'ffmpeg'
-                print("Local ffmpeg not found, using system ffmpeg")
+            # TCP connect time of the stream's host, reported by every probe method
+            startup_stats = {}
+            connect_time_ms = measure_connect_time(stream_url)
+            if connect_time_ms is not None:
+                startup_stats['connect_time_ms'] = round(connect_time_ms)
 
-            # Verify executables exist and are executable
-            import shutil
-            if not shutil.which(ffprobe_executable):
+            fast_result = self._test_stream_fast(stream_id, stream_obj, stream_url, user_agent, probe_mode,
+                                                 stream, stats_buffer, startup_stats)
+            if fast_result is not None:
+                return fast_result
+            
+            # ffprobe/ffmpeg are located and checked once per process (see toolchain.py)
+            toolchain = get_toolchain()
+            if not toolchain.available:
                 return {
                     'success': False,
-                    'message': f'ffprobe executable not found: {ffprobe_executable}'
+                    'message': f'Stream testing unavailable: {toolchain.error}'
                 }
-            if not shutil.which(ffmpeg_executable):
+            if not toolchain.supports_protocol(stream_url):
                 return {
                     'success': False,
-                    'message': f'ffmpeg executable not found: {ffmpeg_executable}'
+                    'message': f'ffmpeg does not support the protocol of {stream_url}'
                 }
+            ffprobe_executable = toolchain.ffprobe
+            ffmpeg_executable = toolchain.ffmpeg
             
             # Step 1: Use ffprobe FIRST to check if stream is accessible and get basic info
             # This is faster than ffmpeg and can fail early if stream is not working
@@ -762,12 +1228,9 @@ class DispatcharrClient:
                 else:
                     ffprobe_quoted_cmd.append(arg)
             # Run primary ffprobe command
-            result = subprocess.run(
-                ffprobe_cmd,
-                capture_output=True,
-                text=True,
-                timeout=test_duration + timeout_buffer
-            )
+            probe_started = time.time()
+            result = self._run_tool(ffprobe_cmd, timeout=test_duration + timeout_buffer)
+            startup_ms = (time.time() - probe_started) * 1000
 
             if result.returncode != 0:
                 error_msg = result.stderr if result.stderr else "Unknown error"
@@ -782,7 +1245,7 @@ class DispatcharrClient:
                 stream_obj['stream_stats_updated_at'] = None
                 
                 try:
-                    updated_stream = self.update_stream(stream_id, stream_obj)
+                    updated_stream = self._save_test_stats(stream_id, stream_obj, stream, stats_buffer)
                     print(f"Cleared statistics for stream {stream_id} in Dispatcharr")
                     return {
                         'success': False,
@@ -844,7 +1307,7 @@ class DispatcharrClient:
                 stream_obj['stream_stats_updated_at'] = None
                 
                 try:
-                    updated_stream = self.update_stream(stream_id, stream_obj)
+                    updated_stream = self._save_test_stats(stream_id, stream_obj, stream, stats_buffer)
                     print(f"Cleared statistics for stream {stream_id} in Dispatcharr")
                     return {
                         'success': False,
@@ -875,6 +1338,11 @@ class DispatcharrClient:
                 '-f', 'null',  # Discard output
                 '-'
             ]
+            if toolchain.supports_progress:
+                # Progress blocks on stdout for the startup/stall metrics
+                ffmpeg_cmd[1:1] = ['-progress', 'pipe:1']
+                if STREAM_TEST_PROGRESS_PERIOD > 0 and toolchain.supports_stats_period:
+                    ffmpeg_cmd[1:1] = ['-stats_period', str(STREAM_TEST_PROGRESS_PERIOD)]
 
             # Print command with proper quoting for readability
             quoted_cmd = []
@@ -885,12 +1353,23 @@ class DispatcharrClient:
                     quoted_cmd.append(arg)
             print(f"   Command: {' '.join(quoted_cmd)}")
 
-            ffmpeg_result = subprocess.run(
-                ffmpeg_cmd,
-                capture_output=True,
-                text=True,
-                timeout=test_duration + timeout_buffer
-            )
+            # Progress (stdout) and stats/summary lines (stderr) are parsed as ffmpeg writes them
+            progress_monitor = FFmpegProgressMonitor()
+            output_parser = FFmpegOutputParser()
+            ffmpeg_result = self._run_tool(ffmpeg_cmd, timeout=test_duration + timeout_buffer,
+                                           on_stdout_line=progress_monitor.feed_line,
+                                           on_stderr_line=output_parser.feed_line)
+            if ffmpeg_result.returncode != 0 and 'stats_period' in ffmpeg_cmd and \
+                    "Unrecognized option 'stats_period'" in (ffmpeg_result.stderr or ''):
+                # ffmpeg older than 4.4: progress is reported every 0.5 seconds
+                print(f"   ⚠️  ffmpeg does not support -stats_period, using its default progress period")
+                toolchain.supports_stats_period = False
+                ffmpeg_cmd[1:3] = []
+                progress_monitor = FFmpegProgressMonitor()
+                output_parser = FFmpegOutputParser()
+                ffmpeg_result = self._run_tool(ffmpeg_cmd, timeout=test_duration + timeout_buffer,
+                                               on_stdout_line=progress_monitor.feed_line,
+                                               on_stderr_line=output_parser.feed_line)
 
             # Check for ffmpeg errors - if ffmpeg fails but ffprobe succeeded, we still have basic info
             if ffmpeg_result.returncode != 0:
@@ -907,7 +1386,7 @@ class DispatcharrClient:
                 stream_obj['stream_stats_updated_at'] = None
                 
                 try:
-                    updated_stream = self.update_stream(stream_id, stream_obj)
+                    updated_stream = self._save_test_stats(stream_id, stream_obj, stream, stats_buffer)
                     print(f"Cleared statistics for stream {stream_id} in Dispatcharr")
                     return {
                         'success': False,
@@ -927,66 +1406,11 @@ class DispatcharrClient:
                         'clear_error': str(e)
                     }
 
-            # Parse bitrate from ffmpeg stderr output
-            # Look for output size line like: "video:5607KiB audio:125KiB"
-            calculated_bitrate = None
-            calculated_bitrate_kbps = None
+            # Bitrate from the data sizes of the final summary line ("video:5607KiB audio:125KiB"),
+            # falling back to the bitrate of the last stats line
+            calculated_bitrate_kbps = output_parser.bitrate_kbps(test_duration)
+            calculated_bitrate = calculated_bitrate_kbps * 1000 if calculated_bitrate_kbps else None
 
-            for line in ffmpeg_result.stderr.split('\n'):
-                # Look for the final summary line with data sizes
-                if 'video:' in line and 'audio:' in line and ('KiB' in line or 'kB' in line):
-                    try:
-                        # Extract video and audio sizes
-                        video_size_kb = 0
-                        audio_size_kb = 0
-
-                        # Parse video size
-                        if 'video:' in line:
-                            # Handle both KiB and kB formats
-                            if 'KiB' in line:
-                                video_part = line.split('video:')[1].split('KiB')[0].strip()
-                            elif 'kB' in line:
-                                video_part = line.split('video:')[1].split('kB')[0].strip()
-                            else:
-                                video_part = None
-                            
-                            if video_part:
-                                video_size_kb = float(video_part)
-
-                        # Parse audio size
-                        if 'audio:' in line:
-                            # Handle both KiB and kB formats
-                            if 'KiB' in line:
-                                audio_part = line.split('audio:')[1].split('KiB')[0].strip()
-                            elif 'kB' in line:
-                                audio_part = line.split('audio:')[1].split('kB')[0].strip()
-                            else:
-                                audio_part = None
-                            
-                            if audio_part:
-                                audio_size_kb = float(audio_part)
-
-                        # Calculate total bitrate: (total_KB * 8) / duration_seconds = kbits/s
-                        total_size_kb = video_size_kb + audio_size_kb
-                        calculated_bitrate_kbps = (total_size_kb * 8) / test_duration
-                        calculated_bitrate = calculated_bitrate_kbps * 1000  # Convert to bits/s
-
-                    except (ValueError, IndexError) as e:
-                        print(f"Error parsing data sizes from line '{line}': {e}")
-                        pass
-
-            # Fallback: try to parse from progress line
-            if not calculated_bitrate:
-                for line in ffmpeg_result.stderr.split('\n'):
-                    if 'bitrate=' in line and 'kbits/s' in line:
-                        try:
-                            bitrate_part = line.split('bitrate=')[1].split('kbits/s')[0].strip()
-                            if bitrate_part and bitrate_part != 'N/A':
-                                calculated_bitrate_kbps = float(bitrate_part)
-                                calculated_bitrate = calculated_bitrate_kbps * 1000
-                        except (ValueError, IndexError):
-                            pass
-            
             # Second fallback: try to get bitrate from format bitrate in ffprobe
             if not calculated_bitrate_kbps:
                 format_bitrate = probe_data.get('format', {}).get('bit_rate')
@@ -1003,11 +1427,11 @@ class DispatcharrClient:
             video_stream = None
             audio_stream = None
             
-            for stream in probe_data.get('streams', []):
-                if stream.get('codec_type') == 'video' and not video_stream:
-                    video_stream = stream
-                elif stream.get('codec_type') == 'audio' and not audio_stream:
-                    audio_stream = stream
+            for probe_stream in probe_data.get('streams', []):
+                if probe_stream.get('codec_type') == 'video' and not video_stream:
+                    video_stream = probe_stream
+                elif probe_stream.get('codec_type') == 'audio' and not audio_stream:
+                    audio_stream = probe_stream
             
             # Build statistics object using Dispatcharr's original format
             # Based on stream 556 format (10 fields)
@@ -1065,6 +1489,14 @@ class DispatcharrClient:
             else:
                 print(f"   ⚠️  FFmpeg completed but no bitrate calculated")
 
+            # Startup latency and stalls
+            stats.update(startup_stats)
+            stats.update(progress_monitor.stats())
+            if 'ttfb_ms' in stats:
+                print(f"      Startup: connect {stats.get('connect_time_ms', '?')} ms, "
+                      f"first data {stats['ttfb_ms']} ms, first keyframe {stats.get('first_keyframe_ms', '?')} ms, "
+                      f"{stats['stall_count']} stall(s) ({stats['stall_total_ms']} ms)")
+
             print(f"📊 Final Statistics Collected:")
             for key, value in stats.items():
                 print(f"   {key}: {value}")
@@ -1080,7 +1512,7 @@ class DispatcharrClient:
 
             # Save the updated stream back to Dispatcharr
             try:
-                updated_stream = self.update_stream(stream_id, stream_obj)
+                updated_stream = self._save_test_stats(stream_id, stream_obj, stream, stats_buffer)
 
                 print(f"Successfully saved statistics to Dispatcharr for stream {stream_id}")
                 return {
@@ -1089,6 +1521,8 @@ class DispatcharrClient:
                     'stream_id': stream_id,
                     'stream_url': stream_url,
                     'statistics': stats,
+                    'probe_method': 'ffmpeg',
+                    'startup_ms': startup_ms,
                     'raw_probe_data': probe_data,
                     'updated_stream': updated_stream
                 }
@@ -1101,6 +1535,8 @@ class DispatcharrClient:
                     'stream_id': stream_id,
                     'stream_url': stream_url,
                     'statistics': stats,
+                    'probe_method': 'ffmpeg',
+                    'startup_ms': startup_ms,
                     'raw_probe_data': probe_data,
                     'save_error': str(e)
                 }
@@ -1112,7 +1548,7 @@ class DispatcharrClient:
             stream_obj['stream_stats_updated_at'] = None
             
             try:
-                updated_stream = self.update_stream(stream_id, stream_obj)
+                updated_stream = self._save_test_stats(stream_id, stream_obj, stream, stats_buffer)
                 print(f"Cleared statistics for stream {stream_id} in Dispatcharr due to timeout")
                 return {
                     'success': False,
@@ -1133,7 +1569,7 @@ class DispatcharrClient:
             stream_obj['stream_stats_updated_at'] = None
             
             try:
-                updated_stream = self.update_stream(stream_id, stream_obj)
+                updated_stream = self._save_test_stats(stream_id, stream_obj, stream, stats_buffer)
                 print(f"Cleared statistics for stream {stream_id} in Dispatcharr due to error")
                 return {
                     'success': False,
@@ -1148,13 +1584,23 @@ class DispatcharrClient:
                     'clear_error': str(clear_e)
                 }
     
-    def get_profiles(self) -> List[Dict[str, Any]]:
+    def get_profiles(self, fresh: bool = False) -> List[Dict[str, Any]]:
         """
-        Get all channel profiles
+        Get all channel profiles (cached, see REFERENCE_TTLS)
+        
+        Args:
+            fresh: Load them from Dispatcharr even if cached
         
         Returns:
             List of channel profiles
         """
+        return list(self.reference_cache.get('profiles', self._load_profiles, fresh).items)
+
+    def get_profile_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Get a channel profile by name from the cached profiles (None if not found)"""
+        return self.reference_cache.get('profiles', self._load_profiles).by_name.get(name)
+
+    def _load_profiles(self) -> List[Dict[str, Any]]:
         result = self._make_request('GET', '/api/channels/profiles/')
         # API may return direct list or paginated object
         if isinstance(result, list):
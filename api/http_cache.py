@@ -0,0 +1,280 @@
+"""
+On-disk HTTP cache for the large Dispatcharr list endpoints
+
+Catalog pulls (streams, channels, logos) download and parse megabytes of JSON
+even when nothing changed. DispatcharrHTTPCache keeps, per page request, the
+parsed payload with its ETag/Last-Modified validators in a local SQLite file:
+the client sends If-None-Match/If-Modified-Since and reuses the cached payload
+on 304 Not Modified.
+
+Dispatcharr doesn't always emit validators. For endpoints without them, whole
+listings are cached with a fingerprint from a cheap change probe (the `count`
+of page 1 and the newest `updated_at`); the listing is reused while the
+fingerprint is unchanged and it is younger than DISPATCHARR_HTTP_CACHE_MAX_AGE_HOURS.
+This only holds if the endpoint honors ordering by updated_at (DRF silently
+ignores ordering fields it doesn't allow), which is checked once per endpoint,
+and the client drops an endpoint's listings whenever it writes to it.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Cache list responses of Dispatcharr on disk and revalidate them
+DISPATCHARR_HTTP_CACHE_ENABLED = os.getenv('DISPATCHARR_HTTP_CACHE_ENABLED', 'true').lower() == 'true'
+
+# HTTP cache database file
+DISPATCHARR_HTTP_CACHE_DB = os.getenv('DISPATCHARR_HTTP_CACHE_DB', 'dispatcharr_cache.db')
+
+# Hours a listing cached by change probe is reused at most (then downloaded again anyway)
+DISPATCHARR_HTTP_CACHE_MAX_AGE_HOURS = float(os.getenv('DISPATCHARR_HTTP_CACHE_MAX_AGE_HOURS', '24'))
+
+# List endpoints whose responses are cached
+CACHEABLE_ENDPOINTS = ('/api/channels/streams/', '/api/channels/channels/', '/api/channels/logos/')
+
+
+def request_key(base_url: str, endpoint: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """Cache key of a GET request"""
+    return f"{base_url}{endpoint}?{json.dumps(params or {}, sort_keys=True, default=str)}"
+
+
+class DispatcharrHTTPCache:
+    """SQLite-backed cache of validated pages and probed listings"""
+
+    def __init__(self, db_file: Optional[str] = None,
+                 max_age_hours: float = DISPATCHARR_HTTP_CACHE_MAX_AGE_HOURS):
+        """
+        Initialize the cache
+
+        Args:
+            db_file: Path to the SQLite database file (default: DISPATCHARR_HTTP_CACHE_DB)
+            max_age_hours: Hours a listing cached by change probe is reused at most
+        """
+        self.db_file = db_file or DISPATCHARR_HTTP_CACHE_DB
+        self.max_age_hours = max_age_hours
+        self._local = threading.local()
+        self._counters = {'revalidated': 0, 'refetched': 0, 'probe_hits': 0, 'probe_misses': 0,
+                          'invalidations': 0}
+        self._counters_lock = threading.Lock()
+        # Endpoint -> whether its responses carry validators (learnt from responses)
+        self._validators: Dict[str, bool] = {}
+        # Endpoint -> whether it honors ordering by updated_at (see check_probe_ordering)
+        self._ordering: Dict[str, bool] = {}
+        # Endpoint -> listing invalidations so far (a download that overlapped one isn't stored)
+        self._generations: Dict[str, int] = {}
+        self._ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the SQLite connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        """Creates the cache tables if they don't exist"""
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS http_responses (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                payload TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS http_listings (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            );
+        """)
+
+    def _count(self, counter: str):
+        with self._counters_lock:
+            self._counters[counter] += 1
+
+    # Validated pages
+
+    def conditional_headers(self, key: str) -> Dict[str, str]:
+        """If-None-Match/If-Modified-Since headers for a cached response (empty if none)"""
+        row = self._connect().execute(
+            'SELECT etag, last_modified FROM http_responses WHERE key = ?', (key,)).fetchone()
+        headers = {}
+        if row is not None:
+            if row['etag']:
+                headers['If-None-Match'] = row['etag']
+            if row['last_modified']:
+                headers['If-Modified-Since'] = row['last_modified']
+        return headers
+
+    def not_modified(self, key: str) -> Optional[Any]:
+        """Cached payload of a response answered with 304 (None if it is gone)"""
+        row = self._connect().execute('SELECT payload FROM http_responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self._count('revalidated')
+        return json.loads(row['payload'])
+
+    def store_response(self, key: str, endpoint: str, headers: Dict[str, str], payload: Any):
+        """Caches a 200 response if it carries validators (and learns whether the endpoint sends them)"""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        self._validators[endpoint] = bool(etag or last_modified)
+        self._count('refetched')
+        if not (etag or last_modified):
+            return
+        self._connect().execute(
+            'INSERT OR REPLACE INTO http_responses (key, etag, last_modified, payload, stored_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, etag, last_modified, json.dumps(payload), time.time()))
+
+    def emits_validators(self, endpoint: str) -> Optional[bool]:
+        """Whether the endpoint's responses carry validators (None until a response was seen)"""
+        return self._validators.get(endpoint)
+
+    # Probed listings
+
+    def cached_listing(self, key: str, fingerprint: str) -> Optional[Any]:
+        """Cached listing if its fingerprint is unchanged and it isn't too old"""
+        row = self._connect().execute(
+            'SELECT fingerprint, payload, stored_at FROM http_listings WHERE key = ?', (key,)).fetchone()
+        if row is None or row['fingerprint'] != fingerprint or \
+                time.time() - row['stored_at'] > self.max_age_hours * 3600:
+            self._count('probe_misses')
+            return None
+        self._count('probe_hits')
+        return json.loads(row['payload'])
+
+    def listing_generation(self, endpoint: str) -> int:
+        """Number of times the endpoint's listings were invalidated (see store_listing)"""
+        with self._counters_lock:
+            return self._generations.get(endpoint, 0)
+
+    def store_listing(self, key: str, endpoint: str, fingerprint: str, payload: Any,
+                      generation: Optional[int] = None):
+        """
+        Caches a whole listing with the fingerprint probed before downloading it
+
+        Args:
+            key: Listing key
+            endpoint: List endpoint
+            fingerprint: Probed fingerprint
+            payload: All items
+            generation: listing_generation() taken before the probe; if the listings
+                were invalidated since (a write during the download), nothing is stored
+        """
+        if generation is not None and generation != self.listing_generation(endpoint):
+            return
+        self._connect().execute(
+            'INSERT OR REPLACE INTO http_listings (key, fingerprint, payload, stored_at) VALUES (?, ?, ?, ?)',
+            (key, fingerprint, json.dumps(payload), time.time()))
+
+    def probe_ordering(self, endpoint: str) -> Optional[bool]:
+        """Whether the endpoint honors ordering by updated_at (None until checked)"""
+        return self._ordering.get(endpoint)
+
+    def set_probe_ordering(self, endpoint: str, honored: bool):
+        """Remembers whether the endpoint honors ordering by updated_at"""
+        self._ordering[endpoint] = honored
+
+    def invalidate_listings(self, base_url: str, endpoint: str) -> int:
+        """
+        Drops the cached listings of an endpoint (e.g. after the client wrote to it)
+
+        Returns:
+            Number of listings dropped
+        """
+        with self._counters_lock:
+            self._generations[endpoint] = self._generations.get(endpoint, 0) + 1
+        prefix = f"{base_url}{endpoint}?"
+        cursor = self._connect().execute(
+            'DELETE FROM http_listings WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+        if cursor.rowcount:
+            self._count('invalidations')
+        return cursor.rowcount
+
+    def clear(self):
+        """Removes all cached responses and listings (and forgets the ordering checks)"""
+        with self._counters_lock:
+            for endpoint in CACHEABLE_ENDPOINTS:
+                self._generations[endpoint] = self._generations.get(endpoint, 0) + 1
+        self._ordering.clear()
+        conn = self._connect()
+        conn.execute('DELETE FROM http_responses')
+        conn.execute('DELETE FROM http_listings')
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and size of the cache"""
+        conn = self._connect()
+        with self._counters_lock:
+            counters = dict(self._counters)
+        counters['responses'] = conn.execute('SELECT COUNT(*) FROM http_responses').fetchone()[0]
+        counters['listings'] = conn.execute('SELECT COUNT(*) FROM http_listings').fetchone()[0]
+        counters['validators'] = dict(self._validators)
+        counters['probe_ordering'] = dict(self._ordering)
+        return counters
+
+
+def listing_fingerprint(probe: Any) -> Optional[str]:
+    """
+    Fingerprint of a list endpoint from its change probe (page 1 ordered by -updated_at)
+
+    Returns:
+        "count|updated_at|id" of the newest item, or None if the probe can't tell
+        changes apart (not paginated, or items without updated_at)
+    """
+    if not isinstance(probe, dict) or 'count' not in probe:
+        return None
+    results = probe.get('results') or []
+    newest: Tuple[Any, Any] = (None, None)
+    if results:
+        if not isinstance(results[0], dict) or 'updated_at' not in results[0]:
+            return None
+        newest = (results[0].get('updated_at'), results[0].get('id'))
+    return f"{probe['count']}|{newest[0]}|{newest[1]}"
+
+
+def _updated_at(page: Any) -> List[Any]:
+    """updated_at of the items of a paginated page"""
+    results = page.get('results') if isinstance(page, dict) else None
+    return [item.get('updated_at') for item in results or [] if isinstance(item, dict)]
+
+
+def check_probe_ordering(descending: Any, ascending: Any) -> bool:
+    """
+    Whether an endpoint honored ordering by updated_at
+
+    Args:
+        descending: Page 1 requested with ordering=-updated_at (at least 2 items per page)
+        ascending: Page 1 requested with ordering=updated_at
+
+    Returns:
+        True if both pages are sorted as requested and start at different ends;
+        False if not, or if the items can't tell (e.g. they all share one updated_at)
+    """
+    newest, oldest = _updated_at(descending), _updated_at(ascending)
+    if len(newest) < 2 or len(oldest) < 2 or None in newest or None in oldest:
+        # A single item can't be out of order
+        return len(newest) == 1 and newest[0] is not None
+    return newest == sorted(newest, reverse=True) and oldest == sorted(oldest) and oldest[0] < newest[0]
+
+
+_cache_lock = threading.Lock()
+_cache: Optional[DispatcharrHTTPCache] = None
+
+
+def get_http_cache() -> Optional[DispatcharrHTTPCache]:
+    """HTTP cache shared by the process (None if DISPATCHARR_HTTP_CACHE_ENABLED is false)"""
+    global _cache
+    if not DISPATCHARR_HTTP_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = DispatcharrHTTPCache()
+        return _cache
@@ -0,0 +1,128 @@
+"""
+Reference data cache of the Dispatcharr client
+
+M3U accounts, channel profiles, channel groups and logos change rarely but
+are read all the time: per preview, per sorting rule, per profile name of an
+execution and on every page load. ReferenceCache keeps each of these lists for
+a per-resource TTL, indexed by ID and by name, so lookups such as
+profile-by-name or account-by-ID are dictionary hits. Writes that change a
+resource invalidate it (see DispatcharrClient.invalidate_reference_data), and
+hits/misses are counted per resource.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+# Seconds each resource is cached (0 = not cached)
+REFERENCE_TTLS = {
+    'm3u_accounts': float(os.getenv('REFERENCE_TTL_M3U_ACCOUNTS', '60')),
+    'profiles': float(os.getenv('REFERENCE_TTL_PROFILES', '300')),
+    'channel_groups': float(os.getenv('REFERENCE_TTL_CHANNEL_GROUPS', '300')),
+    'logos': float(os.getenv('REFERENCE_TTL_LOGOS', '900'))
+}
+
+
+@dataclass
+class ReferenceEntry:
+    """Cached list of one resource with its indexes"""
+    items: List[Dict[str, Any]]
+    loaded_at: float
+    by_id: Dict[Any, Dict[str, Any]] = field(default_factory=dict)
+    by_name: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, items: List[Dict[str, Any]]) -> 'ReferenceEntry':
+        entry = cls(items=items, loaded_at=time.time())
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            if item.get('id') is not None:
+                entry.by_id[item['id']] = item
+            # The first item with a name wins, like the lookups this replaces
+            if item.get('name') and item['name'] not in entry.by_name:
+                entry.by_name[item['name']] = item
+        return entry
+
+
+class ReferenceCache:
+    """Per-resource TTL cache of reference lists (thread-safe)"""
+
+    def __init__(self, ttls: Optional[Dict[str, float]] = None):
+        """
+        Initialize an empty cache
+
+        Args:
+            ttls: Seconds each resource is cached (default REFERENCE_TTLS)
+        """
+        self.ttls = dict(REFERENCE_TTLS if ttls is None else ttls)
+        self._entries: Dict[str, ReferenceEntry] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def _count(self, resource: str, counter: str):
+        with self._lock:
+            counters = self._counters.setdefault(resource, {'hits': 0, 'misses': 0, 'invalidations': 0})
+            counters[counter] += 1
+
+    def _fresh_entry(self, resource: str) -> Optional[ReferenceEntry]:
+        with self._lock:
+            entry = self._entries.get(resource)
+        if entry is not None and time.time() - entry.loaded_at < self.ttls.get(resource, 0):
+            return entry
+        return None
+
+    def get(self, resource: str, loader: Callable[[], List[Dict[str, Any]]], fresh: bool = False) -> ReferenceEntry:
+        """
+        Gets a resource, loading it if it isn't cached or has expired
+
+        Concurrent misses of a resource wait for one load.
+
+        Args:
+            resource: Resource name (a key of the TTLs)
+            loader: Loads the list from Dispatcharr
+            fresh: Load it even if it is cached (the result is cached)
+        """
+        entry = None if fresh else self._fresh_entry(resource)
+        if entry is not None:
+            self._count(resource, 'hits')
+            return entry
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(resource, threading.Lock())
+        with load_lock:
+            # Loaded by another thread while this one waited
+            entry = None if fresh else self._fresh_entry(resource)
+            if entry is not None:
+                self._count(resource, 'hits')
+                return entry
+            self._count(resource, 'misses')
+            entry = ReferenceEntry.build(loader())
+            with self._lock:
+                self._entries[resource] = entry
+            return entry
+
+    def invalidate(self, resource: Optional[str] = None):
+        """Forgets a resource (all resources if None), so it is loaded again on next use"""
+        with self._lock:
+            resources = list(self._entries) if resource is None else [resource]
+            for name in resources:
+                if self._entries.pop(name, None) is not None:
+                    counters = self._counters.setdefault(name, {'hits': 0, 'misses': 0, 'invalidations': 0})
+                    counters['invalidations'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """TTL, size, age and counters of each resource"""
+        now = time.time()
+        with self._lock:
+            return {
+                resource: {
+                    'ttl': ttl,
+                    'items': len(self._entries[resource].items) if resource in self._entries else None,
+                    'age_seconds': round(now - self._entries[resource].loaded_at, 1) if resource in self._entries else None,
+                    **self._counters.get(resource, {'hits': 0, 'misses': 0, 'invalidations': 0})
+                }
+                for resource, ttl in self.ttls.items()
+            }
@@ -0,0 +1,94 @@
+"""
+Request coalescing (single-flight) for the Dispatcharr client
+
+Browser tabs, SSE background threads and executions often ask Dispatcharr for
+the same data at the same moment (e.g. all streams). With SingleFlight, the
+first caller of a key runs the request and concurrent callers of the same key
+wait for it and share its parsed result instead of starting their own
+download. Each caller gets its own deep copy of a shared result, since callers
+modify what they get (e.g. stats applied to streams).
+"""
+import copy
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class _Call:
+    """A request in flight and the callers waiting for it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Shares in-flight calls between concurrent callers of the same key (thread-safe)"""
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._coalesced_by_label: Dict[str, int] = {}
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any], label: Optional[str] = None) -> Any:
+        """
+        Runs fn, or waits for the call of the same key already in flight
+
+        Args:
+            key: Identity of the call (e.g. endpoint and params)
+            fn: Runs the call
+            label: Name the coalesced call is counted under (e.g. the endpoint)
+
+        Returns:
+            The result of fn (a private copy when it was shared)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.followers += 1
+                self.coalesced += 1
+                if label:
+                    self._coalesced_by_label[label] = self._coalesced_by_label.get(label, 0) + 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None and not isinstance(call.error, Exception):
+                # The leader was interrupted (e.g. its job was cancelled): not this caller's error
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.error = e
+            call.done.set()
+            raise
+
+        with self._lock:
+            # No caller can join anymore; followers copy the pristine result
+            self._calls.pop(key, None)
+            shared = call.followers > 0
+        call.result = result
+        call.done.set()
+        return copy.deepcopy(result) if shared else result
+
+    def stats(self) -> Dict[str, Any]:
+        """Coalescing counters"""
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls),
+                'coalesced_by_endpoint': dict(self._coalesced_by_label)
+            }
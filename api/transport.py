@@ -0,0 +1,229 @@
+"""
+HTTP transport of the Dispatcharr client
+
+All Dispatcharr API calls go through one DispatcharrTransport, which adds what
+a bare requests.Session lacks:
+
+- connect/read timeouts, so a hung call can't block an execution thread forever
+- a connection pool sized for the configured concurrency (job executions times
+  their parallel stats writes) instead of requests' default of 10
+- retries with jittered exponential backoff on connection errors, timeouts and
+  5xx/429 answers; only idempotent methods are retried after the request may
+  have reached the server (POST/PATCH only when the connection couldn't be made)
+- client-side token-bucket rate limits, global and per endpoint prefix, so
+  parallel fetches don't overload Dispatcharr
+"""
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Seconds to wait for the connection to Dispatcharr
+DISPATCHARR_CONNECT_TIMEOUT = float(os.getenv('DISPATCHARR_CONNECT_TIMEOUT', '5'))
+
+# Seconds to wait for Dispatcharr to answer once connected
+DISPATCHARR_READ_TIMEOUT = float(os.getenv('DISPATCHARR_READ_TIMEOUT', '60'))
+
+# Connections kept to Dispatcharr (0 = sized from JOB_MAX_CONCURRENT and STATS_WRITE_CONCURRENCY)
+DISPATCHARR_POOL_SIZE = int(os.getenv('DISPATCHARR_POOL_SIZE', '0'))
+
+# Retries of a failed request (connection errors, timeouts, 5xx and 429 answers)
+DISPATCHARR_MAX_RETRIES = int(os.getenv('DISPATCHARR_MAX_RETRIES', '3'))
+
+# Base delay in seconds of the exponential backoff between retries (jittered, capped at RETRY_MAX_DELAY)
+DISPATCHARR_RETRY_BACKOFF = float(os.getenv('DISPATCHARR_RETRY_BACKOFF', '0.5'))
+
+# Requests per second sent to Dispatcharr (0 = unlimited), with bursts of DISPATCHARR_RATE_BURST
+DISPATCHARR_RATE_LIMIT = float(os.getenv('DISPATCHARR_RATE_LIMIT', '20'))
+DISPATCHARR_RATE_BURST = int(os.getenv('DISPATCHARR_RATE_BURST', '20'))
+
+# Requests per second of endpoint prefixes, e.g. "/api/channels/streams/=5,/api/m3u/=1"
+# (the longest matching prefix applies, on top of DISPATCHARR_RATE_LIMIT)
+DISPATCHARR_ENDPOINT_RATE_LIMITS = os.getenv('DISPATCHARR_ENDPOINT_RATE_LIMITS', '')
+
+# Longest delay in seconds between retries (also caps Retry-After)
+RETRY_MAX_DELAY = 10.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+def default_pool_size() -> int:
+    """Connections needed by the configured concurrency (at least requests' default of 10)"""
+    executions = int(os.getenv('JOB_MAX_CONCURRENT', '2'))
+    stats_writers = int(os.getenv('STATS_WRITE_CONCURRENCY', '4'))
+    # Each execution runs its own requests plus its parallel stats writes; + the web requests
+    return max(10, executions * (stats_writers + 1) + 4)
+
+
+def parse_endpoint_limits(value: str) -> List[Tuple[str, float]]:
+    """
+    Parses "prefix=rate,prefix=rate" endpoint limits
+
+    Returns:
+        (prefix, requests per second) pairs, longest prefix first
+    """
+    limits = []
+    for item in value.split(','):
+        prefix, separator, rate = item.strip().rpartition('=')
+        if not separator or not prefix:
+            continue
+        try:
+            limits.append((prefix.strip(), float(rate)))
+        except ValueError:
+            print(f"⚠️  Ignoring invalid endpoint rate limit '{item.strip()}'")
+    return sorted(limits, key=lambda limit: len(limit[0]), reverse=True)
+
+
+class TokenBucket:
+    """Token-bucket rate limiter (thread-safe)"""
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Initialize a full bucket
+
+        Args:
+            rate: Tokens added per second
+            burst: Capacity of the bucket
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting until one is available
+
+        Returns:
+            Seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class DispatcharrTransport:
+    """Session, timeouts, retries and rate limits of the Dispatcharr API calls"""
+
+    def __init__(self, pool_size: int = DISPATCHARR_POOL_SIZE,
+                 timeout: Tuple[float, float] = (DISPATCHARR_CONNECT_TIMEOUT, DISPATCHARR_READ_TIMEOUT),
+                 max_retries: int = DISPATCHARR_MAX_RETRIES, backoff: float = DISPATCHARR_RETRY_BACKOFF,
+                 rate_limit: float = DISPATCHARR_RATE_LIMIT, rate_burst: int = DISPATCHARR_RATE_BURST,
+                 endpoint_limits: str = DISPATCHARR_ENDPOINT_RATE_LIMITS):
+        """
+        Initialize the transport
+
+        Args:
+            pool_size: Connections kept to Dispatcharr (0 = default_pool_size())
+            timeout: (connect, read) timeouts in seconds
+            max_retries: Retries of a failed request
+            backoff: Base delay in seconds of the exponential backoff
+            rate_limit: Requests per second (0 = unlimited)
+            rate_burst: Requests that can be sent at once before the rate limit applies
+            endpoint_limits: Per endpoint prefix limits (see parse_endpoint_limits)
+        """
+        self.pool_size = pool_size or default_pool_size()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._bucket = TokenBucket(rate_limit, rate_burst) if rate_limit > 0 else None
+        self._endpoint_buckets = [(prefix, TokenBucket(rate, max(1, int(rate))))
+                                  for prefix, rate in parse_endpoint_limits(endpoint_limits) if rate > 0]
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _throttle(self, url: str):
+        """Waits for the global and the endpoint rate limit"""
+        waited = self._bucket.acquire() if self._bucket else 0.0
+        path = urlparse(url).path
+        for prefix, bucket in self._endpoint_buckets:
+            if path.startswith(prefix):
+                waited += bucket.acquire()
+                break
+        if waited:
+            with self._stats_lock:
+                self.throttled_seconds += waited
+
+    def _delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        """Seconds to wait before a retry: Retry-After if given, else jittered exponential backoff"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(RETRY_MAX_DELAY, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return random.uniform(0, min(RETRY_MAX_DELAY, self.backoff * (2 ** attempt)))
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """
+        Sends a request, retrying and rate limiting it
+
+        Takes the arguments of requests.Session.request; the timeout defaults to
+        the transport's. A response with a retryable status is returned as is
+        once the retries are exhausted.
+
+        Raises:
+            requests.RequestException: If the request failed after all retries
+        """
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            self._throttle(url)
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A connect timeout means the request never reached the server
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, requests.ConnectTimeout)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                reason, response = type(e).__name__, None
+            else:
+                if response.status_code not in RETRY_STATUSES or method not in IDEMPOTENT_METHODS \
+                        or attempt >= self.max_retries:
+                    return response
+                reason = f'HTTP {response.status_code}'
+
+            delay = self._delay(attempt, response)
+            attempt += 1
+            with self._stats_lock:
+                self.retries += 1
+            print(f"⚠️  Dispatcharr {method} {urlparse(url).path} failed ({reason}), "
+                  f"retrying in {delay:.1f}s ({attempt}/{self.max_retries})")
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+
+    def status(self) -> Dict[str, Any]:
+        """Configuration and counters of the transport"""
+        with self._stats_lock:
+            return {
+                'pool_size': self.pool_size,
+                'timeout': {'connect': self.timeout[0], 'read': self.timeout[1]},
+                'max_retries': self.max_retries,
+                'rate_limit': self._bucket.rate if self._bucket else None,
+                'endpoint_limits': {prefix: bucket.rate for prefix, bucket in self._endpoint_buckets},
+                'retries': self.retries,
+                'throttled_seconds': round(self.throttled_seconds, 2)
+            }
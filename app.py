@@ -2,11 +2,22 @@ from flask import Flask, render_template, request, jsonify, redirect, url_for, f
 import os
 import json
 import time
-from queue import Queue
-from threading import Thread
 from dotenv import load_dotenv
 from flask_cors import CORS
 from api.dispatcharr_client import DispatcharrClient
+from execution_store import ExecutionStore, MAIN_CHANNEL, VERBOSE_CHANNEL
+from jobs import JobManager
+from checkpoints import TestCheckpoint, assignment_checkpoint_scope
+from m3u_refresh import update_m3u_refresh_time
+from stats_refresher import StatsRefresher, STATS_REFRESH_ENABLED
+from stream_test_planner import TestBudget, TestPlan, DEFERRED_IDS_LIMIT
+from circuit_breaker import provider_breakers
+from tool_supervisor import tool_supervisor
+from profile_sync import ProfileSync
+from toolchain import get_toolchain, log_toolchain
+from stats_buffer import StatsWriteBuffer
+from test_registry import StreamTestRegistry
+from stream_health import get_health_store
 from models import RulesManager, AutoAssignmentRule, StreamMatcher, generate_channel_name_regex
 from stream_sorter_models import (
     SortingRulesManager,
@@ -25,9 +36,6 @@ APP_VERSION = "v.0.3.3"
 # Execution state file
 EXECUTION_STATE_FILE = 'execution_state.json'
 
-# M3U refresh state file
-M3U_REFRESH_STATE_FILE = 'm3u_refresh_state.json'
-
 def load_execution_state():
     """Load execution state from file"""
     if os.path.exists(EXECUTION_STATE_FILE):
@@ -49,33 +57,6 @@ def save_execution_state(state):
     except Exception as e:
         print(f"Error saving execution state: {e}")
 
-def load_m3u_refresh_state():
-    """Load M3U refresh state from file"""
-    if os.path.exists(M3U_REFRESH_STATE_FILE):
-        try:
-            with open(M3U_REFRESH_STATE_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            pass
-    return {"last_refresh": None}
-
-def save_m3u_refresh_state(state):
-    """Save M3U refresh state to file"""
-    try:
-        with open(M3U_REFRESH_STATE_FILE, 'w') as f:
-            json.dump(state, f, indent=2)
-    except Exception as e:
-        print(f"Error saving M3U refresh state: {e}")
-
-def update_m3u_refresh_time():
-    """Update the last M3U refresh timestamp"""
-    state = load_m3u_refresh_state()
-    from datetime import datetime, timezone
-    # Always save in UTC
-    utc_now = datetime.now(timezone.utc)
-    state["last_refresh"] = utc_now.isoformat().replace('+00:00', 'Z')
-    save_m3u_refresh_state(state)
-
 def update_execution_timestamp(feature):
     """Update the last execution timestamp for a feature"""
     state = load_execution_state()
@@ -117,8 +98,138 @@ sorting_rules_manager = SortingRulesManager()
 # Initialize channel groups manager
 channel_groups_manager = ChannelGroupsManager(dispatcharr_client)
 
-# Dictionary to store progress queues for active executions
-execution_queues = {}
+# Shared store for execution progress (readable from every worker process)
+execution_store = ExecutionStore()
+
+# Seconds between polls of the execution store while streaming SSE progress
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', '0.5'))
+
+# Seconds without events before a keepalive is sent to SSE clients
+SSE_KEEPALIVE_INTERVAL = 30
+
+
+# Persistent job queue running rule executions (handlers registered below)
+job_manager = JobManager(execution_store)
+
+# Background stream-stats refresher (started below when STATS_REFRESH_ENABLED=true)
+stats_refresher = StatsRefresher(dispatcharr_client, execution_store, rules_manager, sorting_rules_manager)
+
+
+def parse_test_budget(data):
+    """
+    Reads the optional test budget of an execution request
+
+    Args:
+        data: Request JSON with optional 'time_budget' (seconds) and 'max_tests'
+
+    Returns:
+        Tuple (time_budget, max_tests) with the environment defaults applied (None = unlimited)
+
+    Raises:
+        ValueError: If a value is invalid
+    """
+    budget = TestBudget.from_values(data.get('time_budget'), data.get('max_tests'))
+    return budget.time_budget, budget.max_tests
+
+
+def flush_stats_buffer(stats_buffer, queue):
+    """
+    Writes the stream stats buffered by a test phase to Dispatcharr
+
+    Args:
+        stats_buffer: StatsWriteBuffer of the execution
+        queue: Progress queue of the execution (failures are reported to it)
+    """
+    errors = stats_buffer.flush()
+    if errors:
+        queue.put({
+            'type': 'info',
+            'message': f'⚠️ Could not save the stats of {len(errors)} stream(s) to Dispatcharr'
+        })
+
+
+def is_reloader_parent_process():
+    """Whether this is the file-watching parent of the development reloader (it never serves requests)"""
+    debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
+    development = os.getenv('SERVER_MODE', 'development').lower() == 'development'
+    return debug and development and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+
+def execution_event_stream(execution_id):
+    """
+    Build the SSE response for an execution from the shared store
+
+    Events carry their store ID as the SSE `id`, so clients can resume with the
+    `Last-Event-ID` header (or `last_event_id` query parameter) after a reconnect.
+    Any number of clients can follow the same execution. Per-stream test events
+    are only sent when the client opts in with `verbose=1`; otherwise clients
+    get milestones, failures and aggregated `progress` events.
+
+    Returns:
+        Flask response streaming the execution events, or an error response
+        if the execution is unknown or has expired
+    """
+    if not execution_id or not execution_store.get_execution(execution_id):
+        return jsonify({'error': 'Invalid or expired execution ID'}), 400
+
+    resume_from = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(resume_from) if resume_from else 0
+    except ValueError:
+        last_event_id = 0
+
+    if request.args.get('verbose', '').lower() in ('1', 'true'):
+        channels = (MAIN_CHANNEL, VERBOSE_CHANNEL)
+    else:
+        channels = (MAIN_CHANNEL,)
+
+    def generate():
+        nonlocal last_event_id
+        last_sent = time.time()
+
+        # Ask EventSource to retry quickly so resumes don't miss much
+        yield "retry: 3000\n\n"
+
+        if last_event_id:
+            # IDs are shared by all channels: only events trimmed after the client's last one were lost
+            dropped_through = execution_store.get_dropped_through(execution_id, channels)
+            if dropped_through and dropped_through > last_event_id:
+                notice = {'type': 'info', 'message': 'Some earlier progress events are no longer available'}
+                yield f"data: {json.dumps(notice)}\n\n"
+
+        while True:
+            events = execution_store.get_events(execution_id, after_id=last_event_id, channels=channels)
+
+            for event_id, message in events:
+                last_event_id = event_id
+                last_sent = time.time()
+                yield f"id: {event_id}\ndata: {json.dumps(message)}\n\n"
+
+            if events:
+                continue
+
+            execution = execution_store.get_execution(execution_id)
+            if not execution or execution['status'] != 'running':
+                # Execution finished and every event has been delivered; tell the
+                # client so EventSource doesn't reconnect
+                status = execution['status'] if execution else 'expired'
+                yield f"data: {json.dumps({'type': 'end', 'status': status})}\n\n"
+                break
+
+            if time.time() - last_sent >= SSE_KEEPALIVE_INTERVAL:
+                last_sent = time.time()
+                yield f"data: {json.dumps({'type': 'keepalive'})}\n\n"
+
+            time.sleep(SSE_POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 @app.route('/')
 def index():
@@ -340,6 +451,21 @@ def api_get_stream(stream_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/streams/<stream_id>/health', methods=['GET'])
+def api_get_stream_health(stream_id):
+    """API endpoint to get the test history and health figures of a stream"""
+    try:
+        store = get_health_store()
+        if store is None:
+            return jsonify({'error': 'Stream health store is disabled (STREAM_HEALTH_ENABLED=false)'}), 404
+        stream_id = int(stream_id)
+        days = request.args.get('days', type=int)
+        history = store.history(stream_id, days)
+        history['health'] = store.health([stream_id]).get(stream_id)
+        return jsonify(history)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/streams/<stream_id>', methods=['PUT'])
 def api_update_stream(stream_id):
     """API endpoint to update a stream"""
@@ -439,6 +565,10 @@ def api_auto_assign_rules():
                 m3u_account_ids=data.get('m3u_account_ids'),
                 video_bitrate_operator=data.get('bitrate_operator'),
                 video_bitrate_value=int(data['bitrate_value']) if data.get('bitrate_value') else None,
+                first_keyframe_operator=data.get('first_keyframe_operator'),
+                first_keyframe_value=float(data['first_keyframe_value']) if data.get('first_keyframe_value') not in (None, '') else None,
+                stall_count_operator=data.get('stall_count_operator'),
+                stall_count_value=int(data['stall_count_value']) if data.get('stall_count_value') not in (None, '') else None,
                 video_codec=data.get('video_codec'),
                 video_resolution=data.get('video_resolution'),
                 video_fps=int(data['video_fps']) if data.get('video_fps') else None,
@@ -449,6 +579,7 @@ def api_auto_assign_rules():
                 test_streams_before_sorting=data.get('test_streams_before_sorting', False),
                 force_retest_old_streams=data.get('force_retest_old_streams', False),
                 retest_days_threshold=int(data.get('retest_days_threshold', 7)),
+                probe_mode=data.get('probe_mode', 'auto'),
                 force_include_stream_ids=data.get('force_include_stream_ids', []),
                 force_exclude_stream_ids=data.get('force_exclude_stream_ids', [])
             )
@@ -510,6 +641,10 @@ def api_auto_assign_rule(rule_id):
                 m3u_account_ids=data.get('m3u_account_ids'),
                 video_bitrate_operator=data.get('bitrate_operator'),
                 video_bitrate_value=int(data['bitrate_value']) if data.get('bitrate_value') else None,
+                first_keyframe_operator=data.get('first_keyframe_operator'),
+                first_keyframe_value=float(data['first_keyframe_value']) if data.get('first_keyframe_value') not in (None, '') else None,
+                stall_count_operator=data.get('stall_count_operator'),
+                stall_count_value=int(data['stall_count_value']) if data.get('stall_count_value') not in (None, '') else None,
                 video_codec=data.get('video_codec'),
                 video_resolution=data.get('video_resolution'),
                 video_fps=int(data['video_fps']) if data.get('video_fps') else None,
@@ -520,6 +655,7 @@ def api_auto_assign_rule(rule_id):
                 test_streams_before_sorting=data.get('test_streams_before_sorting', False),
                 force_retest_old_streams=data.get('force_retest_old_streams', False),
                 retest_days_threshold=int(data.get('retest_days_threshold', 7)),
+                probe_mode=data.get('probe_mode', 'auto'),
                 force_include_stream_ids=data.get('force_include_stream_ids', []),
                 force_exclude_stream_ids=data.get('force_exclude_stream_ids', [])
             )
@@ -614,20 +750,15 @@ def api_execute_rule(rule_id):
         
         # If streaming requested and rule requires testing, use background execution
         if use_stream and rule.test_streams_before_sorting:
-            import uuid
-            execution_id = str(uuid.uuid4())
-            
-            # Create queue for this execution
-            queue = Queue()
-            execution_queues[execution_id] = queue
+            try:
+                time_budget, max_tests = parse_test_budget(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            # Start background thread
-            thread = Thread(
-                target=execute_auto_assignment_in_background,
-                args=(rule_id, queue)
+            # Queue the execution as a job (progress goes to the shared store)
+            execution_id = job_manager.submit(
+                'auto_assignment', (rule_id, bool(data.get('resume', False)), time_budget, max_tests)
             )
-            thread.daemon = True
-            thread.start()
             
             return jsonify({
                 'success': True,
@@ -660,34 +791,20 @@ def api_execute_rule(rule_id):
                 print(f"Error adding stream {stream['id']}: {str(e)}")
         
         # If no streams were added, disable channel in profiles based on rule configuration
+        # (the named profiles, or all profiles if none; one bulk update per profile)
         if added_count == 0:
-            if rule.disable_profiles:
-                # Disable in specific profiles
-                for profile_name in rule.disable_profiles:
-                    try:
-                        # Get profile ID by name
-                        profiles = dispatcharr_client.get_profiles()
-                        profile_id = None
-                        for profile in profiles:
-                            if profile.get('name') == profile_name:
-                                profile_id = profile.get('id')
-                                break
-                        
-                        if profile_id:
-                            dispatcharr_client.update_channel_profile_status(profile_id, rule.channel_id, False)
-                        else:
-                            print(f'Profile "{profile_name}" not found')
-                    except Exception as e:
-                        print(f'Error disabling channel in profile "{profile_name}": {str(e)}')
-            else:
-                # No specific profiles selected, disable in ALL profiles
-                try:
-                    profiles = dispatcharr_client.get_profiles()
-                    for profile in profiles:
-                        dispatcharr_client.update_channel_profile_status(profile['id'], rule.channel_id, False)
-                    print(f'Channel {rule.channel_id} disabled in all {len(profiles)} profiles (no streams matched)')
-                except Exception as e:
-                    print(f'Error disabling channel in all profiles: {str(e)}')
+            try:
+                profile_sync = ProfileSync(dispatcharr_client)
+                profiles, missing_profiles = profile_sync.set(rule.channel_id, False,
+                                                              names=rule.disable_profiles or None)
+                for profile_name in missing_profiles:
+                    print(f'Profile "{profile_name}" not found')
+                summary = profile_sync.flush()
+                for error_msg in summary['errors']:
+                    print(error_msg)
+                print(f'Channel {rule.channel_id} disabled in {len(profiles)} profile(s) (no streams matched)')
+            except Exception as e:
+                print(f'Error disabling channel in profiles: {str(e)}')
         
         return jsonify({
             'message': 'Rule executed successfully',
@@ -699,49 +816,65 @@ def api_execute_rule(rule_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/auto-assign-rules/<int:rule_id>/checkpoint', methods=['GET', 'DELETE'])
+def api_rule_checkpoint(rule_id):
+    """API endpoint to inspect or discard the checkpoint of an interrupted rule execution"""
+    try:
+        checkpoint = TestCheckpoint.load(assignment_checkpoint_scope(rule_id))
+        if not checkpoint:
+            return jsonify({'checkpoint': None})
+        
+        if request.method == 'DELETE':
+            checkpoint.discard()
+            return jsonify({'success': True})
+        
+        return jsonify({'checkpoint': checkpoint.summary()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/auto-assign-rules/<int:rule_id>/execute-stream')
 def execute_auto_assignment_stream(rule_id):
     """SSE endpoint to stream auto-assignment execution progress"""
     execution_id = request.args.get('execution_id')
-    
-    if not execution_id or execution_id not in execution_queues:
-        return jsonify({'error': 'Invalid execution ID'}), 400
-    
-    def generate():
-        queue = execution_queues[execution_id]
-        
-        try:
-            while True:
-                # Get message from queue (block for max 30 seconds)
-                try:
-                    message = queue.get(timeout=30)
-                    
-                    if message is None:  # Signal to stop
-                        break
-                    
-                    # Send SSE message
-                    yield f"data: {json.dumps(message)}\n\n"
-                    
-                except Exception as e:
-                    # Timeout or error, send keepalive
-                    yield f"data: {json.dumps({'type': 'keepalive'})}\n\n"
-        finally:
-            # Clean up queue when client disconnects
-            if execution_id in execution_queues:
-                del execution_queues[execution_id]
-    
-    return Response(
-        stream_with_context(generate()),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no'
-        }
-    )
+    return execution_event_stream(execution_id)
 
 
-def execute_auto_assignment_in_background(rule_id, queue):
-    """Execute auto-assignment rule in background thread and send progress updates"""
+def send_profile_sync_events(summary, errors, queue):
+    """Sends a progress event per profile updated by ProfileSync.flush()"""
+    for result in summary['profiles']:
+        profile_name = result['profile_name']
+        if result['enabled']:
+            queue.put({
+                'type': 'profile_enabled',
+                'profile_name': profile_name,
+                'message': f'✓ Enabled channel in profile: {profile_name}'
+            })
+        if result['disabled']:
+            queue.put({
+                'type': 'profile_disabled',
+                'profile_name': profile_name,
+                'message': f'✓ Disabled channel in profile: {profile_name}'
+            })
+        if result['unchanged']:
+            queue.put({
+                'type': 'info',
+                'message': f'Channel already in the desired state in profile: {profile_name}'
+            })
+    for error_msg in summary['errors']:
+        errors.append(error_msg)
+        queue.put({'type': 'error', 'message': error_msg})
+
+
+def execute_auto_assignment_in_background(rule_id, resume, time_budget, max_tests, queue):
+    """
+    Execute auto-assignment rule in background thread and send progress updates
+
+    With resume, streams already tested by an interrupted run (see checkpoints.py)
+    are not tested again. With a time budget or max tests, the streams that don't
+    fit are deferred (see stream_test_planner.py) and kept in the checkpoint.
+    """
+    budget = TestBudget(time_budget, max_tests)
+    test_plan = None
     try:
         # Get the rule
         rule = rules_manager.get_rule(rule_id)
@@ -873,22 +1006,15 @@ def execute_auto_assignment_in_background(rule_id, queue):
                 # Check profile disabling logic here when no streams match
                 # When no streams match, disable channel in ALL profiles
                 try:
-                    profiles = dispatcharr_client.get_profiles()
+                    profile_sync = ProfileSync(dispatcharr_client)
+                    profiles, _ = profile_sync.set(rule.channel_id, False)
                     
                     queue.put({
                         'type': 'disabling',
                         'message': f'No streams matched. Disabling channel in all {len(profiles)} profile(s): {", ".join(["{}:{}".format(p.get("id", "?"), p.get("name", "?")) for p in profiles])}'
                     })
                     
-                    for profile in profiles:
-                        profile_name = profile.get('name', f'Profile {profile["id"]}')
-                        
-                        dispatcharr_client.update_channel_profile_status(profile['id'], rule.channel_id, False)
-                        queue.put({
-                            'type': 'profile_disabled',
-                            'profile_name': profile_name,
-                            'message': f'✓ Disabled channel in profile: {profile_name}'
-                        })
+                    send_profile_sync_events(profile_sync.flush(), errors, queue)
                 except Exception as e:
                     error_msg = f'Error disabling channel in all profiles: {str(e)}'
                     errors.append(error_msg)
@@ -898,6 +1024,8 @@ def execute_auto_assignment_in_background(rule_id, queue):
                 queue.put(None)
                 return
             
+            failed_test_stream_ids = set()  # Track streams that failed testing
+            
             # Test streams if needed (only the pre-filtered ones)
             if rule.test_streams_before_sorting:
                 from datetime import datetime, timedelta, timezone
@@ -928,113 +1056,155 @@ def execute_auto_assignment_in_background(rule_id, queue):
                     # Force retest ALL pre-filtered streams (even with recent stats)
                     streams_to_test = pre_filtered_streams
                 
+                # Checkpoint the test phase so an interrupted run can be resumed
+                scope = assignment_checkpoint_scope(rule.id)
+                checkpoint = TestCheckpoint.load(scope) if resume else None
+                if checkpoint:
+                    failed_test_stream_ids.update(checkpoint.failed_ids())
+                    already_tested = [s for s in streams_to_test if checkpoint.is_completed(s['id'])]
+                    streams_to_test = [s for s in streams_to_test if not checkpoint.is_completed(s['id'])]
+                    skipped_count += len(already_tested)
+                    queue.put({
+                        'type': 'info',
+                        'message': f'↩️ Resuming previous run: {len(already_tested)} stream(s) already tested'
+                    })
+                else:
+                    checkpoint = TestCheckpoint.start(scope, [s['id'] for s in streams_to_test])
+                
+                # Test results update the streams in place and are written in batches;
+                # each URL is tested once and its result applied to all streams sharing it
+                stats_buffer = StatsWriteBuffer(dispatcharr_client)
+                test_registry = StreamTestRegistry(dispatcharr_client, stats_buffer, streams)
+                
+                # Test in order of value while the budget allows (streams matching with
+                # their current stats first among streams of similar age)
+                def record_reused(stream, result):
+                    """Checkpoints a stream that got the result of a URL already tested in this run"""
+                    success = bool(result.get('success') and not result.get('save_error'))
+                    if not success:
+                        failed_test_stream_ids.add(stream['id'])
+                    checkpoint.record(stream['id'], success, result.get('save_error', result.get('message')),
+                                      save=False)
+                
+                test_plan = TestPlan(
+                    streams_to_test, budget,
+                    lambda s: 1.0 if StreamMatcher._stream_matches_rule(rule, s) else 0.0,
+                    registry=test_registry, on_reuse=record_reused
+                )
+                streams_to_test = test_plan.streams
+                budget_note = ''
+                if budget.limited:
+                    limits = []
+                    if budget.time_budget:
+                        limits.append(f'{budget.time_budget:.0f}s')
+                    if budget.max_tests:
+                        limits.append(f'{budget.max_tests} tests')
+                    budget_note = f' (budget: {", ".join(limits)})'
                 queue.put({
                     'type': 'test_start',
                     'total_streams': len(streams_to_test),
-                    'message': f'Testing {len(streams_to_test)} stream(s) that passed basic filtering...'
+                    'message': f'Testing {len(streams_to_test)} stream(s) that passed basic filtering{budget_note}...'
                 })
                 
-                # Test streams
-                for stream_idx, stream in enumerate(streams_to_test, 1):
-                    stream_id = stream['id']
-                    stream_name = stream.get('name', f'Stream {stream_id}')
-                    
-                    try:
-                        # Send message BEFORE testing starts
-                        queue.put({
-                            'type': 'info',
-                            'message': f'Testing stream {stream_idx}/{len(streams_to_test)}: {stream_name}...'
-                        })
-                        
-                        result = dispatcharr_client.test_stream(stream_id)
-                        
-                        # Send progress update AFTER test completes
-                        queue.put({
-                            'type': 'test_progress',
-                            'stream_id': stream_id,
-                            'stream_name': stream_name,
-                            'current': stream_idx,
-                            'total': len(streams_to_test),
-                            'message': f'Completed {stream_idx}/{len(streams_to_test)} tests'
-                        })
-                        
-                        if result.get('success') and not result.get('save_error'):
-                            tested_count += 1
-                        
-                        # Add delay between tests to avoid provider detection (except for the last test)
-                        if stream_idx < len(streams_to_test):
-                            test_delay = int(os.getenv('STREAM_TEST_DELAY', '3'))
-                            if test_delay > 0:
-                                time.sleep(test_delay)
-                        
-                        # Get stream stats for display
-                        stats = result.get('statistics', {})
-                        stats_message = ""
-                        if stats:
-                            bitrate = stats.get('ffmpeg_output_bitrate')
-                            resolution = stats.get('resolution', 'Unknown')
-                            codec = stats.get('video_codec', 'Unknown')
-                            if bitrate:
-                                stats_message = f" ({resolution}, {codec}, {bitrate:.0f}kbps)"
+                # Test streams; results are saved in the checkpoint once their stats have been written
+                stats_buffer.add_flush_listener(checkpoint.commit)
+                try:
+                    for stream_idx, stream in enumerate(test_plan, 1):
+                        stream_id = stream['id']
+                        stream_name = stream.get('name', f'Stream {stream_id}')
                         
-                        if result.get('success') and not result.get('save_error'):
+                        try:
+                            # Send message BEFORE testing starts
                             queue.put({
-                                'type': 'test_success',
+                                'type': 'info',
+                                'verbose': True,
+                                'message': f'Testing stream {stream_idx}/{len(streams_to_test)}: {stream_name}...'
+                            })
+                            
+                            result = test_registry.test(stream_id, stream, probe_mode=rule.probe_mode)
+                            checkpoint.record(
+                                stream_id,
+                                bool(result.get('success') and not result.get('save_error')),
+                                result.get('save_error', result.get('message')),
+                                save=False
+                            )
+                            test_plan.record_result(stream, bool(result.get('success')), result.get('message'))
+                            
+                            # Send progress update AFTER test completes
+                            queue.put({
+                                'type': 'test_progress',
                                 'stream_id': stream_id,
                                 'stream_name': stream_name,
-                                'statistics': stats,
-                                'message': f'✓ Stream {stream_name} tested successfully{stats_message}'
+                                'current': stream_idx,
+                                'total': len(streams_to_test),
+                                'message': f'Completed {stream_idx}/{len(streams_to_test)} tests'
                             })
-                        else:
+                            
+                            if result.get('success') and not result.get('save_error'):
+                                tested_count += 1
+                            
+                            # Add delay between tests to avoid provider detection (except for the last test)
+                            if stream_idx < len(streams_to_test):
+                                test_delay = int(os.getenv('STREAM_TEST_DELAY', '3'))
+                                if test_delay > 0:
+                                    time.sleep(test_delay)
+                            
+                            # Get stream stats for display
+                            stats = result.get('statistics', {})
+                            stats_message = ""
+                            if stats:
+                                bitrate = stats.get('ffmpeg_output_bitrate')
+                                resolution = stats.get('resolution', 'Unknown')
+                                codec = stats.get('video_codec', 'Unknown')
+                                if bitrate:
+                                    stats_message = f" ({resolution}, {codec}, {bitrate:.0f}kbps)"
+                            
+                            if result.get('success') and not result.get('save_error'):
+                                queue.put({
+                                    'type': 'test_success',
+                                    'stream_id': stream_id,
+                                    'stream_name': stream_name,
+                                    'statistics': stats,
+                                    'message': f'✓ Stream {stream_name} tested successfully{stats_message}'
+                                })
+                            else:
+                                failed_tests += 1
+                                failed_test_stream_ids.add(stream_id)
+                                error_msg = result.get('save_error', result.get('message', 'Unknown error'))
+                                queue.put({
+                                    'type': 'test_fail',
+                                    'stream_id': stream_id,
+                                    'message': f'✗ Failed to test stream {stream_name}: {error_msg}'
+                                })
+                        except Exception as e:
                             failed_tests += 1
-                            error_msg = result.get('save_error', result.get('message', 'Unknown error'))
+                            failed_test_stream_ids.add(stream_id)
+                            checkpoint.record(stream_id, False, str(e), save=False)
+                            test_plan.record_result(stream, False, str(e))
+                            # Send progress even on error
+                            queue.put({
+                                'type': 'test_progress',
+                                'stream_id': stream_id,
+                                'current': stream_idx,
+                                'total': len(streams_to_test),
+                                'message': f'Completed {stream_idx}/{len(streams_to_test)} tests'
+                            })
                             queue.put({
                                 'type': 'test_fail',
                                 'stream_id': stream_id,
-                                'message': f'✗ Failed to test stream {stream_name}: {error_msg}'
+                                'message': f'✗ Error testing stream {stream_id}: {str(e)}'
                             })
-                    except Exception as e:
-                        failed_tests += 1
-                        # Send progress even on error
-                        queue.put({
-                            'type': 'test_progress',
-                            'stream_id': stream_id,
-                            'current': stream_idx,
-                            'total': len(streams_to_test),
-                            'message': f'Completed {stream_idx}/{len(streams_to_test)} tests'
-                        })
-                        queue.put({
-                            'type': 'test_fail',
-                            'stream_id': stream_id,
-                            'message': f'✗ Error testing stream {stream_id}: {str(e)}'
-                        })
-                
-                # Reload streams after testing
-                queue.put({
-                    'type': 'info',
-                    'message': 'Reloading streams with updated stats...'
-                })
-                all_streams = dispatcharr_client.get_streams()
-                all_streams = [s for s in all_streams if s is not None and isinstance(s, dict)]
+                finally:
+                    # The tested streams already carry their new stats (no reload needed); write the
+                    # buffered stats to Dispatcharr, also when the run is cancelled
+                    flush_stats_buffer(stats_buffer, queue)
+                    stats_buffer.remove_flush_listener(checkpoint.commit)
                 
-                # Re-apply basic filtering + forced overrides to the reloaded streams
-                # This ensures forced includes are maintained after testing
-                pre_filtered_streams = []
-                for stream in all_streams:
-                    stream_id = stream.get('id')
-                    
-                    # Skip streams that are explicitly excluded
-                    if stream_id in rule.force_exclude_stream_ids:
-                        continue
-                    
-                    # Include streams that are explicitly included (even if they don't match basic conditions)
-                    if stream_id in rule.force_include_stream_ids:
-                        pre_filtered_streams.append(stream)
-                        continue
-                    
-                    # For remaining streams, check basic conditions
-                    if StreamMatcher._stream_matches_basic_conditions(rule, stream):
-                        pre_filtered_streams.append(stream)
+                if test_plan.deferred:
+                    queue.put({
+                        'type': 'info',
+                        'message': f'⏭️ {test_plan.describe_deferred()}; evaluating them with their current stats'
+                    })
             
             # Find matching streams (evaluate ALL conditions including stats-based ones)
             queue.put({
@@ -1043,7 +1213,7 @@ def execute_auto_assignment_in_background(rule_id, queue):
             })
             
             # Evaluate rule on pre-filtered streams (those that already passed basic conditions)
-            matching_streams = StreamMatcher.evaluate_rule(rule, pre_filtered_streams)
+            matching_streams = StreamMatcher.evaluate_rule(rule, pre_filtered_streams, failed_test_stream_ids)
             
             queue.put({
                 'type': 'info',
@@ -1074,125 +1244,45 @@ def execute_auto_assignment_in_background(rule_id, queue):
                     errors.append(error_msg)
                     queue.put({'type': 'error', 'message': error_msg})
             
-            # If no streams were added, disable channel in profiles based on rule configuration
-            if added_count == 0:
+            # Enable the channel in its profiles if streams were added, else disable it
+            # (one bulk update per profile, see profile_sync.py)
+            try:
+                profile_sync = ProfileSync(dispatcharr_client)
+                profiles, missing_profiles = profile_sync.apply_rule_outcome(rule, added_count)
+                for profile_name in missing_profiles:
+                    error_msg = f'Profile "{profile_name}" not found'
+                    errors.append(error_msg)
+                    queue.put({'type': 'error', 'message': error_msg})
                 
-                if rule.disable_profiles:
-                    # Disable in ALL profiles EXCEPT the ones specified in disable_profiles
-                    try:
-                        profiles = dispatcharr_client.get_profiles()
-                        
-                        # Get profile IDs that should NOT be disabled
-                        excluded_profile_names = set(rule.disable_profiles)
-                        
-                        profiles_to_disable = [p for p in profiles if p.get('name') not in excluded_profile_names]
-                        
-                        if profiles_to_disable:
-                            queue.put({
-                                'type': 'disabling',
-                                'message': f'No streams matched. Disabling channel in all profiles except {", ".join(rule.disable_profiles)}'
-                            })
-                            
-                            for profile in profiles_to_disable:
-                                profile_name = profile.get('name', f'Profile {profile["id"]}')
-                                
-                                dispatcharr_client.update_channel_profile_status(profile['id'], rule.channel_id, False)
-                                queue.put({
-                                    'type': 'profile_disabled',
-                                    'profile_name': profile_name,
-                                    'message': f'✓ Disabled channel in profile: {profile_name}'
-                                })
-                        else:
-                            queue.put({
-                                'type': 'info',
-                                'message': f'No streams matched, but all profiles are excluded from disabling'
-                            })
-                    except Exception as e:
-                        error_msg = f'Error disabling channel in profiles: {str(e)}'
-                        errors.append(error_msg)
-                        queue.put({'type': 'error', 'message': error_msg})
+                profile_list = ", ".join(["{}:{}".format(p.get("id", "?"), p.get("name", "?")) for p in profiles])
+                if added_count > 0:
+                    queue.put({
+                        'type': 'enabling',
+                        'message': f'Streams found. Enabling channel in {len(profiles)} profile(s): {profile_list}'
+                    })
+                elif profiles:
+                    excluded = f' except {", ".join(rule.disable_profiles)}' if rule.disable_profiles else ''
+                    queue.put({
+                        'type': 'disabling',
+                        'message': f'No streams matched. Disabling channel in {len(profiles)} profile(s){excluded}: {profile_list}'
+                    })
                 else:
-                    # No specific profiles selected, disable in ALL profiles
-                    
-                    try:
-                        profiles = dispatcharr_client.get_profiles()
-                        
-                        queue.put({
-                            'type': 'disabling',
-                            'message': f'No streams matched. Disabling channel in all {len(profiles)} profile(s): {", ".join(["{}:{}".format(p.get("id", "?"), p.get("name", "?")) for p in profiles])}'
-                        })
-                        
-                        for profile in profiles:
-                            profile_name = profile.get('name', f'Profile {profile["id"]}')
-                            
-                            dispatcharr_client.update_channel_profile_status(profile['id'], rule.channel_id, False)
-                            queue.put({
-                                'type': 'profile_disabled',
-                                'profile_name': profile_name,
-                                'message': f'✓ Disabled channel in profile: {profile_name}'
-                            })
-                    except Exception as e:
-                        error_msg = f'Error disabling channel in all profiles: {str(e)}'
-                        errors.append(error_msg)
-                        queue.put({'type': 'error', 'message': error_msg})
+                    queue.put({
+                        'type': 'info',
+                        'message': f'No streams matched, but all profiles are excluded from disabling'
+                    })
+                
+                send_profile_sync_events(profile_sync.flush(), errors, queue)
+            except Exception as e:
+                error_msg = f'Error updating channel in profiles: {str(e)}'
+                errors.append(error_msg)
+                queue.put({'type': 'error', 'message': error_msg})
             
-            # If streams were added, enable channel in assigned profiles
-            if added_count > 0:
-                # Handle profile enabling/disabling
-                if rule.assigned_profiles:
-                    # Enable channel in assigned profiles
-                    try:
-                        for profile_name in rule.assigned_profiles:
-                            profile_id = None
-                            
-                            # Get profile ID by name
-                            try:
-                                profiles = dispatcharr_client.get_profiles()
-                                for p in profiles:
-                                    if p.get('name') == profile_name:
-                                        profile_id = p.get('id')
-                                        break
-                            except:
-                                pass  # Use None if not found
-                            
-                            if profile_id is not None:
-                                dispatcharr_client.update_channel_profile_status(profile_id, rule.channel_id, True)
-                                queue.put({
-                                    'type': 'profile_enabled',
-                                    'profile_name': profile_name,
-                                    'message': f'✓ Enabled channel in profile: {profile_name}'
-                                })
-                            else:
-                                error_msg = f'Profile "{profile_name}" not found'
-                                errors.append(error_msg)
-                                queue.put({'type': 'error', 'message': error_msg})
-                    except Exception as e:
-                        error_msg = f'Error enabling channel in assigned profiles: {str(e)}'
-                        errors.append(error_msg)
-                        queue.put({'type': 'error', 'message': error_msg})
-                else:
-                    # No specific profiles selected, enable in ALL profiles
-                    try:
-                        profiles = dispatcharr_client.get_profiles()
-                        
-                        queue.put({
-                            'type': 'enabling',
-                            'message': f'Streams found. Enabling channel in all {len(profiles)} profile(s): {", ".join(["{}:{}".format(p.get("id", "?"), p.get("name", "?")) for p in profiles])}'
-                        })
-                        
-                        for profile in profiles:
-                            profile_name = profile.get('name', f'Profile {profile["id"]}')
-                            
-                            dispatcharr_client.update_channel_profile_status(profile['id'], rule.channel_id, True)
-                            queue.put({
-                                'type': 'profile_enabled',
-                                'profile_name': profile_name,
-                                'message': f'✓ Enabled channel in profile: {profile_name}'
-                            })
-                    except Exception as e:
-                        error_msg = f'Error enabling channel in all profiles: {str(e)}'
-                        errors.append(error_msg)
-                        queue.put({'type': 'error', 'message': error_msg})
+            # Rule finished: its test phase no longer needs resuming (deferred tests stay
+            # in the checkpoint, so resuming tests them)
+            test_summary = test_plan.summary() if test_plan else None
+            if rule.test_streams_before_sorting and not (test_summary and test_summary['deferred']):
+                TestCheckpoint(assignment_checkpoint_scope(rule.id)).discard()
             
             # Send final summary
             message = f'Successfully added {added_count} stream(s) from {len(matching_streams)} matches'
@@ -1200,6 +1290,10 @@ def execute_auto_assignment_in_background(rule_id, queue):
                 message += f' (tested: {tested_count}, failed: {failed_tests}'
                 if not rule.force_retest_old_streams:
                     message += f', skipped: {skipped_count}'
+                if test_summary and test_summary['reused']:
+                    message += f', same URL as a tested stream: {test_summary["reused"]}'
+                if test_summary and test_summary['deferred']:
+                    message += f', deferred: {test_summary["deferred"]}'
                 message += ')'
             
             queue.put({
@@ -1211,6 +1305,11 @@ def execute_auto_assignment_in_background(rule_id, queue):
                 'tested_count': tested_count,
                 'failed_tests': failed_tests,
                 'skipped_count': skipped_count,
+                'tests_deferred': test_summary['deferred'] if test_summary else 0,
+                'tests_reused': test_summary['reused'] if test_summary else 0,
+                'circuit_deferred': test_summary['circuit_deferred'] if test_summary else 0,
+                'deferred_stream_ids': test_summary['deferred_stream_ids'] if test_summary else [],
+                'test_budget': budget.to_dict(),
                 'errors': errors
             })
             
@@ -1398,6 +1497,10 @@ def api_bulk_create_auto_assign_rules():
                         m3u_account_ids=data.get('m3u_account_ids'),
                         video_bitrate_operator=data.get('bitrate_operator'),
                         video_bitrate_value=int(data['bitrate_value']) if data.get('bitrate_value') else None,
+                        first_keyframe_operator=data.get('first_keyframe_operator'),
+                        first_keyframe_value=float(data['first_keyframe_value']) if data.get('first_keyframe_value') not in (None, '') else None,
+                        stall_count_operator=data.get('stall_count_operator'),
+                        stall_count_value=int(data['stall_count_value']) if data.get('stall_count_value') not in (None, '') else None,
                         video_codec=data.get('video_codec'),
                         video_resolution=data.get('video_resolution'),
                         video_fps=int(data['video_fps']) if data.get('video_fps') else None,
@@ -1407,7 +1510,8 @@ def api_bulk_create_auto_assign_rules():
                         assigned_profiles=data.get('assigned_profiles'),
                         test_streams_before_sorting=data.get('test_streams_before_sorting', False),
                         force_retest_old_streams=data.get('force_retest_old_streams', False),
-                        retest_days_threshold=int(data.get('retest_days_threshold', 7))
+                        retest_days_threshold=int(data.get('retest_days_threshold', 7)),
+                        probe_mode=data.get('probe_mode', 'auto')
                     )
 
                     # Update rule
@@ -1428,6 +1532,10 @@ def api_bulk_create_auto_assign_rules():
                         m3u_account_ids=data.get('m3u_account_ids'),
                         video_bitrate_operator=data.get('bitrate_operator'),
                         video_bitrate_value=int(data['bitrate_value']) if data.get('bitrate_value') else None,
+                        first_keyframe_operator=data.get('first_keyframe_operator'),
+                        first_keyframe_value=float(data['first_keyframe_value']) if data.get('first_keyframe_value') not in (None, '') else None,
+                        stall_count_operator=data.get('stall_count_operator'),
+                        stall_count_value=int(data['stall_count_value']) if data.get('stall_count_value') not in (None, '') else None,
                         video_codec=data.get('video_codec'),
                         video_resolution=data.get('video_resolution'),
                         video_fps=int(data['video_fps']) if data.get('video_fps') else None,
@@ -1437,7 +1545,8 @@ def api_bulk_create_auto_assign_rules():
                         assigned_profiles=data.get('assigned_profiles'),
                         test_streams_before_sorting=data.get('test_streams_before_sorting', False),
                         force_retest_old_streams=data.get('force_retest_old_streams', False),
-                        retest_days_threshold=int(data.get('retest_days_threshold', 7))
+                        retest_days_threshold=int(data.get('retest_days_threshold', 7)),
+                        probe_mode=data.get('probe_mode', 'auto')
                     )
 
                     # Save rule
@@ -1544,6 +1653,7 @@ def api_sorting_rules():
                 test_streams_before_sorting=data.get('test_streams_before_sorting', False),
                 force_retest_old_streams=data.get('force_retest_old_streams', False),
                 retest_days_threshold=data.get('retest_days_threshold', 7),
+                probe_mode=data.get('probe_mode', 'auto'),
                 execution_order=data.get('execution_order', 999),
                 all_channels=data.get('all_channels', False)
             )
@@ -1608,6 +1718,7 @@ def api_sorting_rule(rule_id):
                 test_streams_before_sorting=data.get('test_streams_before_sorting', False),
                 force_retest_old_streams=data.get('force_retest_old_streams', False),
                 retest_days_threshold=data.get('retest_days_threshold', 7),
+                probe_mode=data.get('probe_mode', 'auto'),
                 execution_order=data.get('execution_order', 999),
                 all_channels=data.get('all_channels', False)
             )
@@ -1646,45 +1757,20 @@ def api_channel_groups():
 def execute_sorting_rule_stream(rule_id):
     """SSE endpoint to stream execution progress"""
     execution_id = request.args.get('execution_id')
-    
-    if not execution_id or execution_id not in execution_queues:
-        return jsonify({'error': 'Invalid execution ID'}), 400
-    
-    def generate():
-        queue = execution_queues[execution_id]
-        
-        try:
-            while True:
-                # Get message from queue (block for max 30 seconds)
-                try:
-                    message = queue.get(timeout=30)
-                    
-                    if message is None:  # Signal to stop
-                        break
-                    
-                    # Send SSE message
-                    yield f"data: {json.dumps(message)}\n\n"
-                    
-                except Exception as e:
-                    # Timeout or error, send keepalive
-                    yield f"data: {json.dumps({'type': 'keepalive'})}\n\n"
-        finally:
-            # Clean up queue when client disconnects
-            if execution_id in execution_queues:
-                del execution_queues[execution_id]
-    
-    return Response(
-        stream_with_context(generate()),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no'
-        }
-    )
+    return execution_event_stream(execution_id)
+
 
+def execute_sorting_in_background(rule_id, channel_ids, time_budget, max_tests, queue):
+    """
+    Execute sorting rule in background thread and send progress updates
 
-def execute_sorting_in_background(rule_id, channel_ids, queue):
-    """Execute sorting rule in background thread and send progress updates"""
+    The test budget is shared by all channels; streams that don't fit are
+    deferred and sorted with their current stats.
+    """
+    budget = TestBudget(time_budget, max_tests)
+    total_deferred = 0
+    circuit_deferred = 0
+    deferred_stream_ids = []
     try:
         # Get the rule
         rule = sorting_rules_manager.get_rule(rule_id)
@@ -1710,6 +1796,11 @@ def execute_sorting_in_background(rule_id, channel_ids, queue):
             'total_channels': len(channel_ids)
         })
         
+        # Test results update the channel streams in place and are written in batches;
+        # streams shared by several channels (or URLs shared by several streams) are tested once
+        stats_buffer = StatsWriteBuffer(dispatcharr_client)
+        test_registry = StreamTestRegistry(dispatcharr_client, stats_buffer)
+        
         for idx, channel_id in enumerate(channel_ids, 1):
             tested_count = 0
             failed_tests = 0
@@ -1805,6 +1896,17 @@ def execute_sorting_in_background(rule_id, channel_ids, queue):
                         # Forzar re-testeo de TODOS los streams (incluso los que tienen stats recientes)
                         streams_to_test = [s['id'] for s in streams]
                     
+                    # Test in order of value while the budget allows (streams near the top
+                    # of the channel first among streams of similar age)
+                    positions = {s['id']: position for position, s in enumerate(streams)}
+                    test_registry.add_streams(streams)
+                    test_plan = TestPlan(
+                        [s for s in streams if s['id'] in set(streams_to_test)], budget,
+                        lambda s: 1.0 / (1 + positions[s['id']]),
+                        registry=test_registry
+                    )
+                    streams_to_test = [s['id'] for s in test_plan.streams]
+                    
                     queue.put({
                         'type': 'test_start',
                         'total_streams': len(streams_to_test),
@@ -1812,42 +1914,58 @@ def execute_sorting_in_background(rule_id, channel_ids, queue):
                     })
                     
                     # Test streams
-                    for stream_idx, stream_id in enumerate(streams_to_test, 1):
-                        try:
-                            stream_name = next((s.get('name', f'Stream {stream_id}') for s in streams if s['id'] == stream_id), f'Stream {stream_id}')
-                            
-                            queue.put({
-                                'type': 'test_progress',
-                                'stream_id': stream_id,
-                                'stream_name': stream_name,
-                                'current': stream_idx,
-                                'total': len(streams_to_test),
-                                'message': f'Testing stream {stream_idx}/{len(streams_to_test)}: {stream_name}'
-                            })
-                            
-                            result = dispatcharr_client.test_stream(stream_id)
-                            if result.get('success') and not result.get('save_error'):
-                                tested_count += 1
+                    try:
+                        for stream_idx, stream in enumerate(test_plan, 1):
+                            stream_id = stream['id']
+                            try:
+                                stream_name = stream.get('name', f'Stream {stream_id}')
+                                
                                 queue.put({
-                                    'type': 'test_success',
+                                    'type': 'test_progress',
                                     'stream_id': stream_id,
-                                    'message': f'✓ Stream {stream_name} tested successfully'
+                                    'stream_name': stream_name,
+                                    'current': stream_idx,
+                                    'total': len(streams_to_test),
+                                    'message': f'Testing stream {stream_idx}/{len(streams_to_test)}: {stream_name}'
                                 })
-                            else:
+                                
+                                result = test_registry.test(stream_id, stream, probe_mode=rule.probe_mode)
+                                test_plan.record_result(stream, bool(result.get('success')), result.get('message'))
+                                if result.get('success') and not result.get('save_error'):
+                                    tested_count += 1
+                                    queue.put({
+                                        'type': 'test_success',
+                                        'stream_id': stream_id,
+                                        'message': f'✓ Stream {stream_name} tested successfully'
+                                    })
+                                else:
+                                    failed_tests += 1
+                                    error_msg = result.get('save_error', result.get('message', 'Unknown error'))
+                                    queue.put({
+                                        'type': 'test_fail',
+                                        'stream_id': stream_id,
+                                        'message': f'✗ Failed to test stream {stream_name}: {error_msg}'
+                                    })
+                            except Exception as e:
                                 failed_tests += 1
-                                error_msg = result.get('save_error', result.get('message', 'Unknown error'))
+                                test_plan.record_result(stream, False, str(e))
                                 queue.put({
                                     'type': 'test_fail',
                                     'stream_id': stream_id,
-                                    'message': f'✗ Failed to test stream {stream_name}: {error_msg}'
+                                    'message': f'✗ Error testing stream {stream_id}: {str(e)}'
                                 })
-                        except Exception as e:
-                            failed_tests += 1
-                            queue.put({
-                                'type': 'test_fail',
-                                'stream_id': stream_id,
-                                'message': f'✗ Error testing stream {stream_id}: {str(e)}'
-                            })
+                    finally:
+                        # Write the stats measured so far, also when the run is cancelled
+                        flush_stats_buffer(stats_buffer, queue)
+                    
+                    if test_plan.deferred:
+                        total_deferred += len(test_plan.deferred)
+                        circuit_deferred += len(test_plan.circuit_deferred)
+                        deferred_stream_ids.extend(s['id'] for s in test_plan.deferred)
+                        queue.put({
+                            'type': 'info',
+                            'message': f'⏭️ {test_plan.describe_deferred()}; sorting them with their current stats'
+                        })
                 
                 # Sort streams
                 queue.put({
@@ -1905,6 +2023,8 @@ def execute_sorting_in_background(rule_id, channel_ids, queue):
             message += f' (tested: {total_tested}, failed: {total_failed}'
             if not rule.force_retest_old_streams:
                 message += f', skipped: {total_skipped}'
+            if total_deferred:
+                message += f', deferred: {total_deferred}'
             message += ')'
         
         queue.put({
@@ -1915,6 +2035,10 @@ def execute_sorting_in_background(rule_id, channel_ids, queue):
             'total_tested': total_tested,
             'total_failed': total_failed,
             'total_skipped': total_skipped,
+            'tests_deferred': total_deferred,
+            'circuit_deferred': circuit_deferred,
+            'deferred_stream_ids': deferred_stream_ids[:DEFERRED_IDS_LIMIT],
+            'test_budget': budget.to_dict(),
             'processed_channels': processed_channels,
             'errors': errors
         })
@@ -2010,20 +2134,13 @@ def execute_sorting_rule(rule_id):
         
         # If streaming requested and rule requires testing, use background execution
         if use_stream and rule.test_streams_before_sorting:
-            import uuid
-            execution_id = str(uuid.uuid4())
-            
-            # Create queue for this execution
-            queue = Queue()
-            execution_queues[execution_id] = queue
+            try:
+                time_budget, max_tests = parse_test_budget(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            # Start background thread
-            thread = Thread(
-                target=execute_sorting_in_background,
-                args=(rule_id, channel_ids, queue)
-            )
-            thread.daemon = True
-            thread.start()
+            # Queue the execution as a job (progress goes to the shared store)
+            execution_id = job_manager.submit('sorting', (rule_id, channel_ids, time_budget, max_tests))
             
             return jsonify({
                 'success': True,
@@ -2041,6 +2158,11 @@ def execute_sorting_rule(rule_id):
         processed_channels = []
         errors = []
         
+        # Test results update the channel streams in place and are written in batches;
+        # streams shared by several channels (or URLs shared by several streams) are tested once
+        stats_buffer = StatsWriteBuffer(dispatcharr_client)
+        test_registry = StreamTestRegistry(dispatcharr_client, stats_buffer)
+        
         for channel_id in channel_ids:
             tested_count = 0
             failed_tests = 0
@@ -2110,42 +2232,49 @@ def execute_sorting_rule(rule_id):
                         streams_to_test = [s['id'] for s in streams]
                     
                     # Testear streams seleccionados
-                    for stream_idx, stream_id in enumerate(streams_to_test, 1):
-                        try:
-                            stream_name = next((s.get('name', f'Stream {stream_id}') for s in streams if s['id'] == stream_id), f'Stream {stream_id}')
-                            
-                            queue.put({
-                                'type': 'test_progress',
-                                'stream_id': stream_id,
-                                'stream_name': stream_name,
-                                'current': stream_idx,
-                                'total': len(streams_to_test),
-                                'message': f'Testing stream {stream_idx}/{len(streams_to_test)}: {stream_name}'
-                            })
-                            
-                            result = dispatcharr_client.test_stream(stream_id)
-                            if result.get('success') and not result.get('save_error'):
-                                tested_count += 1
+                    try:
+                        for stream_idx, stream_id in enumerate(streams_to_test, 1):
+                            try:
+                                stream_name = next((s.get('name', f'Stream {stream_id}') for s in streams if s['id'] == stream_id), f'Stream {stream_id}')
+                                
                                 queue.put({
-                                    'type': 'test_success',
+                                    'type': 'test_progress',
                                     'stream_id': stream_id,
-                                    'message': f'✓ Stream {stream_name} tested successfully'
+                                    'stream_name': stream_name,
+                                    'current': stream_idx,
+                                    'total': len(streams_to_test),
+                                    'message': f'Testing stream {stream_idx}/{len(streams_to_test)}: {stream_name}'
                                 })
-                            else:
+                                
+                                result = test_registry.test(
+                                    stream_id, next((s for s in streams if s['id'] == stream_id), None),
+                                    probe_mode=rule.probe_mode
+                                )
+                                if result.get('success') and not result.get('save_error'):
+                                    tested_count += 1
+                                    queue.put({
+                                        'type': 'test_success',
+                                        'stream_id': stream_id,
+                                        'message': f'✓ Stream {stream_name} tested successfully'
+                                    })
+                                else:
+                                    failed_tests += 1
+                                    error_msg = result.get('save_error', result.get('message', 'Unknown error'))
+                                    queue.put({
+                                        'type': 'test_fail',
+                                        'stream_id': stream_id,
+                                        'message': f'✗ Failed to test stream {stream_name}: {error_msg}'
+                                    })
+                            except Exception as e:
                                 failed_tests += 1
-                                error_msg = result.get('save_error', result.get('message', 'Unknown error'))
                                 queue.put({
                                     'type': 'test_fail',
                                     'stream_id': stream_id,
-                                    'message': f'✗ Failed to test stream {stream_name}: {error_msg}'
+                                    'message': f'✗ Error testing stream {stream_id}: {str(e)}'
                                 })
-                        except Exception as e:
-                            failed_tests += 1
-                            queue.put({
-                                'type': 'test_fail',
-                                'stream_id': stream_id,
-                                'message': f'✗ Error testing stream {stream_id}: {str(e)}'
-                            })
+                    finally:
+                        # Write the stats measured so far, also when the run is cancelled
+                        stats_buffer.flush()
                 
                 # Sort streams usando la regla
                 sorted_streams = StreamSorter.sort_streams(rule, streams)
@@ -2269,20 +2398,13 @@ def execute_all_sorting_rules():
         use_stream = data.get('stream', False)  # If true, use SSE streaming
         
         if use_stream:
-            import uuid
-            execution_id = str(uuid.uuid4())
+            try:
+                time_budget, max_tests = parse_test_budget(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            # Create queue for this execution
-            queue = Queue()
-            execution_queues[execution_id] = queue
-            
-            # Start background thread
-            thread = Thread(
-                target=execute_all_sorting_rules_in_background,
-                args=(execution_id, queue)
-            )
-            thread.daemon = True
-            thread.start()
+            # Queue the execution as a job (progress goes to the shared store)
+            execution_id = job_manager.submit('sorting_all', (time_budget, max_tests))
             
             return jsonify({
                 'success': True,
@@ -2315,49 +2437,20 @@ def execute_all_sorting_rules():
 def execute_all_sorting_rules_stream():
     """SSE endpoint to stream all rules execution progress"""
     execution_id = request.args.get('execution_id')
-    
-    if not execution_id or execution_id not in execution_queues:
-        return jsonify({'error': 'Invalid execution ID'}), 400
-    
-    def generate():
-        queue = execution_queues[execution_id]
-        
-        try:
-            while True:
-                # Get message from queue (block for max 30 seconds)
-                try:
-                    message = queue.get(timeout=30)
-                    
-                    if message is None:  # Signal to stop
-                        break
-                    
-                    # Send SSE message
-                    yield f"data: {json.dumps(message)}\n\n"
-                    
-                except Exception as e:
-                    # Timeout or error, send keepalive
-                    yield f"data: {json.dumps({'type': 'keepalive'})}\n\n"
-        finally:
-            # Clean up queue when client disconnects
-            if execution_id in execution_queues:
-                del execution_queues[execution_id]
-    
-    return Response(
-        stream_with_context(generate()),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'X-Accel-Buffering': 'no'
-        }
-    )
+    return execution_event_stream(execution_id)
 
 
-def execute_all_sorting_rules_in_background(execution_id, queue):
+def execute_all_sorting_rules_in_background(time_budget, max_tests, queue):
     """Execute all sorting rules in background thread and send progress updates"""
     try:
         from execute_rules import RuleExecutor
         executor = RuleExecutor()
         
+        # All rules of the run share one catalog snapshot and one test budget
+        catalog = executor.new_catalog()
+        budget = TestBudget(time_budget, max_tests)
+        tests_deferred = 0
+        
         # Load rules in execution order
         all_rules = sorting_rules_manager.load_rules_ordered()
         enabled_rules = [r for r in all_rules if r.enabled]
@@ -2388,10 +2481,11 @@ def execute_all_sorting_rules_in_background(execution_id, queue):
             
             try:
                 # Execute single rule and get result
-                result = executor.execute_single_sorting_rule(rule, verbose=False)
+                result = executor.execute_single_sorting_rule(rule, verbose=False, catalog=catalog, budget=budget)
                 
                 channels_sorted = result.get('channels_sorted', 0)
                 total_channels_sorted += channels_sorted
+                tests_deferred += result.get('tests_deferred', 0)
                 successful_rules += 1
                 
                 queue.put({
@@ -2415,7 +2509,10 @@ def execute_all_sorting_rules_in_background(execution_id, queue):
         queue.put({
             'type': 'complete',
             'rules_executed': successful_rules,
-            'total_channels_sorted': total_channels_sorted
+            'total_channels_sorted': total_channels_sorted,
+            'tests_deferred': tests_deferred,
+            'test_budget': budget.to_dict(),
+            'upstream_calls': catalog.upstream_calls
         })
         
     except Exception as e:
@@ -2499,6 +2596,107 @@ def toggle_sorting_rule(rule_id):
         return jsonify({'error': str(e)}), 500
 
 
+
+@app.route('/api/stats-refresher')
+def api_stats_refresher_status():
+    """API endpoint to get the state of the background stats refresher"""
+    try:
+        status = stats_refresher.status()
+        status['enabled'] = STATS_REFRESH_ENABLED
+        return jsonify(status)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/circuit-breakers')
+def api_circuit_breakers():
+    """API endpoint to get the stream-testing circuit breaker state of each M3U account"""
+    return jsonify(provider_breakers.status())
+
+
+@app.route('/api/tool-processes')
+def api_tool_processes():
+    """API endpoint to get the ffprobe/ffmpeg process limits, running processes and recent resource usage"""
+    return jsonify(tool_supervisor.status())
+
+
+@app.route('/api/diagnostics/toolchain')
+def api_toolchain_diagnostics():
+    """API endpoint to get the ffmpeg/ffprobe paths, versions and capabilities used by stream tests"""
+    refresh = request.args.get('refresh', 'false').lower() == 'true'
+    return jsonify(get_toolchain(refresh=refresh).status())
+
+
+@app.route('/api/diagnostics/dispatcharr')
+def api_dispatcharr_diagnostics():
+    """API endpoint to get the Dispatcharr transport settings (pool, timeouts, rate limits) and counters"""
+    status = dispatcharr_client.transport.status()
+    status['requests'] = dispatcharr_client.request_count
+    status['reference_cache'] = dispatcharr_client.reference_cache.stats()
+    status['coalescing'] = dispatcharr_client.single_flight.stats()
+    status['http_cache'] = dispatcharr_client.http_cache.stats() if dispatcharr_client.http_cache else None
+    return jsonify(status)
+
+
+@app.route('/api/reference-cache/invalidate', methods=['POST'])
+def api_invalidate_reference_cache():
+    """API endpoint to forget cached M3U accounts/profiles/channel groups/logos (all, or the 'resource' given)
+
+    Without a resource, the on-disk cache of stream/channel/logo lists is cleared as well.
+    """
+    resource = (request.get_json(silent=True) or {}).get('resource') or request.args.get('resource')
+    if resource and resource not in dispatcharr_client.reference_cache.ttls:
+        return jsonify({'error': f'Unknown resource: {resource}'}), 400
+    dispatcharr_client.invalidate_reference_data(resource)
+    return jsonify({'success': True, 'invalidated': resource or 'all'})
+
+
+@app.route('/api/jobs')
+def api_list_jobs():
+    """API endpoint to list recent rule execution jobs"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        return jsonify(job_manager.list_jobs(limit))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>')
+def api_get_job(job_id):
+    """API endpoint to get the state of a rule execution job"""
+    job = job_manager.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """API endpoint to cancel a queued or running rule execution job"""
+    try:
+        job = job_manager.cancel(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Register job handlers and start the workers (progress goes to the job's channel)
+# Recovered assignment runs resume from their checkpoint instead of testing everything again
+job_manager.register('auto_assignment', execute_auto_assignment_in_background,
+                     recovery_args=lambda args: [args[0], True, *args[2:]])
+job_manager.register('sorting', execute_sorting_in_background)
+job_manager.register('sorting_all', execute_all_sorting_rules_in_background)
+if not is_reloader_parent_process():
+    # Resolve ffmpeg/ffprobe once, so missing tools are reported at startup
+    log_toolchain(get_toolchain())
+    job_manager.start()
+    if STATS_REFRESH_ENABLED:
+        stats_refresher.start()
+
 if __name__ == '__main__':
-    # Use watchdog reloader for better Windows compatibility
-    app.run(debug=True, use_reloader=True, reloader_type='stat', host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
\ No newline at end of file
+    # Development server only; use serve.py (SERVER_MODE=gunicorn|waitress) in production
+    debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
+    # Use stat reloader for better Windows compatibility
+    app.run(debug=debug, use_reloader=debug, reloader_type='stat', host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Run-scoped catalog snapshot for Stream Plus rule executions
+
+A CatalogSnapshot caches the Dispatcharr catalog (streams, channels, M3U
+accounts) for the duration of one run, so the assignment and sorting phases
+share the same data instead of downloading it again. Writes made during the
+run are applied to the snapshot in place, so later phases see the new channel
+membership without refetching. Stream test results go through the snapshot's
+stats buffer, which updates the snapshot's streams immediately and writes the
+stats to Dispatcharr in batches, and through the snapshot's test registry,
+which tests each URL at most once per run and applies the result to every
+stream sharing it.
+"""
+from typing import Any, Dict, List, Optional
+
+from api.dispatcharr_client import DispatcharrClient
+from m3u_refresh import M3URefreshCoordinator
+from stats_buffer import StatsWriteBuffer
+from test_registry import StreamTestRegistry
+
+
+class CatalogSnapshot:
+    """Catalog data shared by all phases of a rule execution run"""
+
+    def __init__(self, client: DispatcharrClient):
+        """
+        Initialize an empty snapshot (data is loaded on first use)
+
+        Args:
+            client: Dispatcharr client used to load the catalog
+        """
+        self.client = client
+        self.m3u_refresh_attempted = False
+        self.m3u_refreshed = False
+        self._streams: Optional[List[Dict[str, Any]]] = None
+        self._streams_by_id: Dict[int, Dict[str, Any]] = {}
+        self._channels: Optional[List[Dict[str, Any]]] = None
+        self._channel_details: Dict[int, Dict[str, Any]] = {}
+        self._m3u_accounts: Optional[List[Dict[str, Any]]] = None
+        self._start_request_count = client.request_count
+        self.stats_buffer = StatsWriteBuffer(client)
+        self.test_registry = StreamTestRegistry(client, self.stats_buffer)
+
+    def refresh_m3u_sources(self, verbose: bool = False) -> bool:
+        """
+        Refreshes the M3U sources, at most once per run
+
+        Waits until Dispatcharr has finished processing the refresh (see
+        M3URefreshCoordinator), so the catalog is loaded with fresh data.
+
+        Returns:
+            True if this call refreshed the sources
+        """
+        if self.m3u_refresh_attempted:
+            print("ℹ️  M3U sources already refreshed in this run, skipping")
+            return False
+
+        self.m3u_refresh_attempted = True
+        try:
+            result = M3URefreshCoordinator(self.client).refresh()
+            self.m3u_refreshed = result['refreshed']
+            if verbose:
+                print(f"   Refresh result: {result}")
+            if self.m3u_refreshed:
+                # Refreshed sources may add or change streams
+                self.invalidate_streams()
+        except Exception as e:
+            print(f"⚠️  Warning: Failed to refresh M3U sources: {e}")
+            print("   Continuing with rule execution...")
+        return self.m3u_refreshed
+
+    def get_streams(self) -> List[Dict[str, Any]]:
+        """Gets all streams (downloaded once per run unless invalidated)"""
+        if self._streams is None:
+            streams = self.client.get_streams()
+            self._streams = self.stats_buffer.apply([s for s in streams if s is not None and isinstance(s, dict)])
+            self._streams_by_id = {s['id']: s for s in self._streams if 'id' in s}
+            self.test_registry.add_streams(self._streams)
+        return self._streams
+
+    def invalidate_streams(self):
+        """Forgets the streams so they are downloaded again (stats recorded in this run are kept)"""
+        self._streams = None
+        self._streams_by_id = {}
+
+    def get_stream(self, stream_id: int) -> Optional[Dict[str, Any]]:
+        """Gets a stream from the snapshot"""
+        self.get_streams()
+        return self._streams_by_id.get(stream_id)
+
+    def get_channels(self) -> List[Dict[str, Any]]:
+        """Gets all channels (downloaded once per run)"""
+        if self._channels is None:
+            self._channels = self.client.get_channels()
+        return self._channels
+
+    def get_channel(self, channel_id: int) -> Dict[str, Any]:
+        """
+        Gets a channel with its ordered stream IDs (downloaded once per run)
+
+        Returns a copy, so callers can modify it before sending updates.
+        """
+        if channel_id not in self._channel_details:
+            self._channel_details[channel_id] = self.client.get_channel(channel_id)
+        channel = dict(self._channel_details[channel_id])
+        channel['streams'] = list(channel.get('streams', []))
+        return channel
+
+    def get_channel_streams(self, channel_id: int) -> List[Dict[str, Any]]:
+        """
+        Gets the streams of a channel in channel order
+
+        Built from the channel membership and the stream snapshot; falls back
+        to the API if a member stream isn't in the snapshot.
+        """
+        stream_ids = self.get_channel(channel_id).get('streams', [])
+        self.get_streams()
+        if all(stream_id in self._streams_by_id for stream_id in stream_ids):
+            return [self._streams_by_id[stream_id] for stream_id in stream_ids]
+        return self.client.get_channel_streams(channel_id)
+
+    def get_m3u_accounts(self) -> List[Dict[str, Any]]:
+        """Gets all M3U accounts (downloaded once per run)"""
+        if self._m3u_accounts is None:
+            self._m3u_accounts = self.client.get_m3u_accounts()
+        return self._m3u_accounts
+
+    def set_channel_streams(self, channel_id: int, stream_ids: List[int]):
+        """Records a successful update of a channel's streams"""
+        if channel_id in self._channel_details:
+            self._channel_details[channel_id]['streams'] = list(stream_ids)
+        for channel in self._channels or []:
+            if channel.get('id') == channel_id and 'streams' in channel:
+                channel['streams'] = list(stream_ids)
+
+    def add_channel_stream(self, channel_id: int, stream_id: int):
+        """Records a stream successfully added to a channel"""
+        stream_ids = self.get_channel(channel_id).get('streams', [])
+        if stream_id not in stream_ids:
+            stream_ids.append(stream_id)
+        self.set_channel_streams(channel_id, stream_ids)
+
+    def remove_channel_stream(self, channel_id: int, stream_id: int):
+        """Records a stream successfully removed from a channel"""
+        stream_ids = [s for s in self.get_channel(channel_id).get('streams', []) if s != stream_id]
+        self.set_channel_streams(channel_id, stream_ids)
+
+    @property
+    def upstream_calls(self) -> int:
+        """Number of Dispatcharr API calls made since the snapshot was created"""
+        return self.client.request_count - self._start_request_count
@@ -0,0 +1,180 @@
+"""
+Checkpoints for resumable stream-testing runs
+
+The test phase of a rule writes a checkpoint file as tests complete: the run ID,
+the candidate stream IDs and the result of every completed test. Results are
+saved once their stats have been written to Dispatcharr (when the run's stats
+buffer flushes), so a test whose stats were lost is tested again. If the run is
+interrupted, a resumed run skips the streams that were already tested and
+continues matching with their recorded results.
+"""
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Directory where checkpoint files are stored
+CHECKPOINT_DIR = os.getenv('CHECKPOINT_DIR', 'checkpoints')
+
+
+def _utc_now() -> str:
+    """Current UTC time in the ISO format used by the state files"""
+    return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class TestCheckpoint:
+    """Checkpoint of the stream-testing phase of one rule execution"""
+
+    def __init__(self, scope: str, run_id: Optional[str] = None, candidates: Optional[List[int]] = None,
+                 completed: Optional[Dict[int, Dict[str, Any]]] = None, created_at: Optional[str] = None,
+                 checkpoint_dir: Optional[str] = None):
+        """
+        Initialize a checkpoint
+
+        Args:
+            scope: Identifies what is being tested (e.g. 'assignment-rule-3')
+            run_id: ID of the run that created the checkpoint
+            candidates: Stream IDs selected for testing
+            completed: Results of completed tests by stream ID
+            created_at: When the run started
+            checkpoint_dir: Directory for checkpoint files (default: CHECKPOINT_DIR)
+        """
+        self.scope = scope
+        self.run_id = run_id or str(uuid.uuid4())
+        self.candidates = candidates or []
+        self.completed = completed or {}
+        self.created_at = created_at or _utc_now()
+        self.checkpoint_dir = checkpoint_dir or CHECKPOINT_DIR
+
+    @staticmethod
+    def path_for(scope: str, checkpoint_dir: Optional[str] = None) -> str:
+        """Path of the checkpoint file of a scope"""
+        return os.path.join(checkpoint_dir or CHECKPOINT_DIR, f'{scope}.json')
+
+    @property
+    def path(self) -> str:
+        return self.path_for(self.scope, self.checkpoint_dir)
+
+    @classmethod
+    def load(cls, scope: str, checkpoint_dir: Optional[str] = None) -> Optional['TestCheckpoint']:
+        """
+        Loads the checkpoint of a scope
+
+        Returns:
+            The checkpoint, or None if there is none (or it can't be read)
+        """
+        path = cls.path_for(scope, checkpoint_dir)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            return cls(
+                scope=scope,
+                run_id=data.get('run_id'),
+                candidates=data.get('candidates', []),
+                # JSON object keys are strings; stream IDs are ints
+                completed={int(k): v for k, v in data.get('completed', {}).items()},
+                created_at=data.get('created_at'),
+                checkpoint_dir=checkpoint_dir
+            )
+        except (OSError, ValueError) as e:
+            print(f"Error loading checkpoint {path}: {e}")
+            return None
+
+    @classmethod
+    def start(cls, scope: str, candidates: List[int], checkpoint_dir: Optional[str] = None) -> 'TestCheckpoint':
+        """Starts a new checkpoint for a run (replacing any previous one)"""
+        checkpoint = cls(scope=scope, candidates=list(candidates), checkpoint_dir=checkpoint_dir)
+        checkpoint.save()
+        return checkpoint
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary"""
+        return {
+            'run_id': self.run_id,
+            'scope': self.scope,
+            'created_at': self.created_at,
+            'updated_at': _utc_now(),
+            'candidates': self.candidates,
+            'completed': {str(k): v for k, v in self.completed.items()}
+        }
+
+    def save(self):
+        """Writes the checkpoint atomically (a crash never leaves a partial file)"""
+        try:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error saving checkpoint {self.path}: {e}")
+
+    def record(self, stream_id: int, success: bool, message: Optional[str] = None, save: bool = True):
+        """
+        Records the result of a completed test
+
+        Args:
+            stream_id: Tested stream
+            success: Whether the test succeeded
+            message: Result message
+            save: Save the checkpoint now; with False it is saved by the next
+                commit(), once the stats of the test have reached Dispatcharr
+        """
+        self.completed[stream_id] = {
+            'success': success,
+            'message': message,
+            'tested_at': _utc_now()
+        }
+        if save:
+            self.save()
+
+    def commit(self, write_errors: Optional[Dict[int, str]] = None):
+        """
+        Saves the results recorded so far, after their buffered stats were written
+
+        Meant as a StatsWriteBuffer flush listener. Tests whose stats could not
+        be written are saved as failed.
+
+        Args:
+            write_errors: Stats write errors by stream ID
+        """
+        for stream_id, error in (write_errors or {}).items():
+            if stream_id in self.completed:
+                self.completed[stream_id].update(success=False, message=f'Error saving stats: {error}')
+        self.save()
+
+    def is_completed(self, stream_id: int) -> bool:
+        """Whether the stream was already tested in this run"""
+        return stream_id in self.completed
+
+    def failed_ids(self) -> set:
+        """IDs of the streams whose test failed"""
+        return {stream_id for stream_id, result in self.completed.items() if not result.get('success')}
+
+    def summary(self) -> Dict[str, Any]:
+        """Progress summary of the run"""
+        failed = len(self.failed_ids())
+        return {
+            'run_id': self.run_id,
+            'created_at': self.created_at,
+            'candidates': len(self.candidates),
+            'completed': len(self.completed),
+            'failed': failed,
+            'succeeded': len(self.completed) - failed
+        }
+
+    def discard(self):
+        """Deletes the checkpoint file (the run finished)"""
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError as e:
+            print(f"Error deleting checkpoint {self.path}: {e}")
+
+
+def assignment_checkpoint_scope(rule_id: int) -> str:
+    """Checkpoint scope of the test phase of an auto-assignment rule"""
+    return f'assignment-rule-{rule_id}'
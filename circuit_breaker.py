@@ -0,0 +1,194 @@
+"""
+Provider-level circuit breaker for Stream Plus stream testing
+
+When an M3U provider is down, every one of its streams fails only after the
+full ffprobe timeout (and each failed test also reads and rewrites the stream
+to clear its stats). The breakers track connection failures per M3U account
+over a sliding window: after CIRCUIT_FAILURE_THRESHOLD consecutive connection
+failures the provider's circuit opens and its remaining streams are deferred
+(not tested, not marked failed, stats untouched). After CIRCUIT_OPEN_SECONDS
+the circuit half-opens and a single canary test decides whether it closes again.
+"""
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+# Consecutive connection failures that open a provider's circuit
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '3'))
+
+# Seconds a failure counts towards opening the circuit
+CIRCUIT_WINDOW_SECONDS = int(os.getenv('CIRCUIT_WINDOW_SECONDS', '300'))
+
+# Seconds a circuit stays open before a canary test is allowed
+CIRCUIT_OPEN_SECONDS = int(os.getenv('CIRCUIT_OPEN_SECONDS', '120'))
+
+# Circuit states
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+# Test failures caused by the provider not answering (as opposed to a stream with bad content).
+# Only connect, DNS, timeout and reset errors and 5xx answers count: a 4xx answer (e.g. a dead
+# stream's "Server returned 404 Not Found") proves the provider is reachable
+CONNECT_FAILURE_PATTERN = re.compile(
+    r'timeout|timed out|connection refused|connection reset|connection aborted|broken pipe|'
+    r'failed to resolve|name or service not known|temporary failure in name resolution|'
+    r'no route to host|network is unreachable|'
+    r'server returned 5\d\d|http error 5\d\d|\b5\d\d server error',
+    re.IGNORECASE
+)
+
+
+def is_connect_failure(message: Optional[str]) -> bool:
+    """Whether a test failure message means the provider could not be reached"""
+    return bool(message) and bool(CONNECT_FAILURE_PATTERN.search(message))
+
+
+def stream_provider(stream: Dict[str, Any]) -> Optional[int]:
+    """M3U account of a stream (the provider whose circuit applies)"""
+    provider = stream.get('m3u_account')
+    if provider is None:
+        provider = stream.get('m3u_account_id')
+    if isinstance(provider, dict):
+        provider = provider.get('id')
+    return provider
+
+
+class CircuitBreaker:
+    """Circuit of one provider"""
+
+    def __init__(self, threshold: int = CIRCUIT_FAILURE_THRESHOLD, window: int = CIRCUIT_WINDOW_SECONDS,
+                 open_seconds: int = CIRCUIT_OPEN_SECONDS):
+        """
+        Initialize a closed circuit
+
+        Args:
+            threshold: Consecutive connection failures that open the circuit
+            window: Seconds a failure counts towards the threshold
+            open_seconds: Seconds before a canary test is allowed
+        """
+        self.threshold = threshold
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = CIRCUIT_CLOSED
+        self.failures: deque = deque()
+        self.opened_at: Optional[float] = None
+        self.canary_started_at: Optional[float] = None
+        self.skipped = 0
+
+    def allow(self) -> bool:
+        """
+        Whether a stream of the provider may be tested now
+
+        An open circuit half-opens after open_seconds and lets exactly one
+        canary test through (another one if the canary never reported back).
+        """
+        now = time.time()
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if self.state == CIRCUIT_OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = CIRCUIT_HALF_OPEN
+            self.canary_started_at = None
+        if self.state == CIRCUIT_HALF_OPEN:
+            if self.canary_started_at is None or now - self.canary_started_at >= self.open_seconds:
+                self.canary_started_at = now
+                return True
+        self.skipped += 1
+        return False
+
+    def record(self, success: bool, connect_failure: bool = False) -> Optional[str]:
+        """
+        Records the result of a test
+
+        Args:
+            success: Whether the test succeeded
+            connect_failure: Whether the failure was a connection failure
+
+        Returns:
+            The new state if it changed, else None
+        """
+        now = time.time()
+        previous = self.state
+
+        if success or not connect_failure:
+            # The provider answered: any success or content failure resets the count
+            self.failures.clear()
+            if self.state != CIRCUIT_CLOSED:
+                self.state = CIRCUIT_CLOSED
+                self.opened_at = None
+                self.canary_started_at = None
+        else:
+            self.failures.append(now)
+            while self.failures and now - self.failures[0] > self.window:
+                self.failures.popleft()
+            if self.state == CIRCUIT_HALF_OPEN or len(self.failures) >= self.threshold:
+                self.state = CIRCUIT_OPEN
+                self.opened_at = now
+                self.canary_started_at = None
+
+        return self.state if self.state != previous else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary"""
+        return {
+            'state': self.state,
+            'recent_failures': len(self.failures),
+            'opened_at': self.opened_at,
+            'skipped': self.skipped
+        }
+
+
+class ProviderCircuitBreakers:
+    """Circuit breakers of all providers (thread-safe)"""
+
+    def __init__(self, threshold: int = CIRCUIT_FAILURE_THRESHOLD, window: int = CIRCUIT_WINDOW_SECONDS,
+                 open_seconds: int = CIRCUIT_OPEN_SECONDS):
+        self.threshold = threshold
+        self.window = window
+        self.open_seconds = open_seconds
+        self._breakers: Dict[Any, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, provider) -> CircuitBreaker:
+        if provider not in self._breakers:
+            self._breakers[provider] = CircuitBreaker(self.threshold, self.window, self.open_seconds)
+        return self._breakers[provider]
+
+    def allow(self, stream: Dict[str, Any]) -> bool:
+        """Whether a stream may be tested (streams without provider are always allowed)"""
+        provider = stream_provider(stream)
+        if provider is None:
+            return True
+        with self._lock:
+            return self._get(provider).allow()
+
+    def record(self, stream: Dict[str, Any], success: bool, message: Optional[str] = None):
+        """Records the result of a stream test for its provider"""
+        provider = stream_provider(stream)
+        if provider is None:
+            return
+        with self._lock:
+            changed = self._get(provider).record(success, is_connect_failure(message))
+        if changed == CIRCUIT_OPEN:
+            print(f"⛔ Circuit opened for M3U account {provider}: {self.threshold} consecutive connection "
+                  f"failures, deferring its streams for {self.open_seconds}s")
+        elif changed == CIRCUIT_CLOSED:
+            print(f"✅ Circuit closed for M3U account {provider}: provider is answering again")
+
+    def open_providers(self) -> list:
+        """Providers whose circuit is not closed"""
+        with self._lock:
+            return [provider for provider, breaker in self._breakers.items() if breaker.state != CIRCUIT_CLOSED]
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """State of every provider's circuit"""
+        with self._lock:
+            return {str(provider): breaker.to_dict() for provider, breaker in self._breakers.items()}
+
+
+# Breakers shared by every execution of the process, so an outage seen by one
+# run (or the stats refresher) also protects the next ones
+provider_breakers = ProviderCircuitBreakers()
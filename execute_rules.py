@@ -6,8 +6,7 @@ Execute auto-assignment and sorting rules from command line
 import argparse
 import sys
 import os
-import json
-from datetime import datetime, timezone
+from datetime import datetime
 from typing import List, Optional
 from dotenv import load_dotenv
 
@@ -20,35 +19,10 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 from models import RulesManager, StreamMatcher, AutoAssignmentRule
 from stream_sorter_models import SortingRulesManager, StreamSorter, SortingRule
 from api.dispatcharr_client import DispatcharrClient
-
-# M3U refresh state file
-M3U_REFRESH_STATE_FILE = 'm3u_refresh_state.json'
-
-def load_m3u_refresh_state():
-    """Load M3U refresh state from file"""
-    if os.path.exists(M3U_REFRESH_STATE_FILE):
-        try:
-            with open(M3U_REFRESH_STATE_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            pass
-    return {"last_refresh": None}
-
-def save_m3u_refresh_state(state):
-    """Save M3U refresh state to file"""
-    try:
-        with open(M3U_REFRESH_STATE_FILE, 'w') as f:
-            json.dump(state, f, indent=2)
-    except Exception as e:
-        print(f"Error saving M3U refresh state: {e}")
-
-def update_m3u_refresh_time():
-    """Update the last M3U refresh timestamp"""
-    state = load_m3u_refresh_state()
-    # Always save in UTC
-    utc_now = datetime.now(timezone.utc)
-    state["last_refresh"] = utc_now.isoformat().replace('+00:00', 'Z')
-    save_m3u_refresh_state(state)
+from checkpoints import TestCheckpoint, assignment_checkpoint_scope
+from catalog import CatalogSnapshot
+from stream_test_planner import TestBudget, TestPlan
+from profile_sync import ProfileSync
 
 
 class RuleExecutor:
@@ -64,13 +38,22 @@ class RuleExecutor:
         self.assignment_manager = RulesManager()
         self.sorting_manager = SortingRulesManager(dispatcharr_client=self.dispatcharr_client)
         
-    def execute_assignment_rules(self, rule_ids: Optional[List[int]] = None, verbose: bool = False) -> dict:
+    def new_catalog(self) -> CatalogSnapshot:
+        """Creates a catalog snapshot for a run (shared by all of its phases)"""
+        return CatalogSnapshot(self.dispatcharr_client)
+    
+    def execute_assignment_rules(self, rule_ids: Optional[List[int]] = None, verbose: bool = False,
+                                 resume: bool = False, catalog: Optional[CatalogSnapshot] = None,
+                                 budget: Optional[TestBudget] = None) -> dict:
         """
         Execute auto-assignment rules
         
         Args:
             rule_ids: List of specific rule IDs to execute (None = all enabled rules)
             verbose: Print detailed progress information
+            resume: Continue interrupted test phases from their checkpoints
+            catalog: Catalog snapshot of the run (a new one is created if None)
+            budget: Test budget of the run (None = unlimited); streams that don't fit are deferred
             
         Returns:
             Dictionary with execution statistics
@@ -79,18 +62,12 @@ class RuleExecutor:
         print("EXECUTING AUTO-ASSIGNMENT RULES")
         print("="*80 + "\n")
         
-        # Refresh M3U sources before executing rules
-        print("🔄 Refreshing M3U sources...")
-        try:
-            refresh_result = self.dispatcharr_client.refresh_m3u_sources()
-            # Update the refresh timestamp
-            update_m3u_refresh_time()
-            print("✅ M3U sources refreshed successfully")
-            if verbose:
-                print(f"   Refresh result: {refresh_result}")
-        except Exception as e:
-            print(f"⚠️  Warning: Failed to refresh M3U sources: {e}")
-            print("   Continuing with rule execution...")
+        catalog = catalog or self.new_catalog()
+        calls_before = catalog.upstream_calls
+        budget = budget or TestBudget()
+        
+        # Refresh M3U sources and wait for Dispatcharr to process them (once per run)
+        catalog.refresh_m3u_sources(verbose)
         
         print()  # Add blank line
         
@@ -105,7 +82,8 @@ class RuleExecutor:
         
         if not rules_to_execute:
             print("⚠️  No rules to execute")
-            return {'total_rules': 0, 'successful': 0, 'failed': 0, 'total_streams_added': 0, 'total_matches': 0}
+            return {'total_rules': 0, 'successful': 0, 'failed': 0, 'total_streams_added': 0, 'total_matches': 0,
+                    'tests_deferred': 0, 'upstream_calls': catalog.upstream_calls - calls_before}
         
         print(f"📋 Found {len(rules_to_execute)} rule(s) to execute\n")
         
@@ -113,6 +91,9 @@ class RuleExecutor:
         total_matches = 0
         successful_rules = 0
         failed_rules = 0
+        tests_deferred = 0
+        # Profile states of the rules' channels, sent in bulk after all rules ran
+        profile_sync = ProfileSync(self.dispatcharr_client)
         
         for idx, rule in enumerate(rules_to_execute, 1):
             print(f"[{idx}/{len(rules_to_execute)}] Executing rule: {rule.name} (ID: {rule.id})")
@@ -120,7 +101,7 @@ class RuleExecutor:
             
             try:
                 # Get channel info
-                channel = self.dispatcharr_client.get_channel(rule.channel_id)
+                channel = catalog.get_channel(rule.channel_id)
                 if not channel:
                     print(f"    ❌ Error: Channel {rule.channel_id} not found")
                     failed_rules += 1
@@ -131,13 +112,15 @@ class RuleExecutor:
                 # Load all streams
                 if verbose:
                     print(f"    Loading streams...")
-                streams = self.dispatcharr_client.get_streams()
+                streams = catalog.get_streams()
                 
                 if verbose:
                     print(f"    Found {len(streams)} total streams")
                 
                 # Test streams if required
                 failed_test_stream_ids = set()  # Track streams that failed testing
+                checkpoint = None
+                deferred = 0
                 if rule.test_streams_before_sorting:
                     if verbose:
                         print(f"    Testing streams to get stats...")
@@ -163,47 +146,91 @@ class RuleExecutor:
                     if verbose:
                         print(f"    {len(basic_matches)} stream(s) passed basic filtering (including forced includes, excluding forced excludes)")
                     
-                    # Test streams
+                    # Checkpoint the test phase so an interrupted run can be resumed
+                    scope = assignment_checkpoint_scope(rule.id)
+                    checkpoint = TestCheckpoint.load(scope) if resume else None
+                    if checkpoint:
+                        failed_test_stream_ids.update(checkpoint.failed_ids())
+                        print(f"    ↩️  Resuming run {checkpoint.run_id}: "
+                              f"{len(checkpoint.completed)}/{len(checkpoint.candidates)} stream(s) already tested")
+                    else:
+                        checkpoint = TestCheckpoint.start(scope, [s['id'] for s in basic_matches])
+                    
+                    # Select the streams that need testing
                     tested = 0
                     failed = 0
                     skipped = 0
+                    resumed = 0
+                    streams_to_test = []
                     
                     for stream in basic_matches:
-                        stream_stats = stream.get('stream_stats')
+                        if checkpoint.is_completed(stream['id']):
+                            resumed += 1
+                            continue
                         
                         # Check if we need to test
                         needs_test = StreamMatcher._needs_stream_testing(
-                            stream_stats,
+                            stream.get('stream_stats'),
                             stream.get('stream_stats_updated_at'),
                             rule.force_retest_old_streams,
                             rule.retest_days_threshold
                         )
                         
                         if needs_test:
+                            streams_to_test.append(stream)
+                        else:
+                            skipped += 1
+                    
+                    # Test in order of value while the budget allows (streams matching
+                    # with their current stats first among streams of similar age)
+                    def record_reused(stream, result):
+                        """Checkpoints a stream that got the result of a URL already tested in this run"""
+                        if not result.get('success'):
+                            failed_test_stream_ids.add(stream['id'])
+                        checkpoint.record(stream['id'], bool(result.get('success')), result.get('message'),
+                                          save=False)
+                    
+                    plan = TestPlan(
+                        streams_to_test, budget,
+                        lambda s: 1.0 if StreamMatcher._stream_matches_rule(rule, s) else 0.0,
+                        registry=catalog.test_registry, on_reuse=record_reused
+                    )
+                    # Results are saved in the checkpoint once their stats have been written
+                    catalog.stats_buffer.add_flush_listener(checkpoint.commit)
+                    try:
+                        for stream in plan:
                             if verbose:
                                 print(f"      Testing: {stream.get('name', 'unknown')} (ID: {stream.get('id')})")
                             
-                            test_result = self.dispatcharr_client.test_stream(stream['id'])
-                            if test_result and test_result.get('success'):
+                            test_result = catalog.test_registry.test(stream['id'], stream, probe_mode=rule.probe_mode)
+                            test_succeeded = bool(test_result and test_result.get('success'))
+                            test_message = test_result.get('message') if test_result else 'No result'
+                            checkpoint.record(stream['id'], test_succeeded, test_message, save=False)
+                            plan.record_result(stream, test_succeeded, test_message)
+                            if test_succeeded:
                                 tested += 1
                             else:
                                 failed += 1
-                                failed_test_stream_ids.add(stream['id'])  # Track failed streams
-                                # Clear stream stats for failed streams
-                                try:
-                                    self.dispatcharr_client.clear_stream_stats(stream['id'])
-                                    print(f"        ✅ Cleared stats for failed stream {stream['id']}")
-                                except Exception as e:
-                                    print(f"        ❌ Failed to clear stats for stream {stream['id']}: {e}")
+                                failed_test_stream_ids.add(stream['id'])  # Track failed streams (stats cleared by test_stream)
                                 print(f"        ❌ Test failed for stream {stream['id']}: {test_result.get('message', 'Unknown error') if test_result else 'No result'}")
-                        else:
-                            skipped += 1
+                    finally:
+                        # The tested streams of the snapshot already carry their new stats; write
+                        # them to Dispatcharr, also when the run is cancelled
+                        self._flush_stats(catalog, verbose)
+                        catalog.stats_buffer.remove_flush_listener(checkpoint.commit)
+                    
+                    deferred = len(plan.deferred)
+                    tests_deferred += deferred
+                    if deferred:
+                        print(f"    ⏭️  {plan.describe_deferred()}; evaluating with their current stats")
                     
                     if verbose or tested > 0 or failed > 0:
                         print(f"    Stream testing: {tested} tested, {failed} failed, {skipped} skipped")
+                    if resumed:
+                        print(f"    Resumed from checkpoint: {resumed} stream(s) not retested")
                     
-                    # Reload streams with updated stats
-                    streams = self.dispatcharr_client.get_streams()
+                    if plan.reused:
+                        print(f"    ♻️  {len(plan.reused)} stream(s) got the result of a URL already tested in this run")
                 
                 # Find matching streams
                 matches = StreamMatcher.evaluate_rule(rule, streams, failed_test_stream_ids)
@@ -215,9 +242,10 @@ class RuleExecutor:
                         # Clear existing streams
                         if verbose:
                             print(f"    Removing existing streams from channel...")
-                        channel_streams = self.dispatcharr_client.get_channel_streams(rule.channel_id)
+                        channel_streams = catalog.get_channel_streams(rule.channel_id)
                         for stream in channel_streams:
                             self.dispatcharr_client.remove_stream_from_channel(rule.channel_id, stream['id'])
+                            catalog.remove_channel_stream(rule.channel_id, stream['id'])
                     
                     # Add matching streams
                     added = 0
@@ -231,21 +259,49 @@ class RuleExecutor:
                         )
                         if success:
                             added += 1
+                            # Keep the snapshot in sync so sorting sees the new membership
+                            catalog.add_channel_stream(rule.channel_id, stream['id'])
                     
                     print(f"    ✅ Added {added} stream(s) to channel")
                     total_streams_added += added
                     total_matches += len(matches)
                     successful_rules += 1
                 else:
+                    added = 0
                     print(f"    ℹ️  No streams to add")
                     successful_rules += 1
                 
+                # Enabled in its profiles if streams were added, else disabled
+                try:
+                    _, missing_profiles = profile_sync.apply_rule_outcome(rule, added)
+                    for profile_name in missing_profiles:
+                        print(f"    ⚠️  Profile \"{profile_name}\" not found")
+                except Exception as e:
+                    print(f"    ⚠️  Could not read channel profiles: {str(e)}")
+                
+                # Rule finished: its test phase no longer needs resuming (unless tests were deferred)
+                if checkpoint and not deferred:
+                    checkpoint.discard()
+                
             except Exception as e:
                 print(f"    ❌ Error: {str(e)}")
                 failed_rules += 1
             
             print()  # Blank line between rules
         
+        # One bulk update per profile for all rules
+        profile_summary = {'enabled': 0, 'disabled': 0, 'unchanged': 0, 'requests': 0, 'errors': []}
+        if profile_sync.pending:
+            print(f"👥 Updating {profile_sync.pending} channel profile state(s)...")
+            try:
+                profile_summary = profile_sync.flush()
+            except Exception as e:
+                print(f"    ❌ Error updating channel profiles: {str(e)}")
+            for error in profile_summary['errors']:
+                print(f"    ❌ {error}")
+            print(f"    ✅ Profiles: {profile_summary['enabled']} enabled, {profile_summary['disabled']} disabled, "
+                  f"{profile_summary['unchanged']} already up to date ({profile_summary['requests']} request(s))\n")
+        
         # Summary
         print("="*80)
         print("AUTO-ASSIGNMENT SUMMARY")
@@ -255,6 +311,9 @@ class RuleExecutor:
         print(f"Failed: {failed_rules}")
         print(f"Total matches found: {total_matches}")
         print(f"Total streams added: {total_streams_added}")
+        if tests_deferred:
+            print(f"Tests deferred by budget: {tests_deferred} (run again or use --resume to test them)")
+        print(f"Upstream API calls: {catalog.upstream_calls - calls_before}")
         print("="*80 + "\n")
         
         return {
@@ -262,16 +321,24 @@ class RuleExecutor:
             'successful': successful_rules,
             'failed': failed_rules,
             'total_matches': total_matches,
-            'total_streams_added': total_streams_added
+            'total_streams_added': total_streams_added,
+            'tests_deferred': tests_deferred,
+            'profiles_enabled': profile_summary['enabled'],
+            'profiles_disabled': profile_summary['disabled'],
+            'upstream_calls': catalog.upstream_calls - calls_before
         }
     
-    def execute_sorting_rules(self, rule_ids: Optional[List[int]] = None, verbose: bool = False) -> dict:
+    def execute_sorting_rules(self, rule_ids: Optional[List[int]] = None, verbose: bool = False,
+                              catalog: Optional[CatalogSnapshot] = None,
+                              budget: Optional[TestBudget] = None) -> dict:
         """
         Execute sorting rules
         
         Args:
             rule_ids: List of specific rule IDs to execute (None = all enabled rules)
             verbose: Print detailed progress information
+            catalog: Catalog snapshot of the run (a new one is created if None)
+            budget: Test budget of the run (None = unlimited); streams that don't fit are deferred
             
         Returns:
             Dictionary with execution statistics
@@ -280,15 +347,13 @@ class RuleExecutor:
         print("EXECUTING SORTING RULES")
         print("="*80 + "\n")
         
-        # Refresh M3U sources before executing rules
-        print("🔄 Refreshing M3U sources...")
-        try:
-            self.dispatcharr_client.refresh_m3u_sources()
-            # Update the refresh timestamp
-            update_m3u_refresh_time()
-            print("✅ M3U sources refreshed successfully\n")
-        except Exception as e:
-            print(f"⚠️  Failed to refresh M3U sources: {e}\n")
+        catalog = catalog or self.new_catalog()
+        calls_before = catalog.upstream_calls
+        budget = budget or TestBudget()
+        
+        # Refresh M3U sources and wait for Dispatcharr to process them (once per run)
+        catalog.refresh_m3u_sources(verbose)
+        print()
         
         # Load rules
         all_rules = self.sorting_manager.load_rules()
@@ -301,13 +366,15 @@ class RuleExecutor:
         
         if not rules_to_execute:
             print("⚠️  No rules to execute")
-            return {'total_rules': 0, 'successful': 0, 'failed': 0, 'total_channels_sorted': 0}
+            return {'total_rules': 0, 'successful': 0, 'failed': 0, 'total_channels_sorted': 0,
+                    'tests_deferred': 0, 'upstream_calls': catalog.upstream_calls - calls_before}
         
         print(f"📋 Found {len(rules_to_execute)} rule(s) to execute\n")
         
         total_channels_sorted = 0
         successful_rules = 0
         failed_rules = 0
+        tests_deferred = 0
         
         for idx, rule in enumerate(rules_to_execute, 1):
             print(f"[{idx}/{len(rules_to_execute)}] Executing rule: {rule.name} (ID: {rule.id})")
@@ -316,7 +383,7 @@ class RuleExecutor:
                 # Determine target channels
                 if rule.all_channels:
                     # Apply to all channels
-                    all_channels = self.dispatcharr_client.get_channels()
+                    all_channels = catalog.get_channels()
                     channel_ids = [ch['id'] for ch in all_channels]
                     print(f"    Target channels: All ({len(channel_ids)} channel(s))")
                 elif rule.channel_ids:
@@ -341,7 +408,7 @@ class RuleExecutor:
                         continue
                 else:
                     # Default: apply to all channels
-                    all_channels = self.dispatcharr_client.get_channels()
+                    all_channels = catalog.get_channels()
                     channel_ids = [ch['id'] for ch in all_channels]
                     print(f"    Target channels: All ({len(channel_ids)} channel(s))")
                 
@@ -351,16 +418,13 @@ class RuleExecutor:
                         print(f"    Testing streams to get stats...")
                     
                     # Get all streams
-                    streams = self.dispatcharr_client.get_streams()
+                    streams = catalog.get_streams()
                     
-                    # Get streams that belong to target channels
-                    channel_stream_ids = set()
-                    for channel_id in channel_ids:
-                        channel_streams = self.dispatcharr_client.get_channel_streams(channel_id)
-                        channel_stream_ids.update(s['id'] for s in channel_streams)
+                    # Get streams that belong to target channels (with their best position)
+                    channel_positions = self._channel_stream_positions(catalog, channel_ids)
                     
                     # Filter to only test channel streams
-                    streams_to_test = [s for s in streams if s['id'] in channel_stream_ids]
+                    streams_to_test = [s for s in streams if s['id'] in channel_positions]
                     
                     if verbose:
                         print(f"    {len(streams_to_test)} stream(s) in target channels")
@@ -369,33 +433,50 @@ class RuleExecutor:
                     failed = 0
                     skipped = 0
                     
+                    needs_testing = []
                     for stream in streams_to_test:
-                        stream_stats = stream.get('stream_stats')
-                        
                         # Check if we need to test
-                        needs_test = StreamSorter._needs_stream_testing(
-                            stream_stats,
+                        if StreamSorter._needs_stream_testing(
+                            stream.get('stream_stats'),
                             rule.force_retest_old_streams,
                             rule.retest_days_threshold
-                        )
-                        
-                        if needs_test:
+                        ):
+                            needs_testing.append(stream)
+                        else:
+                            skipped += 1
+                    
+                    # Test in order of value while the budget allows (streams near the
+                    # top of their channels first among streams of similar age)
+                    plan = TestPlan(needs_testing, budget, lambda s: 1.0 / (1 + channel_positions[s['id']]),
+                                    registry=catalog.test_registry)
+                    try:
+                        for stream in plan:
                             if verbose:
                                 print(f"      Testing: {stream.get('name', 'unknown')}")
                             
-                            success = self.dispatcharr_client.test_stream(stream['id'])
+                            result = catalog.test_registry.test(stream['id'], stream, probe_mode=rule.probe_mode)
+                            success = bool(result and result.get('success'))
+                            plan.record_result(stream, success, result.get('message') if result else None)
                             if success:
                                 tested += 1
                             else:
                                 failed += 1
-                        else:
-                            skipped += 1
+                    finally:
+                        # The tested streams of the snapshot already carry their new stats; write
+                        # them to Dispatcharr, also when the run is cancelled or a test raises
+                        self._flush_stats(catalog, verbose)
                     
                     if verbose or tested > 0 or failed > 0:
                         print(f"    Stream testing: {tested} tested, {failed} failed, {skipped} skipped")
+                    if plan.deferred:
+                        tests_deferred += len(plan.deferred)
+                        print(f"    ⏭️  {plan.describe_deferred()}; sorting with their current stats")
+                    
+                    if plan.reused:
+                        print(f"    ♻️  {len(plan.reused)} stream(s) got the result of a URL already tested in this run")
                 
                 # Get M3U accounts for stream enrichment
-                m3u_accounts = self.dispatcharr_client.get_m3u_accounts()
+                m3u_accounts = catalog.get_m3u_accounts()
                 m3u_accounts_dict = {account['id']: account for account in m3u_accounts}
                 
                 # Sort each channel
@@ -405,7 +486,7 @@ class RuleExecutor:
                         print(f"      Sorting channel {channel_id}...")
                     
                     # Get channel streams
-                    channel_streams = self.dispatcharr_client.get_channel_streams(channel_id)
+                    channel_streams = catalog.get_channel_streams(channel_id)
                     
                     if not channel_streams:
                         if verbose:
@@ -424,7 +505,7 @@ class RuleExecutor:
                     sorted_streams = StreamSorter.sort_streams(rule, channel_streams)
                     
                     # Update order in Dispatcharr
-                    channel = self.dispatcharr_client.get_channel(channel_id)
+                    channel = catalog.get_channel(channel_id)
                     if channel:
                         original_streams = channel.get('streams', [])
                         sorted_stream_ids = [s['id'] for s in sorted_streams]
@@ -478,6 +559,7 @@ class RuleExecutor:
                     
                     if success:
                         sorted_count += 1
+                        catalog.set_channel_streams(channel_id, sorted_stream_ids)
                         if verbose:
                             print(f"        ✓ Sorted {len(sorted_streams)} stream(s)")
                     else:
@@ -502,30 +584,66 @@ class RuleExecutor:
         print(f"Successful: {successful_rules}")
         print(f"Failed: {failed_rules}")
         print(f"Total channels sorted: {total_channels_sorted}")
+        if tests_deferred:
+            print(f"Tests deferred by budget: {tests_deferred}")
+        print(f"Upstream API calls: {catalog.upstream_calls - calls_before}")
         print("="*80 + "\n")
         
         return {
             'total_rules': len(rules_to_execute),
             'successful': successful_rules,
             'failed': failed_rules,
-            'total_channels_sorted': total_channels_sorted
+            'total_channels_sorted': total_channels_sorted,
+            'tests_deferred': tests_deferred,
+            'upstream_calls': catalog.upstream_calls - calls_before
         }
     
-    def execute_single_sorting_rule(self, rule: SortingRule, verbose: bool = False) -> dict:
+    @staticmethod
+    def _channel_stream_positions(catalog: CatalogSnapshot, channel_ids: List[int]) -> dict:
+        """
+        Gets the streams of the target channels with their best position in any of them
+        
+        Returns:
+            Dictionary of stream ID to position (0 = first stream of a channel)
+        """
+        positions = {}
+        for channel_id in channel_ids:
+            for position, stream_id in enumerate(catalog.get_channel(channel_id).get('streams', [])):
+                positions[stream_id] = min(position, positions.get(stream_id, position))
+        return positions
+    
+    @staticmethod
+    def _flush_stats(catalog: CatalogSnapshot, verbose: bool = False):
+        """Writes the stream stats buffered by a test phase to Dispatcharr"""
+        errors = catalog.stats_buffer.flush()
+        if verbose or errors:
+            summary = catalog.stats_buffer.summary()
+            print(f"    💾 Stream stats: {summary['written']} written, {summary['unchanged']} unchanged, "
+                  f"{summary['failed']} failed")
+    
+    def execute_single_sorting_rule(self, rule: SortingRule, verbose: bool = False,
+                                    catalog: Optional[CatalogSnapshot] = None,
+                                    budget: Optional[TestBudget] = None) -> dict:
         """
         Execute a single sorting rule
         
         Args:
             rule: The sorting rule to execute
             verbose: Print detailed progress information
+            catalog: Catalog snapshot shared with other rules of the run (a new one is created if None)
+            budget: Test budget shared with other rules of the run (None = unlimited)
             
         Returns:
             Dictionary with execution statistics for this rule
         """
+        catalog = catalog or self.new_catalog()
+        budget = budget or TestBudget()
+        tests_deferred = 0
+        
         # Determine target channels
         if rule.all_channels:
             # Apply to all channels
-            all_channels = self.dispatcharr_client.get_channels()
+            all_channels = catalog.get_channels()
             channel_ids = [ch['id'] for ch in all_channels]
             if verbose:
                 print(f"    Target channels: All ({len(channel_ids)} channel(s))")
@@ -542,7 +660,7 @@ class RuleExecutor:
                     print(f"    Target channels: {len(channel_ids)} from group(s)")
         
         # Get M3U accounts for stream enrichment
-        m3u_accounts = self.dispatcharr_client.get_m3u_accounts()
+        m3u_accounts = catalog.get_m3u_accounts()
         m3u_accounts_dict = {account['id']: account for account in m3u_accounts}
         
         if not channel_ids:
@@ -554,16 +672,13 @@ class RuleExecutor:
                 print(f"    Testing streams to get stats...")
             
             # Get all streams
-            streams = self.dispatcharr_client.get_streams()
+            streams = catalog.get_streams()
             
-            # Get streams that belong to target channels
-            channel_stream_ids = set()
-            for channel_id in channel_ids:
-                channel_streams = self.dispatcharr_client.get_channel_streams(channel_id)
-                channel_stream_ids.update(s['id'] for s in channel_streams)
+            # Get streams that belong to target channels (with their best position)
+            channel_positions = self._channel_stream_positions(catalog, channel_ids)
             
             # Filter to only test channel streams
-            streams_to_test = [s for s in streams if s['id'] in channel_stream_ids]
+            streams_to_test = [s for s in streams if s['id'] in channel_positions]
             
             if verbose:
                 print(f"    {len(streams_to_test)} stream(s) in target channels")
@@ -572,33 +687,48 @@ class RuleExecutor:
             failed = 0
             skipped = 0
             
+            needs_testing = []
             for stream in streams_to_test:
-                stream_stats = stream.get('stream_stats')
-                
                 # Check if we need to test
-                needs_test = StreamSorter._needs_stream_testing(
-                    stream_stats,
+                if StreamSorter._needs_stream_testing(
+                    stream.get('stream_stats'),
                     rule.force_retest_old_streams,
                     rule.retest_days_threshold
-                )
-                
-                if needs_test:
+                ):
+                    needs_testing.append(stream)
+                else:
+                    skipped += 1
+            
+            # Test in order of value while the budget allows
+            plan = TestPlan(needs_testing, budget, lambda s: 1.0 / (1 + channel_positions[s['id']]),
+                            registry=catalog.test_registry)
+            try:
+                for stream in plan:
                     # Test the stream
                     try:
-                        updated_stream = self.dispatcharr_client.update_stream(stream['id'], stream)
-                        if updated_stream and updated_stream.get('stream_stats'):
+                        result = catalog.test_registry.test(stream['id'], stream, probe_mode=rule.probe_mode)
+                        success = bool(result and result.get('success'))
+                        plan.record_result(stream, success, result.get('message') if result else None)
+                        if success:
                             tested += 1
                         else:
                             failed += 1
                     except Exception as e:
                         if verbose:
                             print(f"      ❌ Failed to test stream {stream['id']}: {str(e)}")
+                        plan.record_result(stream, False, str(e))
                         failed += 1
-                else:
-                    skipped += 1
+            finally:
+                # The tested streams of the snapshot already carry their new stats; write
+                # them to Dispatcharr, also when the run is cancelled or a test raises
+                self._flush_stats(catalog, verbose)
             
+            tests_deferred = len(plan.deferred)
             if verbose:
-                print(f"    Stream testing: {tested} tested, {skipped} skipped, {failed} failed")
+                print(f"    Stream testing: {tested} tested, {skipped} skipped, {failed} failed, {tests_deferred} deferred")
+            
+            if plan.reused:
+                print(f"    ♻️  {len(plan.reused)} stream(s) got the result of a URL already tested in this run")
         
         # Sort each channel
         sorted_count = 0
@@ -608,7 +738,7 @@ class RuleExecutor:
             
             try:
                 # Get channel streams
-                channel_streams = self.dispatcharr_client.get_channel_streams(channel_id)
+                channel_streams = catalog.get_channel_streams(channel_id)
                 
                 if not channel_streams:
                     if verbose:
@@ -627,7 +757,7 @@ class RuleExecutor:
                 sorted_streams = StreamSorter.sort_streams(rule, channel_streams)
                 
                 # Update order in Dispatcharr
-                channel = self.dispatcharr_client.get_channel(channel_id)
+                channel = catalog.get_channel(channel_id)
                 if channel:
                     original_streams = channel.get('streams', [])
                     sorted_stream_ids = [s['id'] for s in sorted_streams]
@@ -681,6 +811,7 @@ class RuleExecutor:
                 
                 if success:
                     sorted_count += 1
+                    catalog.set_channel_streams(channel_id, sorted_stream_ids)
                     if verbose:
                         print(f"        ✓ Sorted {len(sorted_streams)} stream(s)")
                 else:
@@ -691,7 +822,7 @@ class RuleExecutor:
                 if verbose:
                     print(f"        ❌ Error sorting channel {channel_id}: {str(e)}")
         
-        return {'channels_sorted': sorted_count}
+        return {'channels_sorted': sorted_count, 'tests_deferred': tests_deferred}
 
 
 def main():
@@ -718,6 +849,12 @@ Examples:
   
   # Execute specific sorting rules by ID
   python execute_rules.py --sorting --rule-ids 1 2
+  
+  # Resume an interrupted run (skips streams already tested)
+  python execute_rules.py --assignment --resume
+  
+  # Limit stream testing to 10 minutes and 50 tests (the rest is deferred)
+  python execute_rules.py --all --time-budget 600 --max-tests 50
         """
     )
     
@@ -751,9 +888,29 @@ Examples:
         action='store_true',
         help='Print detailed progress information'
     )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume interrupted stream testing from checkpoints (assignment rules)'
+    )
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        help='Seconds available for stream testing in this run (default: TEST_TIME_BUDGET, 0 = unlimited)'
+    )
+    parser.add_argument(
+        '--max-tests',
+        type=int,
+        help='Maximum stream tests in this run (default: TEST_MAX_TESTS, 0 = unlimited)'
+    )
     
     args = parser.parse_args()
     
+    try:
+        budget = TestBudget.from_values(args.time_budget, args.max_tests)
+    except ValueError as e:
+        parser.error(str(e))
+    
     # Print header
     print("\n" + "="*80)
     print("STREAM PLUS - RULE EXECUTION CLI")
@@ -766,16 +923,24 @@ Examples:
     # Execute rules based on arguments
     try:
         if args.all:
+            # Both phases share one catalog snapshot (and a single M3U refresh)
+            catalog = executor.new_catalog()
+            
             # Execute assignment rules first
             assignment_stats = executor.execute_assignment_rules(
                 rule_ids=args.rule_ids,
-                verbose=args.verbose
+                verbose=args.verbose,
+                resume=args.resume,
+                catalog=catalog,
+                budget=budget
             )
             
-            # Then execute sorting rules
+            # Then execute sorting rules (with what is left of the test budget)
             sorting_stats = executor.execute_sorting_rules(
                 rule_ids=args.rule_ids,
-                verbose=args.verbose
+                verbose=args.verbose,
+                catalog=catalog,
+                budget=budget
             )
             
             # Combined summary
@@ -786,18 +951,25 @@ Examples:
             print(f"Streams added: {assignment_stats['total_streams_added']}")
             print(f"Sorting rules: {sorting_stats['successful']}/{sorting_stats['total_rules']} successful")
             print(f"Channels sorted: {sorting_stats['total_channels_sorted']}")
+            if budget.limited:
+                deferred = assignment_stats['tests_deferred'] + sorting_stats['tests_deferred']
+                print(f"Stream tests: {budget.tests_run} run, {deferred} deferred by budget")
+            print(f"Upstream API calls: {catalog.upstream_calls} (M3U refresh: {'yes' if catalog.m3u_refreshed else 'no'})")
             print("="*80 + "\n")
             
         elif args.assignment:
             executor.execute_assignment_rules(
                 rule_ids=args.rule_ids,
-                verbose=args.verbose
+                verbose=args.verbose,
+                resume=args.resume,
+                budget=budget
             )
             
         elif args.sorting:
             executor.execute_sorting_rules(
                 rule_ids=args.rule_ids,
-                verbose=args.verbose
+                verbose=args.verbose,
+                budget=budget
             )
         
         print(f"✅ Completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
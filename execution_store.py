@@ -0,0 +1,390 @@
+"""
+Shared execution state store for Stream Plus
+
+Execution progress events and execution state are kept in a SQLite database
+instead of process-local queues, so that every web worker process can serve
+SSE progress for any execution, no matter which worker started it.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# Execution store database file
+EXECUTION_STORE_FILE = os.getenv('EXECUTION_STORE_FILE', 'execution_store.db')
+
+# Maximum number of events kept per execution (oldest events are dropped first)
+EXECUTION_EVENT_BUFFER_SIZE = int(os.getenv('EXECUTION_EVENT_BUFFER_SIZE', '2000'))
+
+# Seconds a finished execution and its events are kept for replay
+EXECUTION_EVENT_TTL = int(os.getenv('EXECUTION_EVENT_TTL', '3600'))
+
+# Number of appended events between two ring buffer trims
+EVENT_TRIM_INTERVAL = 50
+
+# Maximum number of aggregated progress events emitted per second
+PROGRESS_EVENT_RATE = float(os.getenv('PROGRESS_EVENT_RATE', '4'))
+
+# Event channels: milestones, failures and aggregated progress go to the main
+# channel; per-stream events go to the opt-in verbose channel
+MAIN_CHANNEL = 'main'
+VERBOSE_CHANNEL = 'verbose'
+
+# Per-stream event types only delivered to verbose subscribers
+VERBOSE_EVENT_TYPES = {'test_progress', 'test_success'}
+
+
+class ExecutionStore:
+    """SQLite-backed store for execution state and progress events"""
+
+    def __init__(self, db_file: Optional[str] = None):
+        """
+        Initialize the execution store
+
+        Args:
+            db_file: Path to the SQLite database file (default: EXECUTION_STORE_FILE)
+        """
+        self.db_file = db_file or EXECUTION_STORE_FILE
+        self._local = threading.local()
+        self._ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the SQLite connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        """Creates the store tables if they don't exist"""
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS executions (
+                execution_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                finished_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS execution_events (
+                event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                execution_id TEXT NOT NULL,
+                channel TEXT NOT NULL DEFAULT 'main',
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_execution_events_execution
+                ON execution_events (execution_id, event_id);
+            CREATE TABLE IF NOT EXISTS execution_event_trims (
+                execution_id TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                dropped_through INTEGER NOT NULL,
+                PRIMARY KEY (execution_id, channel)
+            );
+        """)
+        # Stores created before event channels existed
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(execution_events)')]
+        if 'channel' not in columns:
+            conn.execute(f"ALTER TABLE execution_events ADD COLUMN channel TEXT NOT NULL DEFAULT '{MAIN_CHANNEL}'")
+
+    def create_execution(self, kind: str, execution_id: Optional[str] = None) -> str:
+        """
+        Registers a new running execution
+
+        Args:
+            kind: Execution type (auto_assignment, sorting, sorting_all)
+            execution_id: Optional ID to use (a new UUID is generated otherwise)
+
+        Returns:
+            The execution ID
+        """
+        execution_id = execution_id or str(uuid.uuid4())
+        # Opportunistically evict executions whose replay window has expired
+        self.purge_expired()
+        self._connect().execute(
+            'INSERT INTO executions (execution_id, kind, status, owner, created_at) VALUES (?, ?, ?, ?, ?)',
+            (execution_id, kind, 'running', f'{os.getpid()}', time.time())
+        )
+        return execution_id
+
+    def get_execution(self, execution_id: str) -> Optional[Dict[str, Any]]:
+        """Gets the state of an execution, or None if it doesn't exist"""
+        row = self._connect().execute(
+            'SELECT * FROM executions WHERE execution_id = ?', (execution_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def finish_execution(self, execution_id: str, status: str = 'done'):
+        """Marks an execution as finished"""
+        self._connect().execute(
+            'UPDATE executions SET status = ?, finished_at = ? WHERE execution_id = ?',
+            (status, time.time(), execution_id)
+        )
+
+    def append_event(self, execution_id: str, message: Dict[str, Any], channel: str = MAIN_CHANNEL) -> int:
+        """
+        Appends a progress event to an execution
+
+        Args:
+            execution_id: Execution the event belongs to
+            message: Event payload
+            channel: Event channel (MAIN_CHANNEL or VERBOSE_CHANNEL)
+
+        Returns:
+            The ID of the stored event
+        """
+        cursor = self._connect().execute(
+            'INSERT INTO execution_events (execution_id, channel, payload, created_at) VALUES (?, ?, ?, ?)',
+            (execution_id, channel, json.dumps(message), time.time())
+        )
+        return cursor.lastrowid
+
+    def trim_events(self, execution_id: str, capacity: int = EXECUTION_EVENT_BUFFER_SIZE,
+                    channel: str = MAIN_CHANNEL):
+        """
+        Drops the oldest events of an execution channel so at most `capacity` remain
+
+        Event IDs keep increasing, so the buffer behaves as a ring: readers
+        resuming from a dropped ID continue from the oldest retained event.
+        Channels are trimmed separately so verbose events never push
+        milestones out of the buffer. The ID of the newest dropped event is
+        kept per channel (see get_dropped_through).
+        """
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT event_id FROM execution_events WHERE execution_id = ? AND channel = ? '
+            'ORDER BY event_id DESC LIMIT 1 OFFSET ?',
+            (execution_id, channel, capacity - 1)
+        ).fetchone()
+        if row:
+            dropped = conn.execute(
+                'SELECT MAX(event_id) AS event_id FROM execution_events '
+                'WHERE execution_id = ? AND channel = ? AND event_id < ?',
+                (execution_id, channel, row['event_id'])
+            ).fetchone()['event_id']
+            if dropped is None:
+                return
+            conn.execute(
+                'DELETE FROM execution_events WHERE execution_id = ? AND channel = ? AND event_id < ?',
+                (execution_id, channel, row['event_id'])
+            )
+            conn.execute(
+                'INSERT INTO execution_event_trims (execution_id, channel, dropped_through) VALUES (?, ?, ?) '
+                'ON CONFLICT (execution_id, channel) DO UPDATE SET '
+                'dropped_through = MAX(dropped_through, excluded.dropped_through)',
+                (execution_id, channel, dropped)
+            )
+
+    def get_dropped_through(self, execution_id: str, channels: Tuple[str, ...] = (MAIN_CHANNEL,)) -> Optional[int]:
+        """
+        Gets the ID of the newest event trimmed from the given channels of an execution
+
+        Event IDs are shared by all channels, so a gap in the IDs a channel
+        subscriber saw doesn't mean events were lost; a subscriber that resumes
+        after event N missed events only if this ID is greater than N.
+
+        Returns:
+            The ID, or None if nothing was trimmed
+        """
+        placeholders = ', '.join('?' for _ in channels)
+        row = self._connect().execute(
+            f'SELECT MAX(dropped_through) AS event_id FROM execution_event_trims '
+            f'WHERE execution_id = ? AND channel IN ({placeholders})',
+            (execution_id, *channels)
+        ).fetchone()
+        return row['event_id'] if row else None
+
+    def purge_expired(self, ttl: int = EXECUTION_EVENT_TTL) -> int:
+        """
+        Evicts finished executions (and their events) older than the TTL
+
+        Returns:
+            Number of executions evicted
+        """
+        conn = self._connect()
+        cutoff = time.time() - ttl
+        expired = [
+            row['execution_id'] for row in conn.execute(
+                'SELECT execution_id FROM executions WHERE finished_at IS NOT NULL AND finished_at < ?',
+                (cutoff,)
+            ).fetchall()
+        ]
+        for execution_id in expired:
+            conn.execute('DELETE FROM execution_events WHERE execution_id = ?', (execution_id,))
+            conn.execute('DELETE FROM execution_event_trims WHERE execution_id = ?', (execution_id,))
+            conn.execute('DELETE FROM executions WHERE execution_id = ?', (execution_id,))
+        return len(expired)
+
+    def get_events(self, execution_id: str, after_id: int = 0, limit: int = 500,
+                   channels: Tuple[str, ...] = (MAIN_CHANNEL,)) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Gets the events of an execution emitted after a given event ID
+
+        Args:
+            execution_id: Execution to read
+            after_id: Only events with a greater ID are returned
+            limit: Maximum number of events returned
+            channels: Event channels to include
+
+        Returns:
+            List of (event_id, message) tuples in emission order
+        """
+        placeholders = ', '.join('?' for _ in channels)
+        rows = self._connect().execute(
+            f'SELECT event_id, payload FROM execution_events '
+            f'WHERE execution_id = ? AND event_id > ? AND channel IN ({placeholders}) '
+            f'ORDER BY event_id LIMIT ?',
+            (execution_id, after_id, *channels, limit)
+        ).fetchall()
+        return [(row['event_id'], json.loads(row['payload'])) for row in rows]
+
+
+class ProgressAggregator:
+    """
+    Aggregates per-stream test events into periodic progress samples
+
+    Counters are rebuilt from the events the executors already publish
+    (test_start, test_progress, test_success, test_fail), so executors don't
+    need to know about aggregation.
+    """
+
+    def __init__(self, rate: float = PROGRESS_EVENT_RATE):
+        """
+        Initialize the aggregator
+
+        Args:
+            rate: Maximum number of progress samples per second
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.last_emit = 0.0
+        self.dirty = False
+        self.reset(0)
+
+    def reset(self, total: int):
+        """Starts a new test phase with `total` streams to test"""
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.current_stream = None
+        self.started_at = time.time()
+        # Completion timestamps used for the recent test rate
+        self.completions = deque(maxlen=20)
+        self.dirty = False
+
+    def update(self, message: Dict[str, Any]):
+        """Updates the counters from a published event"""
+        event_type = message.get('type')
+        if event_type == 'test_start':
+            self.reset(message.get('total_streams', 0))
+            return
+        if event_type == 'test_progress':
+            self.current_stream = message.get('stream_name') or self.current_stream
+        elif event_type == 'test_success':
+            self.succeeded += 1
+            self.completions.append(time.time())
+        elif event_type == 'test_fail':
+            self.failed += 1
+            self.completions.append(time.time())
+        else:
+            return
+        self.dirty = True
+
+    def is_due(self) -> bool:
+        """Whether a new progress sample should be emitted now"""
+        return self.dirty and time.time() - self.last_emit >= self.interval
+
+    def sample(self) -> Dict[str, Any]:
+        """Builds a progress event and marks the counters as emitted"""
+        self.last_emit = time.time()
+        self.dirty = False
+
+        completed = self.succeeded + self.failed
+        rate = 0.0
+        if len(self.completions) >= 2:
+            window = self.completions[-1] - self.completions[0]
+            if window > 0:
+                rate = (len(self.completions) - 1) / window
+        elif completed:
+            elapsed = time.time() - self.started_at
+            rate = completed / elapsed if elapsed > 0 else 0.0
+
+        remaining = max(self.total - completed, 0)
+        return {
+            'type': 'progress',
+            'completed': completed,
+            'total': self.total,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'rate': round(rate * 60, 2),  # streams per minute
+            'eta_seconds': round(remaining / rate) if rate > 0 else None,
+            'current_stream': self.current_stream,
+            'message': f'Tested {completed}/{self.total} streams'
+        }
+
+
+class ExecutionChannel:
+    """
+    Queue-like publisher used by background executors
+
+    put(message) stores a progress event; put(None) marks the execution as finished,
+    matching the termination signal the executors already send. Events are kept in
+    a bounded buffer of `capacity` entries per execution and channel.
+
+    Per-stream events (VERBOSE_EVENT_TYPES, or messages flagged with 'verbose')
+    only go to the verbose channel; the main channel gets milestones, failures
+    and aggregated 'progress' samples at most PROGRESS_EVENT_RATE times per second.
+    """
+
+    def __init__(self, store: ExecutionStore, execution_id: str, capacity: int = EXECUTION_EVENT_BUFFER_SIZE):
+        self.store = store
+        self.execution_id = execution_id
+        self.capacity = capacity
+        self.progress = ProgressAggregator()
+        self._appended = {MAIN_CHANNEL: 0, VERBOSE_CHANNEL: 0}
+
+    def _append(self, message: Dict[str, Any], channel: str = MAIN_CHANNEL):
+        """Stores an event and trims its channel buffer periodically"""
+        self.store.append_event(self.execution_id, message, channel)
+        self._appended[channel] += 1
+        if self._appended[channel] % EVENT_TRIM_INTERVAL == 0:
+            self.store.trim_events(self.execution_id, self.capacity, channel)
+
+    def _flush_progress(self, force: bool = False):
+        """Emits a progress sample if the counters changed and one is due"""
+        if self.progress.dirty and (force or self.progress.is_due()):
+            self._append(self.progress.sample())
+
+    def put(self, message: Optional[Dict[str, Any]]):
+        """Publishes a progress event (None finishes the execution)"""
+        try:
+            if message is None:
+                self._flush_progress(force=True)
+                for channel in self._appended:
+                    self.store.trim_events(self.execution_id, self.capacity, channel)
+                self.store.finish_execution(self.execution_id)
+                return
+
+            if message.pop('verbose', False) or message.get('type') in VERBOSE_EVENT_TYPES:
+                self.progress.update(message)
+                self._append(message, VERBOSE_CHANNEL)
+                self._flush_progress()
+            elif message.get('type') == 'test_fail':
+                self.progress.update(message)
+                self._append(message)
+                self._flush_progress()
+            else:
+                # Milestone: publish up-to-date counters before it
+                self._flush_progress(force=True)
+                self.progress.update(message)
+                self._append(message)
+        except sqlite3.Error as e:
+            print(f"Error publishing execution event for {self.execution_id}: {e}")
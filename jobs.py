@@ -0,0 +1,427 @@
+"""
+Durable job queue for Stream Plus rule executions
+
+Rule executions are stored as jobs in the execution store database and run by a
+bounded pool of worker threads. Any web worker process can claim queued jobs;
+the number of jobs running at the same time is capped globally. Running jobs
+send heartbeats, so jobs interrupted by a crash or restart are re-queued, and
+cancellation requests reach the owning process through the database.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+from api.dispatcharr_client import OperationCancelled, set_cancel_event
+from execution_store import ExecutionStore, ExecutionChannel, EXECUTION_EVENT_TTL
+
+# Worker threads per process
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+
+# Maximum number of jobs running at the same time across all processes
+JOB_MAX_CONCURRENT = int(os.getenv('JOB_MAX_CONCURRENT', '2'))
+
+# Seconds between heartbeats of running jobs
+JOB_HEARTBEAT_INTERVAL = int(os.getenv('JOB_HEARTBEAT_INTERVAL', '10'))
+
+# Seconds without heartbeat after which a running job is considered interrupted
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', '60'))
+
+# Maximum number of times a job is started (interrupted jobs are retried)
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+# Seconds between checks for queued jobs and cancellation requests
+JOB_POLL_INTERVAL = 1.0
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobChannel(ExecutionChannel):
+    """
+    Progress channel of a job
+
+    Raises OperationCancelled on publish once the job is cancelled, so executors
+    stop at their next progress update. The end of the execution is recorded by
+    the worker (with the final job state) instead of by put(None).
+    """
+
+    def __init__(self, store: ExecutionStore, execution_id: str, cancel_event: threading.Event):
+        super().__init__(store, execution_id)
+        self.cancel_event = cancel_event
+
+    def put(self, message: Optional[Dict[str, Any]]):
+        """Publishes a progress event; None flushes pending progress"""
+        if message is None:
+            try:
+                self._flush_progress(force=True)
+            except sqlite3.Error as e:
+                print(f"Error publishing execution event for {self.execution_id}: {e}")
+            return
+        if self.cancel_event.is_set():
+            raise OperationCancelled()
+        super().put(message)
+
+
+class JobManager:
+    """Persistent job queue with a bounded worker pool"""
+
+    def __init__(self, store: ExecutionStore, workers: int = JOB_WORKERS,
+                 max_concurrent: int = JOB_MAX_CONCURRENT):
+        """
+        Initialize the job manager
+
+        Args:
+            store: Execution store whose database also holds the jobs
+            workers: Worker threads started in this process
+            max_concurrent: Maximum running jobs across all processes
+        """
+        self.store = store
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.handlers: Dict[str, Callable] = {}
+        # kind -> function giving the arguments of a recovered job (see register)
+        self.recovery_args: Dict[str, Callable[[list], list]] = {}
+        self._local = threading.local()
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+        self._ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the SQLite connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.store.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        """Creates the jobs table if it doesn't exist"""
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                args TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                owner TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+        """)
+
+    def register(self, kind: str, handler: Callable, recovery_args: Optional[Callable[[list], list]] = None):
+        """
+        Registers the function that runs jobs of a kind
+
+        The handler receives the job arguments followed by the progress channel.
+
+        Args:
+            kind: Job kind
+            handler: Runs the jobs
+            recovery_args: Gives the arguments an interrupted job is queued again
+                with (e.g. to resume from its checkpoint); by default its original ones
+        """
+        self.handlers[kind] = handler
+        if recovery_args is not None:
+            self.recovery_args[kind] = recovery_args
+
+    def start(self):
+        """Recovers interrupted jobs and starts the worker and monitor threads"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        self.recover_interrupted_jobs(startup=True)
+
+        for index in range(self.workers):
+            threading.Thread(target=self._worker_loop, name=f'job-worker-{index + 1}', daemon=True).start()
+        threading.Thread(target=self._monitor_loop, name='job-monitor', daemon=True).start()
+        print(f"⚙️  Job workers started ({self.workers} thread(s), max {self.max_concurrent} running job(s))")
+
+    def submit(self, kind: str, args: tuple = ()) -> str:
+        """
+        Queues a job
+
+        Args:
+            kind: Registered job kind
+            args: JSON-serializable positional arguments for the handler
+
+        Returns:
+            The job ID (also the execution ID used for SSE progress)
+        """
+        if kind not in self.handlers:
+            raise ValueError(f'Unknown job kind: {kind}')
+
+        job_id = self.store.create_execution(kind)
+        self._connect().execute(
+            'INSERT INTO jobs (job_id, kind, args, status, created_at) VALUES (?, ?, ?, ?, ?)',
+            (job_id, kind, json.dumps(list(args)), JOB_QUEUED, time.time())
+        )
+        self._wakeup.set()
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Gets a job, or None if it doesn't exist"""
+        row = self._connect().execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Gets the most recent jobs"""
+        rows = self._connect().execute(
+            'SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,)
+        ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancels a job
+
+        Queued jobs are cancelled right away. Running jobs are flagged; the
+        process running them stops the execution and kills its ffmpeg/ffprobe
+        processes.
+
+        Returns:
+            The updated job, or None if it doesn't exist
+        """
+        conn = self._connect()
+        cursor = conn.execute(
+            'UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ? AND status = ?',
+            (JOB_CANCELLED, time.time(), job_id, JOB_QUEUED)
+        )
+        if cursor.rowcount:
+            self._publish_final(job_id, JOB_CANCELLED)
+        else:
+            conn.execute(
+                'UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = ?',
+                (job_id, JOB_RUNNING)
+            )
+            event = self._cancel_events.get(job_id)
+            if event:
+                event.set()
+        return self.get_job(job_id)
+
+    def recover_interrupted_jobs(self, startup: bool = False) -> int:
+        """
+        Re-queues running jobs whose process stopped sending heartbeats
+
+        On startup, jobs owned by a previous process with the same identity
+        (same host and PID after a container restart) are recovered right away.
+
+        Returns:
+            Number of jobs re-queued or failed
+        """
+        conn = self._connect()
+        stale_before = time.time() - JOB_STALE_AFTER
+        if startup:
+            rows = conn.execute(
+                'SELECT * FROM jobs WHERE status = ? AND (heartbeat_at < ? OR owner = ?)',
+                (JOB_RUNNING, stale_before, self.owner)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT * FROM jobs WHERE status = ? AND heartbeat_at < ?',
+                (JOB_RUNNING, stale_before)
+            ).fetchall()
+
+        recovered = 0
+        for row in rows:
+            job_id = row['job_id']
+            if row['cancel_requested']:
+                status = JOB_CANCELLED
+            elif row['attempts'] >= JOB_MAX_ATTEMPTS:
+                status = JOB_FAILED
+            else:
+                status = JOB_QUEUED
+
+            if status == JOB_QUEUED:
+                args = json.loads(row['args'])
+                if row['kind'] in self.recovery_args:
+                    args = list(self.recovery_args[row['kind']](args))
+                cursor = conn.execute(
+                    'UPDATE jobs SET status = ?, owner = NULL, args = ? '
+                    'WHERE job_id = ? AND status = ? AND owner IS ?',
+                    (JOB_QUEUED, json.dumps(args), job_id, JOB_RUNNING, row['owner'])
+                )
+                if cursor.rowcount:
+                    self.store.append_event(job_id, {
+                        'type': 'info',
+                        'message': '⚠️ Execution was interrupted and has been queued again'
+                    })
+            else:
+                cursor = conn.execute(
+                    'UPDATE jobs SET status = ?, error = ?, finished_at = ? '
+                    'WHERE job_id = ? AND status = ? AND owner IS ?',
+                    (status, 'Interrupted', time.time(), job_id, JOB_RUNNING, row['owner'])
+                )
+                if cursor.rowcount:
+                    self._publish_final(job_id, status, 'Execution was interrupted')
+
+            if cursor.rowcount:
+                recovered += 1
+                print(f"♻️  Recovered interrupted job {job_id} ({row['kind']}) -> {status}")
+
+        if recovered:
+            self._wakeup.set()
+        return recovered
+
+    def purge_expired(self, ttl: int = EXECUTION_EVENT_TTL) -> int:
+        """Deletes finished jobs older than the TTL"""
+        placeholders = ', '.join('?' for _ in FINISHED_STATES)
+        cursor = self._connect().execute(
+            f'DELETE FROM jobs WHERE status IN ({placeholders}) AND finished_at < ?',
+            (*FINISHED_STATES, time.time() - ttl)
+        )
+        return cursor.rowcount
+
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """Atomically claims the oldest queued job if the global limit allows it"""
+        conn = self._connect()
+        placeholders = ', '.join('?' for _ in self.handlers)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            running = conn.execute(
+                'SELECT COUNT(*) AS count FROM jobs WHERE status = ?', (JOB_RUNNING,)
+            ).fetchone()['count']
+            row = None
+            if running < self.max_concurrent and self.handlers:
+                row = conn.execute(
+                    f'SELECT * FROM jobs WHERE status = ? AND kind IN ({placeholders}) '
+                    f'ORDER BY created_at LIMIT 1',
+                    (JOB_QUEUED, *self.handlers)
+                ).fetchone()
+            if row:
+                now = time.time()
+                conn.execute(
+                    'UPDATE jobs SET status = ?, owner = ?, attempts = attempts + 1, '
+                    'started_at = ?, heartbeat_at = ? WHERE job_id = ?',
+                    (JOB_RUNNING, self.owner, now, now, row['job_id'])
+                )
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            print(f"Error claiming job: {e}")
+            return None
+        if not row:
+            return None
+        job = self._row_to_dict(row)
+        job.update(status=JOB_RUNNING, owner=self.owner, attempts=job['attempts'] + 1)
+        return job
+
+    def _worker_loop(self):
+        """Runs queued jobs one at a time"""
+        while True:
+            job = self._claim_next()
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._run_job(job)
+
+    def _run_job(self, job: Dict[str, Any]):
+        """Runs a claimed job and records its final state"""
+        job_id = job['job_id']
+        cancel_event = threading.Event()
+        self._cancel_events[job_id] = cancel_event
+        if job['cancel_requested']:
+            cancel_event.set()
+
+        status, error = JOB_DONE, None
+        print(f"▶️  Running job {job_id} ({job['kind']}, attempt {job['attempts']})")
+        set_cancel_event(cancel_event)
+        try:
+            handler = self.handlers[job['kind']]
+            handler(*job['args'], JobChannel(self.store, job_id, cancel_event))
+            if cancel_event.is_set():
+                status = JOB_CANCELLED
+        except OperationCancelled:
+            status = JOB_CANCELLED
+        except Exception as e:
+            status, error = JOB_FAILED, str(e)
+            traceback.print_exc()
+        finally:
+            set_cancel_event(None)
+            self._cancel_events.pop(job_id, None)
+
+        try:
+            self._connect().execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ? AND owner = ?',
+                (status, error, time.time(), job_id, self.owner)
+            )
+            self._publish_final(job_id, status, error)
+        except sqlite3.Error as e:
+            print(f"Error recording final state of job {job_id}: {e}")
+        print(f"⏹️  Job {job_id} finished: {status}")
+
+    def _publish_final(self, job_id: str, status: str, error: Optional[str] = None):
+        """Publishes the end of a job to its SSE subscribers"""
+        if status == JOB_CANCELLED:
+            self.store.append_event(job_id, {
+                'type': 'complete',
+                'success': False,
+                'cancelled': True,
+                'message': '⛔ Execution cancelled'
+            })
+        elif status == JOB_FAILED:
+            self.store.append_event(job_id, {'type': 'error', 'message': f'Execution failed: {error}'})
+        self.store.finish_execution(job_id, status)
+
+    def _monitor_loop(self):
+        """Propagates cancellation requests, sends heartbeats and recovers interrupted jobs"""
+        last_heartbeat = 0.0
+        while True:
+            time.sleep(JOB_POLL_INTERVAL)
+            try:
+                self._apply_cancel_requests()
+                if time.time() - last_heartbeat >= JOB_HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.time()
+                    self._connect().execute(
+                        'UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND owner = ?',
+                        (last_heartbeat, JOB_RUNNING, self.owner)
+                    )
+                    self.recover_interrupted_jobs()
+                    self.purge_expired()
+            except sqlite3.Error as e:
+                print(f"Job monitor error: {e}")
+
+    def _apply_cancel_requests(self):
+        """Sets the cancel event of local jobs cancelled from any process"""
+        if not self._cancel_events:
+            return
+        rows = self._connect().execute(
+            'SELECT job_id FROM jobs WHERE status = ? AND owner = ? AND cancel_requested = 1',
+            (JOB_RUNNING, self.owner)
+        ).fetchall()
+        for row in rows:
+            event = self._cancel_events.get(row['job_id'])
+            if event and not event.is_set():
+                print(f"⛔ Cancelling job {row['job_id']}")
+                event.set()
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        """Converts a jobs row to a dictionary"""
+        job = dict(row)
+        job['args'] = json.loads(job['args'])
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
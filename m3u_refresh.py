@@ -0,0 +1,220 @@
+"""
+M3U refresh coordination for Stream Plus rule executions
+
+Dispatcharr refreshes M3U accounts asynchronously: the refresh endpoint returns
+right away and the accounts are fetched and parsed in the background. The
+M3URefreshCoordinator triggers the refresh and then polls the accounts (with
+backoff) until every active account has finished, so rules are evaluated
+against the refreshed catalog. Refreshes are skipped when the last one is
+more recent than M3U_REFRESH_MAX_AGE_MINUTES.
+"""
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from api.dispatcharr_client import DispatcharrClient
+
+# M3U refresh state file (shared with the web UI)
+M3U_REFRESH_STATE_FILE = 'm3u_refresh_state.json'
+
+# Skip the refresh if the last one finished less than this many minutes ago (0 = always refresh)
+M3U_REFRESH_MAX_AGE_MINUTES = float(os.getenv('M3U_REFRESH_MAX_AGE_MINUTES', '0'))
+
+# Maximum seconds to wait for accounts to finish refreshing
+M3U_REFRESH_TIMEOUT = int(os.getenv('M3U_REFRESH_TIMEOUT', '600'))
+
+# Seconds after which an account that never started refreshing is considered done
+M3U_REFRESH_START_GRACE = int(os.getenv('M3U_REFRESH_START_GRACE', '60'))
+
+# Polling backoff (seconds)
+POLL_INITIAL_INTERVAL = 2.0
+POLL_MAX_INTERVAL = 30.0
+POLL_BACKOFF_FACTOR = 1.5
+
+# Account statuses reported by Dispatcharr while a refresh is running
+IN_PROGRESS_STATUSES = {'fetching', 'parsing', 'pending_setup', 'initializing', 'processing', 'refreshing'}
+
+
+def load_m3u_refresh_state(state_file: str = M3U_REFRESH_STATE_FILE) -> Dict[str, Any]:
+    """Load M3U refresh state from file"""
+    if os.path.exists(state_file):
+        try:
+            with open(state_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+    return {"last_refresh": None}
+
+
+def update_m3u_refresh_time(state_file: str = M3U_REFRESH_STATE_FILE):
+    """Update the last M3U refresh timestamp (always saved in UTC)"""
+    state = load_m3u_refresh_state(state_file)
+    state["last_refresh"] = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+    try:
+        with open(state_file, 'w') as f:
+            json.dump(state, f, indent=2)
+    except OSError as e:
+        print(f"Error saving M3U refresh state: {e}")
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parses an ISO timestamp from Dispatcharr or the state file"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class M3URefreshCoordinator:
+    """Triggers M3U refreshes and waits until Dispatcharr has processed them"""
+
+    def __init__(self, client: DispatcharrClient, max_age_minutes: float = M3U_REFRESH_MAX_AGE_MINUTES,
+                 timeout: int = M3U_REFRESH_TIMEOUT, state_file: str = M3U_REFRESH_STATE_FILE,
+                 log: Callable[[str], None] = print):
+        """
+        Initialize the coordinator
+
+        Args:
+            client: Dispatcharr client
+            max_age_minutes: Skip refreshing if the last refresh is newer than this (0 = always refresh)
+            timeout: Maximum seconds to wait for the refresh to complete
+            state_file: File where the last refresh time is stored
+            log: Function used to report progress
+        """
+        self.client = client
+        self.max_age_minutes = max_age_minutes
+        self.timeout = timeout
+        self.state_file = state_file
+        self.log = log
+
+    def last_refresh_age_minutes(self) -> Optional[float]:
+        """Minutes since the last recorded refresh, or None if unknown"""
+        last_refresh = _parse_timestamp(load_m3u_refresh_state(self.state_file).get('last_refresh'))
+        if not last_refresh:
+            return None
+        return (datetime.now(timezone.utc) - last_refresh).total_seconds() / 60
+
+    def refresh(self, force: bool = False, wait: bool = True) -> Dict[str, Any]:
+        """
+        Refreshes the M3U sources and waits for them to finish
+
+        Args:
+            force: Refresh even if the last refresh is recent
+            wait: Wait until every active account has finished refreshing
+
+        Returns:
+            Dictionary with 'refreshed', 'skipped', 'completed', 'timed_out',
+            'pending' (names of unfinished accounts) and 'elapsed' seconds
+        """
+        result = {'refreshed': False, 'skipped': False, 'completed': False,
+                  'timed_out': False, 'pending': [], 'elapsed': 0.0}
+
+        age = self.last_refresh_age_minutes()
+        if not force and self.max_age_minutes > 0 and age is not None and age < self.max_age_minutes:
+            self.log(f"ℹ️  M3U sources refreshed {age:.0f} minute(s) ago "
+                     f"(max age {self.max_age_minutes:.0f}), skipping refresh")
+            result.update(skipped=True, completed=True)
+            return result
+
+        started_at = time.time()
+        baseline = self._snapshot_accounts() if wait else {}
+
+        self.log("🔄 Refreshing M3U sources...")
+        self.client.refresh_m3u_sources()
+        result['refreshed'] = True
+
+        if wait and baseline:
+            pending = self._wait_for_accounts(baseline, started_at)
+            result['pending'] = pending
+            result['completed'] = not pending
+            result['timed_out'] = bool(pending)
+            if pending:
+                self.log(f"⚠️  M3U refresh still running after {self.timeout}s for: {', '.join(pending)}; "
+                         f"continuing with current data")
+            else:
+                self.log(f"✅ M3U sources refreshed ({time.time() - started_at:.0f}s)")
+        else:
+            result['completed'] = not wait
+            self.log("✅ M3U refresh requested")
+
+        # Record the refresh once the data is (as far as we know) up to date
+        update_m3u_refresh_time(self.state_file)
+        result['elapsed'] = time.time() - started_at
+        return result
+
+    def _snapshot_accounts(self) -> Dict[int, Dict[str, Any]]:
+        """Gets the active accounts with their status before the refresh"""
+        try:
+            accounts = self.client.get_m3u_accounts(fresh=True)
+        except Exception as e:
+            self.log(f"⚠️  Could not read M3U accounts, not waiting for refresh: {e}")
+            return {}
+        return {
+            account['id']: {
+                'name': account.get('name', f"Account {account['id']}"),
+                'updated_at': _parse_timestamp(account.get('updated_at')),
+                'seen_in_progress': False
+            }
+            for account in accounts
+            if account.get('id') is not None and account.get('is_active', True)
+        }
+
+    def _wait_for_accounts(self, baseline: Dict[int, Dict[str, Any]], started_at: float) -> list:
+        """
+        Polls the accounts until all of them finished refreshing or the timeout passes
+
+        An account is finished when it is no longer fetching/parsing and either
+        its updated_at moved forward or it was seen in progress. Accounts that
+        never start refreshing are considered finished after M3U_REFRESH_START_GRACE.
+
+        Returns:
+            Names of the accounts still pending when the wait ended
+        """
+        deadline = started_at + self.timeout
+        interval = POLL_INITIAL_INTERVAL
+        pending = set(baseline)
+
+        while pending:
+            now = time.time()
+            if now >= deadline:
+                break
+            time.sleep(min(interval, max(deadline - now, 0)))
+            interval = min(interval * POLL_BACKOFF_FACTOR, POLL_MAX_INTERVAL)
+
+            try:
+                accounts = {a['id']: a for a in self.client.get_m3u_accounts(fresh=True) if a.get('id') is not None}
+            except Exception as e:
+                self.log(f"⚠️  Error polling M3U accounts: {e}")
+                continue
+
+            for account_id in list(pending):
+                account = accounts.get(account_id)
+                if account is None:
+                    # Account deleted meanwhile
+                    pending.discard(account_id)
+                    continue
+
+                known = baseline[account_id]
+                status = str(account.get('status') or '').lower()
+                if status in IN_PROGRESS_STATUSES:
+                    known['seen_in_progress'] = True
+                    continue
+
+                updated_at = _parse_timestamp(account.get('updated_at'))
+                advanced = updated_at is not None and (known['updated_at'] is None or updated_at > known['updated_at'])
+                never_started = time.time() - started_at >= M3U_REFRESH_START_GRACE
+                if advanced or known['seen_in_progress'] or never_started:
+                    pending.discard(account_id)
+
+            if pending:
+                names = ', '.join(baseline[a]['name'] for a in sorted(pending))
+                self.log(f"   ⏳ Waiting for M3U refresh: {names}")
+
+        return [baseline[a]['name'] for a in sorted(pending)]
@@ -39,6 +39,10 @@ class AutoAssignmentRule:
         video_resolution: Required resolution (720p, 1080p, 2160p, SD)
         video_fps: Required exact FPS
         pixel_format: Required pixel format (yuv420p, yuv420p10le, etc.)
+        first_keyframe_operator: Comparison operator for the time to first keyframe
+        first_keyframe_value: Time to first keyframe (zap time) in ms to compare
+        stall_count_operator: Comparison operator for the stalls of the last test
+        stall_count_value: Number of stalls to compare
         
         # Audio stats conditions:
         audio_codec: Required audio codec (ac3, aac, etc.)
@@ -47,6 +51,9 @@ class AutoAssignmentRule:
         test_streams_before_sorting: Whether to test streams to obtain stats before applying rule
         force_retest_old_streams: Whether to force retesting all streams (even with recent stats)
         retest_days_threshold: Days threshold for considering stats "old" (default 7)
+        probe_mode: How streams are tested: 'auto' (HLS playlists analyzed in-process,
+            ffprobe/ffmpeg otherwise), 'fast' (in-process HLS and MPEG-TS probes, ffprobe/ffmpeg
+            as fallback) or 'full' (always ffprobe/ffmpeg)
     """
     id: int
     name: str
@@ -67,6 +74,12 @@ class AutoAssignmentRule:
     pixel_format_operator: Optional[str] = None  # ==, !=
     pixel_format: Optional[str] = None  # Pixel format (e.g., "yuv420p", "yuv420p10le")
     
+    # Startup and stall conditions
+    first_keyframe_operator: Optional[str] = None  # >, >=, <, <=, ==
+    first_keyframe_value: Optional[float] = None  # ms
+    stall_count_operator: Optional[str] = None  # >, >=, <, <=, ==
+    stall_count_value: Optional[int] = None
+    
     # Audio conditions
     audio_codec: Optional[List[str]] = None  # Can be a list: ["aac", "ac3"]
     
@@ -77,6 +90,7 @@ class AutoAssignmentRule:
     test_streams_before_sorting: bool = False
     force_retest_old_streams: bool = False
     retest_days_threshold: int = 7
+    probe_mode: str = 'auto'
     
     # Manual stream inclusion/exclusion
     force_include_stream_ids: List[int] = field(default_factory=list)  # Streams to include even if they don't match criteria
@@ -418,7 +432,9 @@ class StreamMatcher:
                 rule.video_resolution or
                 rule.video_fps or
                 rule.audio_codec or
-                rule.pixel_format
+                rule.pixel_format or
+                rule.first_keyframe_operator or
+                rule.stall_count_operator
             )
             
             if rule_requires_stats and stream_id in failed_test_stream_ids:
@@ -489,7 +505,9 @@ class StreamMatcher:
             rule.video_resolution or
             rule.video_fps or
             rule.audio_codec or
-            rule.pixel_format
+            rule.pixel_format or
+            rule.first_keyframe_operator or
+            rule.stall_count_operator
         )
         
         # From here, we need stream statistics
@@ -554,6 +572,18 @@ class StreamMatcher:
                 if pixel_format == rule.pixel_format:
                     return False
         
+        # 8. Filter by time to first keyframe (zap time)
+        if rule.first_keyframe_operator and rule.first_keyframe_value is not None:
+            first_keyframe = StreamMatcher._extract_stream_stat(stream_stats, 'first_keyframe_ms')
+            if not StreamMatcher._compare_value(first_keyframe, rule.first_keyframe_operator, rule.first_keyframe_value):
+                return False
+        
+        # 9. Filter by stalls in the last test
+        if rule.stall_count_operator and rule.stall_count_value is not None:
+            stall_count = StreamMatcher._extract_stream_stat(stream_stats, 'stall_count')
+            if not StreamMatcher._compare_value(stall_count, rule.stall_count_operator, rule.stall_count_value):
+                return False
+        
         # If it passed all filters, the stream matches
         return True
     
@@ -620,7 +650,9 @@ class StreamMatcher:
                 rule.video_resolution or
                 rule.video_fps or
                 rule.audio_codec or
-                rule.pixel_format
+                rule.pixel_format or
+                rule.first_keyframe_operator or
+                rule.stall_count_operator
             )
             
             if rule_requires_stats:
@@ -655,6 +687,10 @@ class StreamMatcher:
         if rule.pixel_format:
             operator_text = rule.pixel_format_operator or '=='
             conditions.append(f"Pixel format {operator_text} {rule.pixel_format}")
+        if rule.first_keyframe_operator and rule.first_keyframe_value is not None:
+            conditions.append(f"Time to first keyframe {rule.first_keyframe_operator} {rule.first_keyframe_value} ms")
+        if rule.stall_count_operator and rule.stall_count_value is not None:
+            conditions.append(f"Stalls {rule.stall_count_operator} {rule.stall_count_value}")
         
         return {
             'total_streams': len(streams),
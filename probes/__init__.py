@@ -0,0 +1,5 @@
+# In-process stream probes (fast alternatives to ffprobe/ffmpeg)
+from .ffmpeg_output import FFmpegOutputParser
+from .hls import HLSProbe, ProbeError, is_hls_url
+from .mpegts import TSProbe
+from .startup import FFmpegProgressMonitor, measure_connect_time
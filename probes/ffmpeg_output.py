@@ -0,0 +1,79 @@
+"""
+Incremental parsing of the ffmpeg bitrate test output
+
+The bitrate test used to buffer the whole stderr of ffmpeg and scan it after
+the run. Verbose or looping sources can write megabytes of stderr per test, so
+FFmpegOutputParser is fed one line at a time while ffmpeg runs instead: it
+matches the stats lines (`... bitrate=1234.5kbits/s ...`) and the final summary
+(`video:5607KiB audio:125KiB ...`) with precompiled patterns, and keeps only
+the last STREAM_TEST_OUTPUT_TAIL_LINES lines for error reporting. Memory per
+test stays constant, and the latest bitrate is available while ffmpeg runs.
+"""
+import os
+import re
+from collections import deque
+from typing import Optional
+
+# Lines of ffmpeg/ffprobe stderr kept for error reporting
+STREAM_TEST_OUTPUT_TAIL_LINES = int(os.getenv('STREAM_TEST_OUTPUT_TAIL_LINES', '40'))
+
+# Final summary: "video:5607KiB audio:125KiB subtitle:0KiB ..." (kB before ffmpeg 6.1)
+SUMMARY_PATTERN = re.compile(r'video:\s*([\d.]+)\s*(?:KiB|kB)\s+audio:\s*([\d.]+)\s*(?:KiB|kB)')
+
+# Stats line: "frame=  250 fps= 25 ... bitrate=2345.6kbits/s speed=1x"
+BITRATE_PATTERN = re.compile(r'bitrate=\s*([\d.]+)\s*kbits/s')
+
+
+class FFmpegOutputParser:
+    """Bitrate of an ffmpeg run from its stderr, parsed line by line"""
+
+    def __init__(self, tail_lines: int = STREAM_TEST_OUTPUT_TAIL_LINES):
+        """
+        Initialize a parser for one ffmpeg run
+
+        Args:
+            tail_lines: Lines of output kept for error reporting
+        """
+        self.video_kb: Optional[float] = None
+        self.audio_kb: Optional[float] = None
+        self.last_bitrate_kbps: Optional[float] = None
+        self.lines = 0
+        self._tail = deque(maxlen=max(1, tail_lines))
+
+    def feed_line(self, line: str):
+        """Processes one line of stderr"""
+        line = line.rstrip('\r\n')
+        if not line:
+            return
+        self.lines += 1
+        self._tail.append(line)
+
+        if 'bitrate=' in line:
+            match = BITRATE_PATTERN.search(line)
+            if match:
+                self.last_bitrate_kbps = float(match.group(1))
+        elif 'video:' in line:
+            match = SUMMARY_PATTERN.search(line)
+            if match:
+                self.video_kb = float(match.group(1))
+                self.audio_kb = float(match.group(2))
+
+    def bitrate_kbps(self, duration: float) -> Optional[float]:
+        """
+        Average bitrate of the run
+
+        Computed from the data sizes of the final summary over the test duration,
+        falling back to the last bitrate reported by a stats line.
+
+        Args:
+            duration: Seconds of stream read by ffmpeg (its -t value)
+        """
+        if self.video_kb is not None and duration > 0:
+            total_kb = self.video_kb + (self.audio_kb or 0.0)
+            if total_kb > 0:
+                return (total_kb * 8) / duration
+        return self.last_bitrate_kbps
+
+    def tail(self) -> str:
+        """Last lines of the output"""
+        return '\n'.join(self._tail)
@@ -0,0 +1,315 @@
+"""
+In-process HLS probe
+
+For HLS streams the master playlist usually declares resolution, codecs, frame
+rate and bandwidth in its EXT-X-STREAM-INF tags, and the real bitrate can be
+measured from segment sizes and their EXTINF durations. HLSProbe fetches the
+playlists with a pooled HTTP session, picks the best variant, sizes a few
+segments at the live edge and returns the same stats dictionary as the
+ffprobe/ffmpeg test, in a few hundred milliseconds instead of ~10 seconds.
+"""
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Seconds to wait for each playlist/segment request
+HLS_PROBE_TIMEOUT = float(os.getenv('HLS_PROBE_TIMEOUT', '10'))
+
+# Segments sized to measure the bitrate (0 = use the declared bandwidth)
+HLS_PROBE_SEGMENTS = int(os.getenv('HLS_PROBE_SEGMENTS', '2'))
+
+# Pattern of the total size in a Content-Range header ("bytes 0-0/1234567")
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+\d+-\d+/(\d+)')
+
+# Connections kept per host by the shared session
+HLS_POOL_SIZE = 16
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# RFC 6381 codec identifiers to the codec names reported by ffprobe
+CODEC_NAMES = {
+    'avc1': 'h264', 'avc3': 'h264',
+    'hvc1': 'hevc', 'hev1': 'hevc',
+    'av01': 'av1', 'vp09': 'vp9',
+    'mp4a.40.34': 'mp3', 'mp4a.69': 'mp3', 'mp4a.6b': 'mp3',
+    'mp4a': 'aac',
+    'ac-3': 'ac3', 'ec-3': 'eac3', 'opus': 'opus'
+}
+VIDEO_CODECS = {'h264', 'hevc', 'av1', 'vp9'}
+
+
+class ProbeError(Exception):
+    """Raised when a playlist can't be fetched or parsed"""
+    pass
+
+
+@dataclass
+class HLSVariant:
+    """A variant stream declared by EXT-X-STREAM-INF in a master playlist"""
+    uri: str
+    bandwidth: Optional[int] = None
+    average_bandwidth: Optional[int] = None
+    resolution: Optional[str] = None
+    codecs: List[str] = field(default_factory=list)
+    frame_rate: Optional[float] = None
+
+
+@dataclass
+class HLSSegment:
+    """A media segment of a media playlist"""
+    uri: str
+    duration: float
+    byte_length: Optional[int] = None
+
+
+def parse_attributes(text: str) -> Dict[str, str]:
+    """Parses an HLS attribute list (KEY=value,KEY="quoted, value")"""
+    return {key: value.strip('"') for key, value in ATTRIBUTE_PATTERN.findall(text)}
+
+
+def codec_name(identifier: str) -> Optional[str]:
+    """Maps an RFC 6381 codec identifier (e.g. 'avc1.64001f') to the ffprobe codec name"""
+    identifier = identifier.strip().lower()
+    for prefix, name in CODEC_NAMES.items():
+        if identifier == prefix or identifier.startswith(prefix + '.'):
+            return name
+    return None
+
+
+def parse_master_playlist(text: str, base_url: str) -> List[HLSVariant]:
+    """
+    Parses the variants of a master playlist
+
+    Returns:
+        The variants (empty if the playlist is a media playlist)
+    """
+    variants = []
+    pending: Optional[Dict[str, str]] = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending = parse_attributes(line.split(':', 1)[1])
+        elif pending is not None and line and not line.startswith('#'):
+            try:
+                frame_rate = float(pending['FRAME-RATE']) if pending.get('FRAME-RATE') else None
+            except ValueError:
+                frame_rate = None
+            variants.append(HLSVariant(
+                uri=urljoin(base_url, line),
+                bandwidth=int(pending['BANDWIDTH']) if pending.get('BANDWIDTH', '').isdigit() else None,
+                average_bandwidth=(int(pending['AVERAGE-BANDWIDTH'])
+                                   if pending.get('AVERAGE-BANDWIDTH', '').isdigit() else None),
+                resolution=pending.get('RESOLUTION'),
+                codecs=[c for c in pending.get('CODECS', '').split(',') if c.strip()],
+                frame_rate=frame_rate
+            ))
+            pending = None
+    return variants
+
+
+def parse_media_playlist(text: str, base_url: str) -> List[HLSSegment]:
+    """Parses the segments of a media playlist (with EXT-X-BYTERANGE lengths when present)"""
+    segments = []
+    duration: Optional[float] = None
+    byte_length: Optional[int] = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXTINF:'):
+            try:
+                duration = float(line.split(':', 1)[1].split(',', 1)[0])
+            except ValueError:
+                duration = None
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            try:
+                byte_length = int(line.split(':', 1)[1].split('@', 1)[0])
+            except ValueError:
+                byte_length = None
+        elif line and not line.startswith('#') and duration is not None:
+            segments.append(HLSSegment(urljoin(base_url, line), duration, byte_length))
+            duration = None
+            byte_length = None
+    return segments
+
+
+def is_hls_url(url: Optional[str]) -> bool:
+    """Whether a URL looks like an HLS playlist"""
+    if not url:
+        return False
+    return urlparse(url).path.lower().endswith('.m3u8')
+
+
+_session_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+
+
+def get_session() -> requests.Session:
+    """Shared HTTP session (connection pool) used by the in-process probes"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HLS_POOL_SIZE, pool_maxsize=HLS_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+class HLSProbe:
+    """Analyzes HLS streams from their playlists"""
+
+    def __init__(self, user_agent: Optional[str] = None, timeout: float = HLS_PROBE_TIMEOUT,
+                 sample_segments: int = HLS_PROBE_SEGMENTS, session: Optional[requests.Session] = None):
+        """
+        Initialize the probe
+
+        Args:
+            user_agent: User-Agent sent to the provider
+            timeout: Seconds to wait for each request
+            sample_segments: Segments sized to measure the bitrate
+            session: HTTP session (default: the shared pooled session)
+        """
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.sample_segments = sample_segments
+        self.session = session or get_session()
+
+    def _headers(self) -> Dict[str, str]:
+        return {'User-Agent': self.user_agent} if self.user_agent else {}
+
+    def _fetch_playlist(self, url: str) -> Tuple[str, str]:
+        """
+        Fetches a playlist
+
+        Returns:
+            Tuple (text, final URL after redirects)
+
+        Raises:
+            ProbeError: If the request fails or the response isn't a playlist
+        """
+        try:
+            response = self.session.get(url, headers=self._headers(), timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise ProbeError(f'Could not fetch playlist: {e}')
+        text = response.text
+        if not text.lstrip().startswith('#EXTM3U'):
+            raise ProbeError('Response is not an M3U8 playlist')
+        return text, response.url
+
+    def _segment_size(self, segment: HLSSegment) -> Optional[int]:
+        """
+        Size in bytes of a segment, without downloading it
+
+        From the playlist's BYTERANGE, a HEAD request, or the Content-Range
+        (or Content-Length) of a GET for its first byte whose body isn't read.
+
+        Returns:
+            The size, or None if the server doesn't tell (the bitrate then
+            comes from the declared bandwidth or the ffmpeg test)
+        """
+        if segment.byte_length:
+            return segment.byte_length
+        try:
+            response = self.session.head(segment.uri, headers=self._headers(), timeout=self.timeout,
+                                         allow_redirects=True)
+            length = response.headers.get('Content-Length')
+            if response.ok and length and length.isdigit() and int(length) > 0:
+                return int(length)
+
+            headers = {**self._headers(), 'Range': 'bytes=0-0'}
+            with self.session.get(segment.uri, headers=headers, timeout=self.timeout,
+                                  stream=True) as response:
+                response.raise_for_status()
+                if response.status_code == 206:
+                    match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+                    return int(match.group(1)) if match and int(match.group(1)) > 0 else None
+                # Range ignored: the length of the full answer, if announced (the body is never read)
+                length = response.headers.get('Content-Length')
+                return int(length) if length and length.isdigit() and int(length) > 0 else None
+        except requests.RequestException:
+            return None
+
+    def measure_bitrate(self, segments: List[HLSSegment]) -> Optional[float]:
+        """
+        Measures the bitrate of a media playlist from its last segments
+
+        Returns:
+            Bitrate in kbps, or None if no segment could be sized
+        """
+        total_bytes = 0
+        total_duration = 0.0
+        for segment in segments[-self.sample_segments:] if self.sample_segments > 0 else []:
+            size = self._segment_size(segment)
+            if size and segment.duration > 0:
+                total_bytes += size
+                total_duration += segment.duration
+        if not total_duration:
+            return None
+        return total_bytes * 8 / total_duration / 1000
+
+    def probe(self, url: str) -> Dict[str, Any]:
+        """
+        Analyzes an HLS stream
+
+        Args:
+            url: URL of the master or media playlist
+
+        Returns:
+            Dictionary with 'stats' (same fields as the ffprobe/ffmpeg test),
+            'complete' (True if resolution, video codec and bitrate are known),
+            'variant' (URL of the analyzed variant), 'variants' (count) and
+            'startup_ms' (time until the media playlist was loaded)
+
+        Raises:
+            ProbeError: If the playlists can't be fetched or contain no segments
+        """
+        started = time.time()
+        text, final_url = self._fetch_playlist(url)
+        variants = parse_master_playlist(text, final_url)
+
+        stats: Dict[str, Any] = {'stream_type': 'hls'}
+        variant = None
+        media_url = final_url
+        if variants:
+            # Analyze the best variant (the one a player would settle on with enough bandwidth)
+            variant = max(variants, key=lambda v: (v.bandwidth or 0, v.average_bandwidth or 0))
+            media_url = variant.uri
+            if variant.resolution:
+                stats['resolution'] = variant.resolution
+            if variant.frame_rate:
+                stats['source_fps'] = variant.frame_rate
+            for identifier in variant.codecs:
+                name = codec_name(identifier)
+                if name in VIDEO_CODECS:
+                    stats.setdefault('video_codec', name)
+                elif name:
+                    stats.setdefault('audio_codec', name)
+            text, media_url = self._fetch_playlist(media_url)
+
+        startup_ms = (time.time() - started) * 1000
+        segments = parse_media_playlist(text, media_url)
+        if not segments:
+            raise ProbeError('Media playlist has no segments')
+
+        bitrate = self.measure_bitrate(segments)
+        if bitrate is None and variant is not None:
+            declared = variant.average_bandwidth or variant.bandwidth
+            bitrate = declared / 1000 if declared else None
+        if bitrate:
+            stats['ffmpeg_output_bitrate'] = bitrate
+
+        return {
+            'stats': stats,
+            'complete': all(key in stats for key in ('resolution', 'video_codec', 'ffmpeg_output_bitrate')),
+            'variant': media_url,
+            'variants': len(variants),
+            'startup_ms': startup_ms
+        }
@@ -0,0 +1,564 @@
+"""
+In-process MPEG-TS probe
+
+Reads the start of a raw MPEG-TS stream over HTTP and extracts what the
+ffprobe/ffmpeg test reports: the PAT/PMT give the elementary stream types,
+the H.264/HEVC sequence parameter set gives resolution, pixel format and
+(when it carries timing info) frame rate, the audio frame headers give sample
+rate and channels, and the bitrate is derived from the bytes received between
+PCR timestamps. Typically needs one or two seconds of stream instead of the
+ffprobe run plus a 10 second ffmpeg copy.
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from .hls import ProbeError, get_session
+
+# Maximum bytes read from the stream
+TS_PROBE_MAX_BYTES = int(os.getenv('TS_PROBE_MAX_BYTES', str(4 * 1024 * 1024)))
+
+# Seconds of stream (PCR time) needed to measure the bitrate
+TS_PROBE_PCR_SECONDS = float(os.getenv('TS_PROBE_PCR_SECONDS', '2'))
+
+# Seconds to wait for the stream data
+TS_PROBE_TIMEOUT = float(os.getenv('TS_PROBE_TIMEOUT', '10'))
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+PCR_CLOCK = 27000000
+PTS_CLOCK = 90000
+
+# PMT stream_type values to the codec names reported by ffprobe
+VIDEO_STREAM_TYPES = {0x01: 'mpeg1video', 0x02: 'mpeg2video', 0x10: 'mpeg4', 0x1b: 'h264', 0x24: 'hevc'}
+AUDIO_STREAM_TYPES = {0x03: 'mp2', 0x04: 'mp2', 0x0f: 'aac', 0x11: 'aac_latm', 0x81: 'ac3', 0x87: 'eac3'}
+
+# Descriptors identifying the codec of private data streams (stream_type 0x06)
+AC3_DESCRIPTOR = 0x6a
+EAC3_DESCRIPTOR = 0x7a
+REGISTRATION_DESCRIPTOR = 0x05
+REGISTRATION_CODECS = {b'AC-3': 'ac3', b'EAC3': 'eac3', b'HEVC': 'hevc', b'Opus': 'opus'}
+
+# H.264 profiles whose SPS carries chroma format and bit depth
+H264_HIGH_PROFILES = {100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135}
+
+CHROMA_FORMATS = {0: 'gray', 1: 'yuv420p', 2: 'yuv422p', 3: 'yuv444p'}
+
+AAC_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+AC3_SAMPLE_RATES = [48000, 44100, 32000]
+AC3_CHANNELS = [2, 1, 2, 3, 3, 4, 4, 5]
+MPEG_AUDIO_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+class BitReader:
+    """Reads bits and Exp-Golomb codes from a NAL unit payload"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def bits(self, count: int) -> int:
+        value = 0
+        for _ in range(count):
+            byte = self.position >> 3
+            if byte >= len(self.data):
+                raise ProbeError('Truncated parameter set')
+            value = (value << 1) | ((self.data[byte] >> (7 - (self.position & 7))) & 1)
+            self.position += 1
+        return value
+
+    def skip(self, count: int):
+        self.position += count
+
+    def ue(self) -> int:
+        zeros = 0
+        while self.bits(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise ProbeError('Invalid Exp-Golomb code')
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self) -> int:
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def remove_emulation_prevention(data: bytes) -> bytes:
+    """Removes the emulation prevention bytes (00 00 03) of a NAL unit"""
+    return data.replace(b'\x00\x00\x03', b'\x00\x00')
+
+
+def pixel_format(chroma_format_idc: int, bit_depth: int) -> Optional[str]:
+    """Pixel format name as reported by ffprobe (e.g. 'yuv420p', 'yuv420p10le')"""
+    name = CHROMA_FORMATS.get(chroma_format_idc)
+    if name and bit_depth > 8:
+        name = f"{name}{bit_depth}le" if name != 'gray' else f"gray{bit_depth}le"
+    return name
+
+
+def _skip_scaling_list(reader: BitReader, size: int):
+    last_scale = next_scale = 8
+    for _ in range(size):
+        if next_scale != 0:
+            next_scale = (last_scale + reader.se() + 256) % 256
+        last_scale = next_scale if next_scale != 0 else last_scale
+
+
+def parse_h264_sps(nal: bytes) -> Dict[str, Any]:
+    """
+    Parses an H.264 sequence parameter set
+
+    Args:
+        nal: NAL unit including its 1 byte header
+
+    Returns:
+        Dictionary with width, height, pixel_format and fps (when the VUI has timing info)
+    """
+    reader = BitReader(remove_emulation_prevention(nal[1:]))
+    profile_idc = reader.bits(8)
+    reader.skip(16)  # constraint flags, level_idc
+    reader.ue()  # seq_parameter_set_id
+
+    chroma_format_idc = 1
+    separate_colour_plane = 0
+    bit_depth = 8
+    if profile_idc in H264_HIGH_PROFILES:
+        chroma_format_idc = reader.ue()
+        if chroma_format_idc == 3:
+            separate_colour_plane = reader.bits(1)
+        bit_depth = reader.ue() + 8
+        reader.ue()  # bit_depth_chroma_minus8
+        reader.skip(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.bits(1):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if reader.bits(1):
+                    _skip_scaling_list(reader, 16 if i < 6 else 64)
+
+    reader.ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.ue()
+    if pic_order_cnt_type == 0:
+        reader.ue()
+    elif pic_order_cnt_type == 1:
+        reader.skip(1)
+        reader.se()
+        reader.se()
+        for _ in range(reader.ue()):
+            reader.se()
+    reader.ue()  # max_num_ref_frames
+    reader.skip(1)  # gaps_in_frame_num_value_allowed_flag
+    width_in_mbs = reader.ue() + 1
+    height_in_map_units = reader.ue() + 1
+    frame_mbs_only = reader.bits(1)
+    if not frame_mbs_only:
+        reader.skip(1)  # mb_adaptive_frame_field_flag
+    reader.skip(1)  # direct_8x8_inference_flag
+
+    crop_left = crop_right = crop_top = crop_bottom = 0
+    if reader.bits(1):  # frame_cropping_flag
+        crop_left, crop_right, crop_top, crop_bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+
+    if chroma_format_idc == 0 or separate_colour_plane:
+        crop_unit_x, crop_unit_y = 1, 2 - frame_mbs_only
+    else:
+        crop_unit_x = 1 if chroma_format_idc == 3 else 2
+        crop_unit_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+
+    info = {
+        'width': width_in_mbs * 16 - crop_unit_x * (crop_left + crop_right),
+        'height': (2 - frame_mbs_only) * height_in_map_units * 16 - crop_unit_y * (crop_top + crop_bottom),
+        'pixel_format': pixel_format(chroma_format_idc, bit_depth)
+    }
+
+    try:
+        if reader.bits(1):  # vui_parameters_present_flag
+            if reader.bits(1):  # aspect_ratio_info_present_flag
+                if reader.bits(8) == 255:
+                    reader.skip(32)
+            if reader.bits(1):  # overscan_info_present_flag
+                reader.skip(1)
+            if reader.bits(1):  # video_signal_type_present_flag
+                reader.skip(4)
+                if reader.bits(1):
+                    reader.skip(24)
+            if reader.bits(1):  # chroma_loc_info_present_flag
+                reader.ue()
+                reader.ue()
+            if reader.bits(1):  # timing_info_present_flag
+                num_units_in_tick = reader.bits(32)
+                time_scale = reader.bits(32)
+                if num_units_in_tick:
+                    info['fps'] = time_scale / (2 * num_units_in_tick)
+    except ProbeError:
+        pass
+    return info
+
+
+def parse_hevc_sps(nal: bytes) -> Dict[str, Any]:
+    """
+    Parses an HEVC sequence parameter set (frame rate is taken from timestamps)
+
+    Args:
+        nal: NAL unit including its 2 byte header
+
+    Returns:
+        Dictionary with width, height and pixel_format
+    """
+    reader = BitReader(remove_emulation_prevention(nal[2:]))
+    reader.skip(4)  # sps_video_parameter_set_id
+    max_sub_layers_minus1 = reader.bits(3)
+    reader.skip(1)  # sps_temporal_id_nesting_flag
+
+    # profile_tier_level
+    reader.skip(96)
+    sub_layer_flags = [(reader.bits(1), reader.bits(1)) for _ in range(max_sub_layers_minus1)]
+    if max_sub_layers_minus1 > 0:
+        reader.skip(2 * (8 - max_sub_layers_minus1))
+    for profile_present, level_present in sub_layer_flags:
+        if profile_present:
+            reader.skip(88)
+        if level_present:
+            reader.skip(8)
+
+    reader.ue()  # sps_seq_parameter_set_id
+    chroma_format_idc = reader.ue()
+    separate_colour_plane = reader.bits(1) if chroma_format_idc == 3 else 0
+    width = reader.ue()
+    height = reader.ue()
+    if reader.bits(1):  # conformance_window_flag
+        sub_width = 2 if chroma_format_idc in (1, 2) and not separate_colour_plane else 1
+        sub_height = 2 if chroma_format_idc == 1 and not separate_colour_plane else 1
+        left, right, top, bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+        width -= sub_width * (left + right)
+        height -= sub_height * (top + bottom)
+    bit_depth = reader.ue() + 8
+    return {'width': width, 'height': height, 'pixel_format': pixel_format(chroma_format_idc, bit_depth)}
+
+
+def find_nal_units(data: bytes) -> List[bytes]:
+    """Splits an Annex B byte stream into NAL units (without start codes)"""
+    units = []
+    start = data.find(b'\x00\x00\x01')
+    while start != -1:
+        begin = start + 3
+        end = data.find(b'\x00\x00\x01', begin)
+        unit = data[begin:end] if end != -1 else data[begin:]
+        units.append(unit.rstrip(b'\x00'))
+        start = end
+    return units
+
+
+def parse_audio_header(codec: str, data: bytes) -> Dict[str, Any]:
+    """
+    Reads sample rate and channels from the first audio frame of a PES payload
+
+    Returns:
+        Dictionary with sample_rate and channels (empty if no frame header was found)
+    """
+    if codec == 'aac':
+        for i in range(len(data) - 6):
+            if data[i] == 0xFF and data[i + 1] & 0xF6 == 0xF0:
+                index = (data[i + 2] >> 2) & 0x0F
+                channels = ((data[i + 2] & 0x01) << 2) | (data[i + 3] >> 6)
+                if index < len(AAC_SAMPLE_RATES):
+                    return {'sample_rate': AAC_SAMPLE_RATES[index], 'channels': channels}
+    elif codec in ('ac3', 'eac3'):
+        position = data.find(b'\x0b\x77')
+        if position != -1 and position + 7 <= len(data):
+            if codec == 'ac3':
+                fscod = data[position + 4] >> 6
+                acmod = data[position + 6] >> 5
+            else:
+                fscod = data[position + 4] >> 6
+                acmod = (data[position + 4] >> 1) & 0x07
+            if fscod < len(AC3_SAMPLE_RATES):
+                return {'sample_rate': AC3_SAMPLE_RATES[fscod], 'channels': AC3_CHANNELS[acmod]}
+    elif codec == 'mp2':
+        for i in range(len(data) - 3):
+            if data[i] == 0xFF and data[i + 1] & 0xE0 == 0xE0:
+                version = (data[i + 1] >> 3) & 0x03
+                rate_index = (data[i + 2] >> 2) & 0x03
+                if version in MPEG_AUDIO_SAMPLE_RATES and rate_index < 3:
+                    mode = data[i + 3] >> 6
+                    return {'sample_rate': MPEG_AUDIO_SAMPLE_RATES[version][rate_index],
+                            'channels': 1 if mode == 3 else 2}
+    return {}
+
+
+def parse_pts(header: bytes) -> Optional[int]:
+    """PTS of a PES packet header, or None if it has none"""
+    if len(header) < 14 or header[:3] != b'\x00\x00\x01' or not header[7] & 0x80:
+        return None
+    p = header[9:14]
+    return (((p[0] >> 1) & 0x07) << 30) | (p[1] << 22) | ((p[2] >> 1) << 15) | (p[3] << 7) | (p[4] >> 1)
+
+
+class TSAnalyzer:
+    """Incremental MPEG-TS demuxer collecting the stream properties"""
+
+    def __init__(self):
+        self.buffer = b''
+        self.bytes_read = 0
+        self.pmt_pids: set = set()
+        self.video_pid: Optional[int] = None
+        self.video_codec: Optional[str] = None
+        self.audio_pid: Optional[int] = None
+        self.audio_codec: Optional[str] = None
+        self.pcr_pid: Optional[int] = None
+        self.pcrs: List[tuple] = []
+        self.video_pes = b''
+        self.video_pts: List[int] = []
+        self.video_info: Optional[Dict[str, Any]] = None
+        self.audio_info: Optional[Dict[str, Any]] = None
+
+    def feed(self, data: bytes):
+        """Processes the next chunk of the stream"""
+        self.buffer += data
+        offset = 0
+        synced = self.bytes_read > 0
+        while offset + TS_PACKET_SIZE <= len(self.buffer):
+            if not synced or self.buffer[offset] != TS_SYNC_BYTE:
+                offset = self._sync_offset(offset)
+                if offset is None:
+                    return
+                synced = True
+            self.bytes_read += TS_PACKET_SIZE
+            self._packet(self.buffer[offset:offset + TS_PACKET_SIZE])
+            offset += TS_PACKET_SIZE
+        self.buffer = self.buffer[offset:]
+
+    def _sync_offset(self, offset: int) -> Optional[int]:
+        """
+        Finds the next packet boundary (three consecutive packets starting with the sync byte)
+
+        Returns:
+            Offset of the boundary, or None if more data is needed
+
+        Raises:
+            ProbeError: If there is enough data and no boundary was found
+        """
+        if len(self.buffer) - offset < 4 * TS_PACKET_SIZE:
+            self.buffer = self.buffer[offset:]
+            return None
+        for start in range(offset, offset + TS_PACKET_SIZE):
+            if all(self.buffer[start + i * TS_PACKET_SIZE] == TS_SYNC_BYTE for i in range(3)):
+                return start
+        raise ProbeError('Stream is not MPEG-TS (no sync byte)')
+
+    def _packet(self, packet: bytes):
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        unit_start = bool(packet[1] & 0x40)
+        adaptation = (packet[3] >> 4) & 0x03
+        payload_start = 4
+        if adaptation & 0x02:
+            length = packet[4]
+            if pid == self.pcr_pid and length >= 7 and packet[5] & 0x10:
+                base = (packet[6] << 25) | (packet[7] << 17) | (packet[8] << 9) | (packet[9] << 1) | (packet[10] >> 7)
+                extension = ((packet[10] & 0x01) << 8) | packet[11]
+                self.pcrs.append((self.bytes_read, base * 300 + extension))
+            payload_start = 5 + length
+        if not adaptation & 0x01 or payload_start >= TS_PACKET_SIZE:
+            return
+        payload = packet[payload_start:]
+
+        if pid == 0 and unit_start:
+            self._parse_pat(payload)
+        elif pid in self.pmt_pids and unit_start and self.video_pid is None:
+            self._parse_pmt(payload)
+        elif pid == self.video_pid:
+            self._video_payload(payload, unit_start)
+        elif pid == self.audio_pid and unit_start and self.audio_info is None and payload[:3] == b'\x00\x00\x01':
+            self.audio_info = parse_audio_header(self.audio_codec, payload[9 + payload[8]:]) or None
+
+    @staticmethod
+    def _section(payload: bytes) -> bytes:
+        pointer = payload[0]
+        section = payload[1 + pointer:]
+        length = ((section[1] & 0x0F) << 8) | section[2] if len(section) > 3 else 0
+        return section[:3 + length]
+
+    def _parse_pat(self, payload: bytes):
+        section = self._section(payload)
+        for i in range(8, len(section) - 4, 4):
+            program = (section[i] << 8) | section[i + 1]
+            if program != 0:
+                self.pmt_pids.add(((section[i + 2] & 0x1F) << 8) | section[i + 3])
+
+    def _parse_pmt(self, payload: bytes):
+        section = self._section(payload)
+        if len(section) < 16:
+            return
+        self.pcr_pid = ((section[8] & 0x1F) << 8) | section[9]
+        position = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        while position + 5 <= len(section) - 4:
+            stream_type = section[position]
+            pid = ((section[position + 1] & 0x1F) << 8) | section[position + 2]
+            info_length = ((section[position + 3] & 0x0F) << 8) | section[position + 4]
+            descriptors = section[position + 5:position + 5 + info_length]
+            codec = VIDEO_STREAM_TYPES.get(stream_type) or AUDIO_STREAM_TYPES.get(stream_type)
+            if stream_type == 0x06:
+                codec = self._descriptor_codec(descriptors)
+            if codec in VIDEO_STREAM_TYPES.values():
+                if self.video_pid is None:
+                    self.video_pid, self.video_codec = pid, codec
+            elif codec and self.audio_pid is None:
+                self.audio_pid, self.audio_codec = pid, codec
+            position += 5 + info_length
+
+    @staticmethod
+    def _descriptor_codec(descriptors: bytes) -> Optional[str]:
+        position = 0
+        while position + 2 <= len(descriptors):
+            tag, length = descriptors[position], descriptors[position + 1]
+            if tag == AC3_DESCRIPTOR:
+                return 'ac3'
+            if tag == EAC3_DESCRIPTOR:
+                return 'eac3'
+            if tag == REGISTRATION_DESCRIPTOR:
+                codec = REGISTRATION_CODECS.get(descriptors[position + 2:position + 6])
+                if codec:
+                    return codec
+            position += 2 + length
+        return None
+
+    def _video_payload(self, payload: bytes, unit_start: bool):
+        if unit_start:
+            pts = parse_pts(payload)
+            if pts is not None:
+                self.video_pts.append(pts)
+            if self.video_info is None and self.video_pes:
+                self._parse_parameter_sets(self.video_pes)
+            header_length = 9 + payload[8] if payload[:3] == b'\x00\x00\x01' and len(payload) > 9 else len(payload)
+            self.video_pes = payload[header_length:] if self.video_info is None else b''
+        elif self.video_info is None:
+            self.video_pes += payload
+
+    def _parse_parameter_sets(self, data: bytes):
+        for nal in find_nal_units(data):
+            if not nal:
+                continue
+            try:
+                if self.video_codec == 'h264' and nal[0] & 0x1F == 7:
+                    self.video_info = parse_h264_sps(nal)
+                elif self.video_codec == 'hevc' and (nal[0] >> 1) & 0x3F == 33:
+                    self.video_info = parse_hevc_sps(nal)
+            except ProbeError:
+                continue
+            if self.video_info:
+                return
+
+    def pcr_seconds(self) -> float:
+        """Seconds of stream covered by the PCRs seen so far"""
+        if len(self.pcrs) < 2:
+            return 0.0
+        return max(0.0, (self.pcrs[-1][1] - self.pcrs[0][1]) / PCR_CLOCK)
+
+    def bitrate(self) -> Optional[float]:
+        """Bitrate in kbps from the bytes between the first and last PCR"""
+        seconds = self.pcr_seconds()
+        if seconds <= 0:
+            return None
+        return (self.pcrs[-1][0] - self.pcrs[0][0]) * 8 / seconds / 1000
+
+    def frame_rate(self) -> Optional[float]:
+        """Frame rate from the SPS timing info, else from the video PTS spacing"""
+        if self.video_info and self.video_info.get('fps'):
+            return self.video_info['fps']
+        timestamps = sorted(set(self.video_pts))
+        deltas = sorted(b - a for a, b in zip(timestamps, timestamps[1:]) if b > a)
+        if not deltas:
+            return None
+        return round(PTS_CLOCK / deltas[len(deltas) // 2], 3)
+
+    def done(self) -> bool:
+        """Whether everything the probe reports has been found"""
+        video_ready = self.video_pid is not None and (self.video_info is not None or
+                                                       self.video_codec not in ('h264', 'hevc'))
+        audio_ready = self.audio_pid is None or self.audio_info is not None
+        return video_ready and audio_ready and self.pcr_seconds() >= TS_PROBE_PCR_SECONDS
+
+    def stats(self) -> Dict[str, Any]:
+        """Stats in the format of the ffprobe/ffmpeg test"""
+        stats: Dict[str, Any] = {'stream_type': 'mpegts'}
+        if self.video_codec:
+            stats['video_codec'] = self.video_codec
+        if self.video_info:
+            stats['resolution'] = f"{self.video_info['width']}x{self.video_info['height']}"
+            if self.video_info.get('pixel_format'):
+                stats['pixel_format'] = self.video_info['pixel_format']
+        fps = self.frame_rate()
+        if fps:
+            stats['source_fps'] = fps
+        if self.audio_codec:
+            stats['audio_codec'] = self.audio_codec
+        if self.audio_info:
+            stats['sample_rate'] = self.audio_info['sample_rate']
+            stats['audio_channels'] = 'stereo' if self.audio_info['channels'] == 2 else 'mono'
+        bitrate = self.bitrate()
+        if bitrate:
+            stats['ffmpeg_output_bitrate'] = bitrate
+        return stats
+
+
+class TSProbe:
+    """Analyzes raw MPEG-TS streams from the first megabytes of the HTTP response"""
+
+    def __init__(self, user_agent: Optional[str] = None, timeout: float = TS_PROBE_TIMEOUT,
+                 max_bytes: int = TS_PROBE_MAX_BYTES, session: Optional[requests.Session] = None):
+        """
+        Initialize the probe
+
+        Args:
+            user_agent: User-Agent sent to the provider
+            timeout: Seconds to wait for the stream data
+            max_bytes: Maximum bytes read from the stream
+            session: HTTP session (default: the shared pooled session)
+        """
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.session = session or get_session()
+
+    def probe(self, url: str) -> Dict[str, Any]:
+        """
+        Analyzes an MPEG-TS stream
+
+        Args:
+            url: URL of the stream
+
+        Returns:
+            Dictionary with 'stats' (same fields as the ffprobe/ffmpeg test),
+            'complete' (True if resolution, video codec and bitrate are known),
+            'bytes_read' and 'startup_ms' (time until the first data arrived)
+
+        Raises:
+            ProbeError: If the stream can't be read or isn't MPEG-TS
+        """
+        headers = {'User-Agent': self.user_agent} if self.user_agent else {}
+        analyzer = TSAnalyzer()
+        started = time.time()
+        deadline = started + self.timeout
+        startup_ms = None
+        try:
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if startup_ms is None:
+                        startup_ms = (time.time() - started) * 1000
+                    analyzer.feed(chunk)
+                    if analyzer.done() or analyzer.bytes_read >= self.max_bytes or time.time() >= deadline:
+                        break
+        except requests.RequestException as e:
+            raise ProbeError(f'Could not read stream: {e}')
+
+        if not analyzer.pmt_pids:
+            raise ProbeError('No PAT found in the stream')
+        stats = analyzer.stats()
+        return {
+            'stats': stats,
+            'complete': all(key in stats for key in ('resolution', 'video_codec', 'ffmpeg_output_bitrate')),
+            'bytes_read': analyzer.bytes_read,
+            'startup_ms': startup_ms
+        }
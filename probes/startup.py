@@ -0,0 +1,129 @@
+"""
+Startup latency and stall metrics of stream tests
+
+Viewers notice slow channel zaps and stalls long before a lower bitrate. The
+ffmpeg bitrate test is run with `-progress pipe:1`, which writes a block of
+key=value lines (frame, out_time_us, ...) ending in `progress=continue` every
+stats period. FFmpegProgressMonitor timestamps these blocks as they arrive:
+
+- ttfb_ms: first block with media written (the first packets arrived)
+- first_keyframe_ms: first block with a video frame written (stream copy only
+  starts writing video at the first keyframe, so this is the zap time)
+- stall_count / stall_total_ms: gaps longer than STREAM_STALL_THRESHOLD_MS in
+  which the written media time didn't advance (no data arrived)
+
+The TCP connect time (DNS included) is measured separately with
+measure_connect_time, before the tool starts.
+"""
+import os
+import socket
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+# Milliseconds without new data that count as a stall
+STREAM_STALL_THRESHOLD_MS = float(os.getenv('STREAM_STALL_THRESHOLD_MS', '1000'))
+
+# Seconds to wait for the TCP connection of the connect time measurement
+STREAM_CONNECT_TIMEOUT = float(os.getenv('STREAM_CONNECT_TIMEOUT', '5'))
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'rtmp': 1935, 'rtsp': 554}
+
+
+def measure_connect_time(url: str, timeout: float = STREAM_CONNECT_TIMEOUT) -> Optional[float]:
+    """
+    Milliseconds to resolve the host of a URL and open a TCP connection to it
+
+    Returns:
+        Connect time, or None if the URL has no host or the connection failed
+        (the test itself reports why the stream can't be read)
+    """
+    parsed = urlparse(url)
+    if not parsed.hostname:
+        return None
+    try:
+        port = parsed.port or DEFAULT_PORTS.get(parsed.scheme.lower())
+    except ValueError:
+        return None
+    if not port:
+        return None
+    started = time.time()
+    try:
+        with socket.create_connection((parsed.hostname, port), timeout=timeout):
+            return (time.time() - started) * 1000
+    except OSError:
+        return None
+
+
+def _progress_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class FFmpegProgressMonitor:
+    """Startup and stall metrics from the `-progress` output of ffmpeg"""
+
+    def __init__(self, stall_threshold_ms: float = STREAM_STALL_THRESHOLD_MS):
+        """
+        Initialize a monitor; create it right before starting ffmpeg
+
+        Args:
+            stall_threshold_ms: Milliseconds without new data that count as a stall
+        """
+        self.stall_threshold_ms = stall_threshold_ms
+        self.started = time.time()
+        self.ttfb_ms: Optional[float] = None
+        self.first_keyframe_ms: Optional[float] = None
+        self.stall_count = 0
+        self.stall_total_ms = 0.0
+        self.longest_stall_ms = 0.0
+        self._block: Dict[str, str] = {}
+        self._last_out_time: Optional[int] = None
+        self._last_advance: Optional[float] = None
+
+    def feed_line(self, line: str, now: Optional[float] = None):
+        """Processes one line of the progress output"""
+        key, separator, value = line.strip().partition('=')
+        if not separator:
+            return
+        if key != 'progress':
+            self._block[key] = value.strip()
+            return
+        self._on_block(now or time.time(), self._block)
+        self._block = {}
+
+    def _on_block(self, now: float, block: Dict[str, str]):
+        elapsed_ms = (now - self.started) * 1000
+        # out_time_ms is also in microseconds (kept by ffmpeg for compatibility)
+        out_time = _progress_int(block.get('out_time_us', block.get('out_time_ms')))
+        frames = _progress_int(block.get('frame'))
+
+        if self.ttfb_ms is None and ((out_time or 0) > 0 or (frames or 0) > 0):
+            self.ttfb_ms = elapsed_ms
+        if self.first_keyframe_ms is None and (frames or 0) > 0:
+            self.first_keyframe_ms = elapsed_ms
+
+        if out_time is None or self.ttfb_ms is None:
+            return
+        if self._last_out_time is None or out_time > self._last_out_time:
+            if self._last_advance is not None:
+                gap_ms = (now - self._last_advance) * 1000
+                if gap_ms > self.stall_threshold_ms:
+                    self.stall_count += 1
+                    self.stall_total_ms += gap_ms
+                    self.longest_stall_ms = max(self.longest_stall_ms, gap_ms)
+            self._last_out_time = out_time
+            self._last_advance = now
+
+    def stats(self) -> Dict[str, Any]:
+        """Measured metrics as stream_stats fields (only the ones that could be measured)"""
+        stats: Dict[str, Any] = {}
+        if self.ttfb_ms is not None:
+            stats['ttfb_ms'] = round(self.ttfb_ms)
+            stats['stall_count'] = self.stall_count
+            stats['stall_total_ms'] = round(self.stall_total_ms)
+        if self.first_keyframe_ms is not None:
+            stats['first_keyframe_ms'] = round(self.first_keyframe_ms)
+        return stats
@@ -0,0 +1,168 @@
+"""
+Bulk synchronization of channel profile membership for Stream Plus
+
+After an assignment rule runs, its channel is enabled in its profiles (streams
+were added) or disabled in them (nothing matched). Doing this one
+update_channel_profile_status call per profile and channel makes thousands of
+requests on large rule sets. A ProfileSync collects the desired
+(profile, channel, enabled) states instead, across all rules of a run, and
+flush() sends one bulk-update per profile, leaving out the channels that are
+already in the desired state.
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from api.dispatcharr_client import DispatcharrClient
+
+
+def _enabled_channel_ids(profile: Dict[str, Any]) -> Optional[set]:
+    """
+    IDs of the channels enabled in a profile, from its 'channels' field
+
+    Returns:
+        The IDs, or None if the profile doesn't list its channels
+    """
+    channels = profile.get('channels')
+    if not isinstance(channels, list):
+        return None
+    enabled = set()
+    for channel in channels:
+        if isinstance(channel, int):
+            enabled.add(channel)
+        elif isinstance(channel, dict) and channel.get('enabled', True):
+            channel_id = channel.get('channel_id', channel.get('id'))
+            if channel_id is not None:
+                enabled.add(channel_id)
+    return enabled
+
+
+class ProfileSync:
+    """Desired channel states per profile, applied in bulk"""
+
+    def __init__(self, client: DispatcharrClient):
+        """
+        Initialize an empty sync
+
+        Args:
+            client: Dispatcharr client used to read profiles and send the updates
+        """
+        self.client = client
+        # profile ID -> channel ID -> enabled (the last state set wins)
+        self._desired: Dict[int, Dict[int, bool]] = {}
+        self._profile_names: Dict[int, str] = {}
+
+    def set(self, channel_id: int, enabled: bool, names: Optional[Iterable[str]] = None,
+            exclude: Optional[Iterable[str]] = None) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Records the desired state of a channel in profiles
+
+        Args:
+            channel_id: Channel ID
+            enabled: True to enable the channel, False to disable it
+            names: Profile names (None = all profiles)
+            exclude: Profile names left unchanged
+
+        Returns:
+            The profiles the state was recorded for, and the names not found
+        """
+        missing = []
+        if names is None:
+            profiles = self.client.get_profiles()
+        else:
+            profiles = []
+            for name in names:
+                profile = self.client.get_profile_by_name(name)
+                if profile is None:
+                    missing.append(name)
+                else:
+                    profiles.append(profile)
+        excluded = set(exclude or [])
+        profiles = [p for p in profiles if p.get('name') not in excluded]
+        for profile in profiles:
+            self._desired.setdefault(profile['id'], {})[channel_id] = enabled
+            self._profile_names[profile['id']] = profile.get('name', f"Profile {profile['id']}")
+        return profiles, missing
+
+    def apply_rule_outcome(self, rule, added_count: int) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Records the profile states of an assignment rule's channel after the rule ran
+
+        With streams added, the channel is enabled in the rule's assigned profiles
+        (all profiles if none); without, it is disabled in all profiles except
+        the rule's disable_profiles.
+
+        Returns:
+            The profiles the state was recorded for, and the profile names not found
+        """
+        if added_count > 0:
+            return self.set(rule.channel_id, True, names=rule.assigned_profiles or None)
+        return self.set(rule.channel_id, False, exclude=rule.disable_profiles)
+
+    @property
+    def pending(self) -> int:
+        """Number of recorded (profile, channel) states"""
+        return sum(len(channels) for channels in self._desired.values())
+
+    def flush(self) -> Dict[str, Any]:
+        """
+        Sends one bulk update per profile with the recorded states
+
+        Channels already in the desired state are left out (when the profile
+        lists its channels). If a bulk update fails, its channels are updated
+        one at a time.
+
+        Returns:
+            Dict with 'enabled', 'disabled' and 'unchanged' counts, 'requests'
+            sent, 'profiles' (per-profile results) and 'errors'
+        """
+        summary = {'enabled': 0, 'disabled': 0, 'unchanged': 0, 'requests': 0, 'profiles': [], 'errors': []}
+        desired, self._desired = self._desired, {}
+
+        for profile_id, channels in desired.items():
+            name = self._profile_names.get(profile_id, f'Profile {profile_id}')
+            current = None
+            try:
+                current = _enabled_channel_ids(self.client.get_profile(profile_id))
+                summary['requests'] += 1
+            except Exception as e:
+                print(f"⚠️  Could not read profile {name}, updating all its channels: {e}")
+
+            enable_ids = sorted(c for c, enabled in channels.items()
+                                if enabled and (current is None or c not in current))
+            disable_ids = sorted(c for c, enabled in channels.items()
+                                 if not enabled and (current is None or c in current))
+            unchanged = len(channels) - len(enable_ids) - len(disable_ids)
+            summary['unchanged'] += unchanged
+            result = {'profile_id': profile_id, 'profile_name': name, 'enabled': enable_ids,
+                      'disabled': disable_ids, 'unchanged': unchanged}
+            summary['profiles'].append(result)
+            if not enable_ids and not disable_ids:
+                continue
+
+            try:
+                self.client.bulk_update_channel_profile(profile_id, {
+                    'enable_channel_ids': enable_ids,
+                    'disable_channel_ids': disable_ids
+                })
+                summary['requests'] += 1
+            except Exception as e:
+                print(f"⚠️  Bulk update of profile {name} failed, updating channels one by one: {e}")
+                failed = self._update_one_by_one(profile_id, name, enable_ids, disable_ids, summary)
+                enable_ids = [c for c in enable_ids if c not in failed]
+                disable_ids = [c for c in disable_ids if c not in failed]
+                result['enabled'], result['disabled'] = enable_ids, disable_ids
+            summary['enabled'] += len(enable_ids)
+            summary['disabled'] += len(disable_ids)
+        return summary
+
+    def _update_one_by_one(self, profile_id: int, name: str, enable_ids: List[int],
+                           disable_ids: List[int], summary: Dict[str, Any]) -> set:
+        """Fallback of a failed bulk update; returns the channels that failed"""
+        failed = set()
+        for channel_id, enabled in [(c, True) for c in enable_ids] + [(c, False) for c in disable_ids]:
+            try:
+                self.client.update_channel_profile_status(profile_id, channel_id, enabled)
+            except Exception as e:
+                failed.add(channel_id)
+                summary['errors'].append(f'Error updating channel {channel_id} in profile "{name}": {e}')
+            summary['requests'] += 1
+        return failed
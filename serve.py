@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Stream Plus - Server entry point
+Runs the web application with the server selected by SERVER_MODE:
+
+  development  Flask development server (debug/reloader controlled by FLASK_DEBUG)
+  waitress     Waitress, single process with a thread pool
+  gunicorn     Gunicorn with threaded (gthread) workers
+
+Execution progress lives in the shared execution store, so any worker can
+serve SSE clients for executions started by another worker.
+"""
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+SERVER_MODES = ('development', 'waitress', 'gunicorn')
+
+
+def run_development(host: str, port: int):
+    """Run the Flask development server"""
+    from app import app
+    debug = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
+    app.run(debug=debug, use_reloader=debug, reloader_type='stat', host=host, port=port, threaded=True)
+
+
+def run_waitress(host: str, port: int):
+    """Run the application with waitress"""
+    from waitress import serve
+    from app import app
+    threads = int(os.getenv('WEB_THREADS', '16'))
+    print(f"Starting waitress on {host}:{port} with {threads} threads")
+    serve(app, host=host, port=port, threads=threads)
+
+
+def run_gunicorn(host: str, port: int):
+    """Run the application with gunicorn threaded workers"""
+    from gunicorn.app.base import BaseApplication
+
+    class StreamPlusApplication(BaseApplication):
+        """Embedded gunicorn application that imports the app in each worker"""
+
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key.lower(), value)
+
+        def load(self):
+            # Imported inside the worker so every process builds its own clients and threads
+            from app import app
+            return app
+
+    options = {
+        'bind': f'{host}:{port}',
+        'workers': int(os.getenv('WEB_WORKERS', '2')),
+        'worker_class': 'gthread',
+        'threads': int(os.getenv('WEB_THREADS', '16')),
+        # gthread workers heartbeat independently of requests, so long SSE streams are fine
+        'timeout': int(os.getenv('WEB_TIMEOUT', '120')),
+        'graceful_timeout': 30,
+        'accesslog': '-',
+        'preload_app': False,
+    }
+    print(f"Starting gunicorn on {options['bind']} with {options['workers']} worker(s) x {options['threads']} threads")
+    StreamPlusApplication(options).run()
+
+
+def main():
+    """Start the server selected by SERVER_MODE"""
+    mode = os.getenv('SERVER_MODE', 'development').lower()
+    host = os.getenv('HOST', '0.0.0.0')
+    port = int(os.getenv('PORT', 5000))
+
+    if mode not in SERVER_MODES:
+        raise SystemExit(f"Invalid SERVER_MODE '{mode}'. Expected one of: {', '.join(SERVER_MODES)}")
+
+    if mode == 'gunicorn':
+        run_gunicorn(host, port)
+    elif mode == 'waitress':
+        run_waitress(host, port)
+    else:
+        run_development(host, port)
+
+
+if __name__ == '__main__':
+    main()
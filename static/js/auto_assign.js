@@ -195,6 +195,7 @@ function showCreateRuleModal() {
     document.getElementById('testStreamsBeforeSorting').checked = false;
     document.getElementById('forceRetestOldStreams').checked = false;
     document.getElementById('retestDaysThreshold').value = 7;
+    document.getElementById('probeMode').value = 'auto';
     
     // Clear manual stream overrides
     document.getElementById('forceIncludeStreamIds').value = '[]';
@@ -249,6 +250,10 @@ async function editRule(ruleId) {
         
         document.getElementById('bitrateOperator').value = rule.video_bitrate_operator || '';
         document.getElementById('bitrateValue').value = rule.video_bitrate_value || '';
+        document.getElementById('firstKeyframeOperator').value = rule.first_keyframe_operator || '';
+        document.getElementById('firstKeyframeValue').value = rule.first_keyframe_value != null ? rule.first_keyframe_value : '';
+        document.getElementById('stallCountOperator').value = rule.stall_count_operator || '';
+        document.getElementById('stallCountValue').value = rule.stall_count_value != null ? rule.stall_count_value : '';
         
         // Helper function to set selected values in multiple select
         const setMultipleSelectValues = (selectId, values) => {
@@ -283,6 +288,7 @@ async function editRule(ruleId) {
         document.getElementById('testStreamsBeforeSorting').checked = rule.test_streams_before_sorting || false;
         document.getElementById('forceRetestOldStreams').checked = rule.force_retest_old_streams || false;
         document.getElementById('retestDaysThreshold').value = rule.retest_days_threshold || 7;
+        document.getElementById('probeMode').value = rule.probe_mode || 'auto';
         
         // Load manual stream overrides
         document.getElementById('forceIncludeStreamIds').value = JSON.stringify(rule.force_include_stream_ids || []);
@@ -357,6 +363,10 @@ async function saveRule() {
         m3u_account_ids: getSelectedIntValues('m3uAccountIds'),
         bitrate_operator: document.getElementById('bitrateOperator').value || null,
         bitrate_value: document.getElementById('bitrateValue').value ? parseFloat(document.getElementById('bitrateValue').value) : null,
+        first_keyframe_operator: document.getElementById('firstKeyframeOperator').value || null,
+        first_keyframe_value: document.getElementById('firstKeyframeValue').value !== '' ? parseFloat(document.getElementById('firstKeyframeValue').value) : null,
+        stall_count_operator: document.getElementById('stallCountOperator').value || null,
+        stall_count_value: document.getElementById('stallCountValue').value !== '' ? parseInt(document.getElementById('stallCountValue').value) : null,
         video_codec: getSelectedValues('videoCodec'),
         video_resolution: getSelectedValues('resolution'),
         video_fps: getFpsValues(),
@@ -366,6 +376,7 @@ async function saveRule() {
         test_streams_before_sorting: testStreamsBeforeSorting,
         force_retest_old_streams: testStreamsBeforeSorting && forceRetestOldStreams,
         retest_days_threshold: retestDaysThreshold,
+        probe_mode: document.getElementById('probeMode').value || 'auto',
         force_include_stream_ids: JSON.parse(document.getElementById('forceIncludeStreamIds').value || '[]'),
         force_exclude_stream_ids: JSON.parse(document.getElementById('forceExcludeStreamIds').value || '[]'),
         assigned_profiles: Array.from(document.querySelectorAll('input.profile-checkbox:checked')).map(cb => cb.value)
@@ -659,13 +670,29 @@ async function executeRule(ruleId) {
         // Determine if we should use SSE (streaming) mode
         const useStream = rule && rule.test_streams_before_sorting === true;
         
+        // Offer to resume a previous run that was interrupted during stream testing
+        let resume = false;
+        if (useStream) {
+            const checkpointResponse = await fetch(`/api/auto-assign-rules/${ruleId}/checkpoint`);
+            if (checkpointResponse.ok) {
+                const { checkpoint } = await checkpointResponse.json();
+                if (checkpoint && checkpoint.completed > 0) {
+                    resume = confirm(
+                        `A previous execution was interrupted after testing ${checkpoint.completed}/${checkpoint.candidates} streams.\n\n` +
+                        'Resume it (OK) or start testing from scratch (Cancel)?'
+                    );
+                }
+            }
+        }
+        
         const response = await fetch(`/api/auto-assign-rules/${ruleId}/execute`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({
-                stream: useStream
+                stream: useStream,
+                resume: resume
             })
         });
         
@@ -4,6 +4,7 @@
  */
 
 var currentEventSource = null;
+var currentExecutionId = null;
 var totalStreamsToTest = 0;
 var currentStreamsTested = 0;
 
@@ -12,6 +13,7 @@ var currentStreamsTested = 0;
  */
 function showExecutionProgressModal(ruleId, executionId) {
     // Reset state
+    currentExecutionId = executionId;
     totalStreamsToTest = 0;
     currentStreamsTested = 0;
     
@@ -22,6 +24,8 @@ function showExecutionProgressModal(ruleId, executionId) {
     document.getElementById('progressPercent').textContent = '0%';
     document.getElementById('executionProgressBar').style.width = '0%';
     document.getElementById('closeProgressBtn').disabled = true;
+    document.getElementById('cancelExecutionBtn').disabled = false;
+    document.getElementById('cancelExecutionBtn').style.display = '';
     
     // Show modal
     const modal = new bootstrap.Modal(document.getElementById('executionProgressModal'));
@@ -41,7 +45,11 @@ function connectToExecutionStream(ruleId, executionId) {
     }
     
     // Create new EventSource
-    const url = `/api/auto-assign-rules/${ruleId}/execute-stream?execution_id=${executionId}`;
+    // Per-stream events are opt-in: open the page with ?verbose_progress=1 to get them
+    let url = `/api/auto-assign-rules/${ruleId}/execute-stream?execution_id=${executionId}`;
+    if (new URLSearchParams(window.location.search).get('verbose_progress') === '1') {
+        url += '&verbose=1';
+    }
     currentEventSource = new EventSource(url);
     
     currentEventSource.onmessage = function(event) {
@@ -55,12 +63,14 @@ function connectToExecutionStream(ruleId, executionId) {
     
     currentEventSource.onerror = function(error) {
         console.error('SSE error:', error);
-        addLogLine('Connection error. Retrying...', 'error');
-        
-        // Close connection
-        if (currentEventSource) {
-            currentEventSource.close();
+
+        // EventSource reconnects on its own and resumes from the last received
+        // event (Last-Event-ID); only give up once the server rejects the stream
+        if (currentEventSource && currentEventSource.readyState === EventSource.CLOSED) {
+            addLogLine('Connection lost. The execution may have expired.', 'error');
             currentEventSource = null;
+        } else {
+            addLogLine('Connection error. Retrying...', 'error');
         }
     };
 }
@@ -99,6 +109,16 @@ function handleExecutionMessage(data) {
             );
             break;
             
+        case 'progress':
+            // Aggregated counters sent a few times per second
+            totalStreamsToTest = data.total || totalStreamsToTest;
+            currentStreamsTested = data.completed || 0;
+            updateProgress(
+                totalStreamsToTest > 0 ? (currentStreamsTested / totalStreamsToTest) * 100 : 0,
+                formatProgressLabel(data)
+            );
+            break;
+            
         case 'test_success':
             // Show stream statistics if available
             let message = data.message;
@@ -139,6 +159,16 @@ function handleExecutionMessage(data) {
             // Just a keepalive, ignore
             break;
             
+        case 'end':
+            // Stream finished (normally after 'complete'); stop reconnecting
+            if (currentEventSource) {
+                currentEventSource.close();
+                currentEventSource = null;
+            }
+            document.getElementById('closeProgressBtn').disabled = false;
+            document.getElementById('cancelExecutionBtn').style.display = 'none';
+            break;
+            
         case 'disabling':
             addLogLine(`\n🚫 ${data.message}`, 'warning');
             break;
@@ -164,6 +194,9 @@ function handleExecutionComplete(data) {
         currentEventSource = null;
     }
     
+    // Nothing left to cancel
+    document.getElementById('cancelExecutionBtn').style.display = 'none';
+    
     // Update progress bar to 100% only if there were streams to test
     if (totalStreamsToTest > 0) {
         updateProgress(100, 'Complete');
@@ -198,6 +231,9 @@ function handleExecutionComplete(data) {
         if (data.skipped_count !== undefined && data.skipped_count > 0) {
             summaryHTML += `<li><strong>Skipped (recent stats):</strong> ${data.skipped_count}</li>`;
         }
+        if (data.tests_deferred) {
+            summaryHTML += `<li><strong>Deferred (test budget):</strong> ${data.tests_deferred} - evaluated with their current stats</li>`;
+        }
         summaryHTML += '</ul>';
     }
     
@@ -222,6 +258,30 @@ function handleExecutionComplete(data) {
         '<i class="fas fa-check-circle text-success"></i> Execution Complete';
 }
 
+/**
+ * Cancel the running execution (kills in-flight stream tests)
+ */
+async function cancelExecution() {
+    if (!currentExecutionId) {
+        return;
+    }
+    
+    const cancelBtn = document.getElementById('cancelExecutionBtn');
+    cancelBtn.disabled = true;
+    
+    try {
+        const response = await fetch(`/api/jobs/${currentExecutionId}/cancel`, { method: 'POST' });
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || 'Error cancelling execution');
+        }
+        addLogLine('Cancellation requested, stopping current test...', 'warning');
+    } catch (error) {
+        addLogLine(`Could not cancel execution: ${error.message}`, 'error');
+        cancelBtn.disabled = false;
+    }
+}
+
 /**
  * Add line to execution log
  */
@@ -264,6 +324,25 @@ function addLogLine(message, type = 'info') {
     logDiv.parentElement.scrollTop = logDiv.parentElement.scrollHeight;
 }
 
+/**
+ * Build the progress label from an aggregated progress event
+ */
+function formatProgressLabel(data) {
+    let label = `Tested ${data.completed}/${data.total} streams`;
+    if (data.failed > 0) {
+        label += ` (${data.failed} failed)`;
+    }
+    if (data.rate > 0) {
+        label += ` · ${data.rate.toFixed(1)}/min`;
+    }
+    if (data.eta_seconds) {
+        const minutes = Math.floor(data.eta_seconds / 60);
+        const seconds = data.eta_seconds % 60;
+        label += ` · ETA ${minutes}m ${seconds}s`;
+    }
+    return label;
+}
+
 /**
  * Update progress bar
  */
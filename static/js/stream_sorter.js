@@ -56,6 +56,54 @@ var conditionTypes = {
         valueType: 'select',
         operators: ['==', '!='],
         values: ['yuv420p', 'yuv420p10le', 'yuv444p', 'yuv444p10le', 'rgb24', 'rgb48be']
+    },
+    connect_time: {
+        label: 'Connect Time (ms)',
+        hasOperator: true,
+        valueType: 'number',
+        operators: ['>', '>=', '<', '<=']
+    },
+    time_to_first_byte: {
+        label: 'Time to First Byte (ms)',
+        hasOperator: true,
+        valueType: 'number',
+        operators: ['>', '>=', '<', '<=']
+    },
+    time_to_first_keyframe: {
+        label: 'Time to First Keyframe (ms)',
+        hasOperator: true,
+        valueType: 'number',
+        operators: ['>', '>=', '<', '<=']
+    },
+    stall_count: {
+        label: 'Stalls (count)',
+        hasOperator: true,
+        valueType: 'number',
+        operators: ['>', '>=', '<', '<=', '==']
+    },
+    stall_duration: {
+        label: 'Stall Duration (ms)',
+        hasOperator: true,
+        valueType: 'number',
+        operators: ['>', '>=', '<', '<=']
+    },
+    success_rate: {
+        label: 'Test Success Rate (%)',
+        hasOperator: true,
+        valueType: 'number',
+        operators: ['>', '>=', '<', '<=']
+    },
+    bitrate_p10: {
+        label: 'Bitrate P10 (kbps)',
+        hasOperator: true,
+        valueType: 'number',
+        operators: ['>', '>=', '<', '<=']
+    },
+    startup_latency: {
+        label: 'Startup Latency (ms)',
+        hasOperator: true,
+        valueType: 'number',
+        operators: ['>', '>=', '<', '<=']
     }
 };
 
@@ -81,6 +129,7 @@ function showCreateRuleModal() {
         document.getElementById('testStreamsBeforeSorting').checked = false;
         document.getElementById('forceRetestOldStreams').checked = false;
         document.getElementById('retestDaysThreshold').value = 7;
+        document.getElementById('probeMode').value = 'auto';
         document.getElementById('executionOrder').value = '';
         
         // Setup event listeners for modal
@@ -429,6 +478,7 @@ async function saveSortingRule() {
         test_streams_before_sorting: testStreamsBeforeSorting,
         force_retest_old_streams: testStreamsBeforeSorting && forceRetestOldStreams,
         retest_days_threshold: retestDaysThresholdValue,
+        probe_mode: document.getElementById('probeMode').value || 'auto',
         execution_order: executionOrder
     };
     
@@ -561,6 +611,7 @@ async function editSortingRule(ruleId) {
         document.getElementById('testStreamsBeforeSorting').checked = rule.test_streams_before_sorting || false;
         document.getElementById('forceRetestOldStreams').checked = rule.force_retest_old_streams || false;
         document.getElementById('retestDaysThreshold').value = rule.retest_days_threshold || 7;
+        document.getElementById('probeMode').value = rule.probe_mode || 'auto';
         
         // Setup event listeners for modal
         setupModalEventListeners();
@@ -1492,6 +1543,16 @@ function listenForAllRulesExecutionProgress(executionId) {
                 logDiv.innerHTML += `<div class="text-success">[COMPLETE] Rule ${data.rule_index}/${data.total_rules}: ${data.rule_name} - ${data.channels_sorted} channels sorted</div>`;
                 logDiv.scrollTop = logDiv.scrollHeight;
                 
+            } else if (data.type === 'complete' && data.cancelled) {
+                progressDiv.innerHTML = `
+                    <div class="alert alert-warning">
+                        <strong>Execution cancelled</strong>
+                    </div>
+                `;
+                logDiv.innerHTML += `<div class="text-warning fw-bold">[CANCELLED] ${data.message}</div>`;
+                logDiv.scrollTop = logDiv.scrollHeight;
+                eventSource.close();
+                
             } else if (data.type === 'complete') {
                 progressDiv.innerHTML = `
                     <div class="alert alert-success">
@@ -1500,6 +1561,9 @@ function listenForAllRulesExecutionProgress(executionId) {
                     </div>
                 `;
                 logDiv.innerHTML += `<div class="text-success fw-bold">[FINISHED] All rules executed successfully</div>`;
+                if (data.tests_deferred) {
+                    logDiv.innerHTML += `<div class="text-warning">[BUDGET] ${data.tests_deferred} stream test(s) deferred; streams were sorted with their current stats</div>`;
+                }
                 logDiv.scrollTop = logDiv.scrollHeight;
                 
                 // Close EventSource after a delay
@@ -1515,6 +1579,10 @@ function listenForAllRulesExecutionProgress(executionId) {
                 logDiv.scrollTop = logDiv.scrollHeight;
                 eventSource.close();
                 
+            } else if (data.type === 'end') {
+                // Stream finished; stop the browser from reconnecting
+                eventSource.close();
+                
             } else if (data.type === 'keepalive') {
                 // Keep-alive message, ignore
             }
@@ -1526,12 +1594,16 @@ function listenForAllRulesExecutionProgress(executionId) {
     
     eventSource.onerror = function(error) {
         console.error('EventSource error:', error);
+
+        // The browser retries automatically and resumes from the last received event
+        if (eventSource.readyState !== EventSource.CLOSED) {
+            return;
+        }
         progressDiv.innerHTML = `
             <div class="alert alert-warning">
                 <strong>Connection lost</strong> - Refresh the page to check execution status
             </div>
         `;
-        eventSource.close();
     };
 }
 
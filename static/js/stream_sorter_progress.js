@@ -4,6 +4,7 @@
  */
 
 var currentEventSource = null;
+var currentExecutionId = null;
 var totalStreamsToTest = 0;
 var currentStreamsTested = 0;
 var totalChannels = 0;
@@ -14,6 +15,7 @@ var currentChannel = 0;
  */
 function showExecutionProgressModal(ruleId, executionId) {
     // Reset state
+    currentExecutionId = executionId;
     totalStreamsToTest = 0;
     currentStreamsTested = 0;
     totalChannels = 0;
@@ -26,6 +28,8 @@ function showExecutionProgressModal(ruleId, executionId) {
     document.getElementById('progressPercent').textContent = '0%';
     document.getElementById('executionProgressBar').style.width = '0%';
     document.getElementById('closeProgressBtn').disabled = true;
+    document.getElementById('cancelExecutionBtn').disabled = false;
+    document.getElementById('cancelExecutionBtn').style.display = '';
     
     // Show modal
     const modal = new bootstrap.Modal(document.getElementById('executionProgressModal'));
@@ -45,7 +49,11 @@ function connectToExecutionStream(ruleId, executionId) {
     }
     
     // Create new EventSource
-    const url = `/api/sorting-rules/${ruleId}/execute-stream?execution_id=${executionId}`;
+    // Per-stream events are opt-in: open the page with ?verbose_progress=1 to get them
+    let url = `/api/sorting-rules/${ruleId}/execute-stream?execution_id=${executionId}`;
+    if (new URLSearchParams(window.location.search).get('verbose_progress') === '1') {
+        url += '&verbose=1';
+    }
     currentEventSource = new EventSource(url);
     
     currentEventSource.onmessage = function(event) {
@@ -59,12 +67,14 @@ function connectToExecutionStream(ruleId, executionId) {
     
     currentEventSource.onerror = function(error) {
         console.error('SSE error:', error);
-        addLogLine('Connection error. Retrying...', 'error');
-        
-        // Close connection
-        if (currentEventSource) {
-            currentEventSource.close();
+
+        // EventSource reconnects on its own and resumes from the last received
+        // event (Last-Event-ID); only give up once the server rejects the stream
+        if (currentEventSource && currentEventSource.readyState === EventSource.CLOSED) {
+            addLogLine('Connection lost. The execution may have expired.', 'error');
             currentEventSource = null;
+        } else {
+            addLogLine('Connection error. Retrying...', 'error');
         }
     };
 }
@@ -115,6 +125,18 @@ function handleExecutionMessage(data) {
             );
             break;
             
+        case 'progress': {
+            // Aggregated counters sent a few times per second
+            totalStreamsToTest = data.total || totalStreamsToTest;
+            currentStreamsTested = data.completed || 0;
+            const channelBase = (currentChannel - 1) / totalChannels;
+            const channelTests = totalStreamsToTest > 0
+                ? (currentStreamsTested / totalStreamsToTest) / totalChannels
+                : 0;
+            updateProgress((channelBase + channelTests) * 100, formatProgressLabel(data));
+            break;
+        }
+            
         case 'test_success':
             // Show stream statistics if available
             let message = data.message;
@@ -164,6 +186,16 @@ function handleExecutionMessage(data) {
             // Just a keepalive, ignore
             break;
             
+        case 'end':
+            // Stream finished (normally after 'complete'); stop reconnecting
+            if (currentEventSource) {
+                currentEventSource.close();
+                currentEventSource = null;
+            }
+            document.getElementById('closeProgressBtn').disabled = false;
+            document.getElementById('cancelExecutionBtn').style.display = 'none';
+            break;
+            
         default:
             console.log('Unknown message type:', data.type, data);
     }
@@ -179,6 +211,9 @@ function handleExecutionComplete(data) {
         currentEventSource = null;
     }
     
+    // Nothing left to cancel
+    document.getElementById('cancelExecutionBtn').style.display = 'none';
+    
     // Update progress bar to 100%
     updateProgress(100, 'Complete');
     
@@ -207,6 +242,10 @@ function handleExecutionComplete(data) {
         summaryHTML += '</ul>';
     }
     
+    if (data.tests_deferred) {
+        summaryHTML += `<div class="mt-2"><strong>Deferred (test budget):</strong> ${data.tests_deferred} stream test(s); streams were sorted with their current stats</div>`;
+    }
+    
     if (data.errors && data.errors.length > 0) {
         summaryHTML += '<div class="mt-2"><strong>Errors:</strong><ul class="mb-0">';
         data.errors.forEach(err => {
@@ -225,6 +264,30 @@ function handleExecutionComplete(data) {
         '<i class="fas fa-check-circle text-success"></i> Execution Complete';
 }
 
+/**
+ * Cancel the running execution (kills in-flight stream tests)
+ */
+async function cancelExecution() {
+    if (!currentExecutionId) {
+        return;
+    }
+    
+    const cancelBtn = document.getElementById('cancelExecutionBtn');
+    cancelBtn.disabled = true;
+    
+    try {
+        const response = await fetch(`/api/jobs/${currentExecutionId}/cancel`, { method: 'POST' });
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || 'Error cancelling execution');
+        }
+        addLogLine('Cancellation requested, stopping current test...', 'warning');
+    } catch (error) {
+        addLogLine(`Could not cancel execution: ${error.message}`, 'error');
+        cancelBtn.disabled = false;
+    }
+}
+
 /**
  * Add line to execution log
  */
@@ -270,6 +333,25 @@ function addLogLine(message, type = 'info') {
     logDiv.parentElement.scrollTop = logDiv.parentElement.scrollHeight;
 }
 
+/**
+ * Build the progress label from an aggregated progress event
+ */
+function formatProgressLabel(data) {
+    let label = `Tested ${data.completed}/${data.total} streams`;
+    if (data.failed > 0) {
+        label += ` (${data.failed} failed)`;
+    }
+    if (data.rate > 0) {
+        label += ` · ${data.rate.toFixed(1)}/min`;
+    }
+    if (data.eta_seconds) {
+        const minutes = Math.floor(data.eta_seconds / 60);
+        const seconds = data.eta_seconds % 60;
+        label += ` · ETA ${minutes}m ${seconds}s`;
+    }
+    return label;
+}
+
 /**
  * Update progress bar
  */
@@ -0,0 +1,224 @@
+"""
+Write-behind buffer for stream test results
+
+Saving the result of every stream test used to cost a GET of the stream plus
+a PUT of the whole object (and failures were cleared again by the callers).
+A StatsWriteBuffer collects the results of a run instead: the stats are
+applied to the caller's stream dictionaries right away (so rule evaluation in
+the same run reads them without reloading all streams) and written to
+Dispatcharr in batches, with a PATCH of only the stats fields, a bounded number
+of concurrent requests, and no write at all when the stats didn't change.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from api.dispatcharr_client import DispatcharrClient
+
+# Buffered results that trigger a flush
+STATS_WRITE_BATCH_SIZE = int(os.getenv('STATS_WRITE_BATCH_SIZE', '25'))
+
+# Concurrent write requests during a flush
+STATS_WRITE_CONCURRENCY = int(os.getenv('STATS_WRITE_CONCURRENCY', '4'))
+
+# Hours after which unchanged stats are written anyway, to refresh their timestamp
+STATS_UNCHANGED_WRITE_HOURS = float(os.getenv('STATS_UNCHANGED_WRITE_HOURS', '24'))
+
+STATS_FIELDS = ('stream_stats', 'stream_stats_updated_at')
+
+
+def normalize_stats(stats: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Stats with measurement noise removed (floats rounded), for change detection"""
+    return {key: round(value, 1) if isinstance(value, float) else value
+            for key, value in (stats or {}).items() if value is not None}
+
+
+def stats_age_hours(updated_at: Optional[str]) -> Optional[float]:
+    """Hours since a stats timestamp, or None if it's missing or invalid"""
+    if not updated_at:
+        return None
+    try:
+        updated = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - updated).total_seconds() / 3600
+
+
+class StatsWriteBuffer:
+    """Stream stats waiting to be written to Dispatcharr (thread-safe)"""
+
+    def __init__(self, client: DispatcharrClient, batch_size: int = STATS_WRITE_BATCH_SIZE,
+                 concurrency: int = STATS_WRITE_CONCURRENCY):
+        """
+        Initialize an empty buffer
+
+        Args:
+            client: Dispatcharr client used for the writes
+            batch_size: Buffered results that trigger a flush (0 = only explicit flushes)
+            concurrency: Concurrent write requests during a flush
+        """
+        self.client = client
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.use_patch = True
+        self.written = 0
+        self.unchanged = 0
+        self.errors: Dict[int, str] = {}
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._results: Dict[int, Dict[str, Any]] = {}
+        # Called with the errors of each flush, once its writes are done (see add_flush_listener)
+        self._flush_listeners: List[Callable[[Dict[int, str]], None]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _is_unchanged(self, stream: Dict[str, Any], stats: Dict[str, Any]) -> bool:
+        """Whether the stored stats already say the same and are recent enough to keep"""
+        if normalize_stats(stream.get('stream_stats')) != normalize_stats(stats):
+            return False
+        if not stats:
+            # Already cleared
+            return True
+        age = stats_age_hours(stream.get('stream_stats_updated_at'))
+        return age is not None and age < STATS_UNCHANGED_WRITE_HOURS
+
+    def record(self, stream: Dict[str, Any], stats: Dict[str, Any], updated_at: Optional[str]) -> bool:
+        """
+        Records the result of a stream test
+
+        The stats are applied to the stream dictionary in place and queued for
+        writing, unless they equal the stored ones.
+
+        Args:
+            stream: Stream as known by the caller (must have 'id' and the stored stats)
+            stats: New stats ({} to clear them after a failed test)
+            updated_at: New stats timestamp (None when clearing)
+
+        Returns:
+            True if a write was queued, False if the stats were unchanged
+        """
+        stream_id = stream['id']
+        with self._lock:
+            if self._is_unchanged(stream, stats):
+                self.unchanged += 1
+                self._results[stream_id] = {field: stream.get(field) for field in STATS_FIELDS}
+                return False
+            fields = {'stream_stats': stats, 'stream_stats_updated_at': updated_at}
+            self._pending[stream_id] = fields
+            self._results[stream_id] = fields
+            flush_needed = self.batch_size > 0 and len(self._pending) >= self.batch_size
+        stream.update(fields)
+        if flush_needed:
+            self.flush()
+        return True
+
+    def apply(self, streams: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Applies the results recorded in this run to freshly loaded streams
+
+        Returns:
+            The same list, with the stats of tested streams replaced
+        """
+        with self._lock:
+            results = dict(self._results)
+        for stream in streams:
+            fields = results.get(stream.get('id'))
+            if fields:
+                stream.update(fields)
+        return streams
+
+    def add_flush_listener(self, listener: Callable[[Dict[int, str]], None]):
+        """
+        Calls a function after every flush (including the automatic ones)
+
+        At that point every result recorded before the flush has reached
+        Dispatcharr, except the streams in the errors passed to the listener;
+        e.g. a checkpoint saves its completed tests then.
+        """
+        self._flush_listeners.append(listener)
+
+    def remove_flush_listener(self, listener: Callable[[Dict[int, str]], None]):
+        """Stops calling a flush listener"""
+        if listener in self._flush_listeners:
+            self._flush_listeners.remove(listener)
+
+    @property
+    def pending(self) -> int:
+        """Number of results waiting to be written"""
+        with self._lock:
+            return len(self._pending)
+
+    def _write(self, stream_id: int, fields: Dict[str, Any]):
+        """
+        Writes the stats of one stream
+
+        PATCHes only the stats fields; if Dispatcharr rejects or ignores the
+        PATCH, the stream is written with GET + PUT instead, and later writes
+        of the buffer go straight to PUT.
+        """
+        if self.use_patch:
+            try:
+                response = self.client.patch_stream(stream_id, fields)
+                if not isinstance(response, dict) or 'stream_stats' not in response or \
+                        normalize_stats(response.get('stream_stats')) == normalize_stats(fields['stream_stats']):
+                    return
+                print(f"⚠️  PATCH did not update stream_stats of stream {stream_id}, writing stats with PUT")
+            except Exception as e:
+                print(f"⚠️  PATCH of stream {stream_id} stats failed ({e}), retrying with PUT")
+            stream = self.client.get_stream(stream_id)
+            stream.update(fields)
+            self.client.update_stream(stream_id, stream)
+            self.use_patch = False
+            return
+
+        stream = self.client.get_stream(stream_id)
+        stream.update(fields)
+        self.client.update_stream(stream_id, stream)
+
+    def flush(self) -> Dict[int, str]:
+        """
+        Writes the pending results to Dispatcharr
+
+        Returns:
+            Errors of this flush by stream ID (failed writes are not retried)
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            errors = self._write_batch(batch) if batch else {}
+            for listener in list(self._flush_listeners):
+                listener(errors)
+            return errors
+
+    def _write_batch(self, batch: Dict[int, Dict[str, Any]]) -> Dict[int, str]:
+        """Writes a batch of results concurrently; returns the errors by stream ID"""
+        errors = {}
+        workers = min(self.concurrency, len(batch))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stats-write') as executor:
+            futures = {executor.submit(self._write, stream_id, fields): stream_id
+                       for stream_id, fields in batch.items()}
+            for future in as_completed(futures):
+                stream_id = futures[future]
+                try:
+                    future.result()
+                    self.written += 1
+                except Exception as e:
+                    errors[stream_id] = str(e)
+
+        if errors:
+            print(f"❌ Failed to save stats of {len(errors)} stream(s) to Dispatcharr: "
+                  f"{', '.join(str(stream_id) for stream_id in list(errors)[:10])}")
+        self.errors.update(errors)
+        return errors
+
+    def summary(self) -> Dict[str, int]:
+        """Counters of the buffer"""
+        return {
+            'written': self.written,
+            'unchanged': self.unchanged,
+            'failed': len(self.errors),
+            'pending': self.pending
+        }
@@ -0,0 +1,578 @@
+#!/usr/bin/env python
+"""
+Background stream-stats refresher for Stream Plus
+
+Keeps `stream_stats` fresh continuously instead of testing streams only while a
+rule runs. Stale streams are queued by priority (how stale their stats are,
+whether they are assigned to a channel and whether an enabled rule uses them)
+and tested at a pace limited by a budget of tests per hour, outside the
+configured quiet hours. Rule executions then find recent stats and skip the
+test phase (or run with testing disabled).
+
+The refresher runs inside the web app (STATS_REFRESH_ENABLED=true) or
+standalone (`python stats_refresher.py`). A lease in the execution store
+database makes sure only one refresher runs at a time.
+"""
+import argparse
+import heapq
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from api.dispatcharr_client import DispatcharrClient, OperationCancelled, set_cancel_event
+from circuit_breaker import provider_breakers, stream_provider
+from execution_store import ExecutionStore
+from models import RulesManager, StreamMatcher
+from stats_buffer import StatsWriteBuffer
+from stream_sorter_models import SortingRulesManager
+
+# Start the refresher inside the web app
+STATS_REFRESH_ENABLED = os.getenv('STATS_REFRESH_ENABLED', 'false').lower() == 'true'
+
+# Maximum stream tests per hour
+STATS_REFRESH_BUDGET_PER_HOUR = int(os.getenv('STATS_REFRESH_BUDGET_PER_HOUR', '60'))
+
+# Stats older than this many hours are refreshed
+STATS_REFRESH_MAX_AGE_HOURS = float(os.getenv('STATS_REFRESH_MAX_AGE_HOURS', '24'))
+
+# Hours before a stream whose test failed is tried again
+STATS_REFRESH_FAILED_RETRY_HOURS = float(os.getenv('STATS_REFRESH_FAILED_RETRY_HOURS', '6'))
+
+# Local time ranges without tests, e.g. "18:00-23:30" or "01:00-06:00,12:00-13:00"
+STATS_REFRESH_QUIET_HOURS = os.getenv('STATS_REFRESH_QUIET_HOURS', '')
+
+# Seconds between rebuilds of the refresh queue
+STATS_REFRESH_PLAN_INTERVAL = int(os.getenv('STATS_REFRESH_PLAN_INTERVAL', '900'))
+
+# Seconds a refresher holds its lease without renewing it
+STATS_REFRESH_LEASE_TTL = 120
+
+# Seconds to wait when there is nothing to do (quiet hours, empty queue, no lease)
+STATS_REFRESH_IDLE_SLEEP = 30
+
+# Priority multipliers
+ASSIGNED_WEIGHT = 4.0
+RULE_RELEVANT_WEIGHT = 2.0
+
+# Staleness (in multiples of the max age) given to streams that were never tested
+NEVER_TESTED_STALENESS = 4.0
+MAX_STALENESS = 10.0
+
+LEASE_NAME = 'stats_refresher'
+
+
+def parse_quiet_hours(spec: str) -> List[Tuple[int, int]]:
+    """
+    Parses quiet hours into (start, end) minute-of-day ranges
+
+    Args:
+        spec: Comma-separated "HH:MM-HH:MM" ranges; a range may wrap past midnight
+
+    Returns:
+        List of (start_minute, end_minute) tuples
+    """
+    ranges = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            start, end = part.split('-')
+            start_h, start_m = (int(x) for x in start.strip().split(':'))
+            end_h, end_m = (int(x) for x in end.strip().split(':'))
+            ranges.append((start_h * 60 + start_m, end_h * 60 + end_m))
+        except ValueError:
+            print(f"⚠️  Ignoring invalid quiet hours range: '{part}' (expected HH:MM-HH:MM)")
+    return ranges
+
+
+def in_quiet_hours(ranges: List[Tuple[int, int]], now: Optional[datetime] = None) -> bool:
+    """Whether the local time is inside any of the quiet hour ranges"""
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for start, end in ranges:
+        if start <= end:
+            if start <= minute < end:
+                return True
+        elif minute >= start or minute < end:
+            return True
+    return False
+
+
+def stats_age_hours(stream: Dict[str, Any], now: Optional[datetime] = None) -> Optional[float]:
+    """
+    Age of a stream's stats in hours
+
+    Returns:
+        The age, or None if the stream has no stats (or no valid timestamp)
+    """
+    if not stream.get('stream_stats'):
+        return None
+    updated_at = stream.get('stream_stats_updated_at')
+    if not updated_at:
+        return None
+    try:
+        updated = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max((now - updated).total_seconds() / 3600, 0.0)
+
+
+def stream_priority(stream: Dict[str, Any], assigned: bool, rule_relevant: bool,
+                    max_age_hours: float = STATS_REFRESH_MAX_AGE_HOURS,
+                    now: Optional[datetime] = None) -> Optional[float]:
+    """
+    Refresh priority of a stream (higher is more urgent)
+
+    Staleness is measured in multiples of the max age, then boosted for streams
+    assigned to a channel and for streams used by an enabled rule.
+
+    Returns:
+        The priority, or None if the stats are still fresh
+    """
+    age = stats_age_hours(stream, now)
+    if age is None:
+        staleness = NEVER_TESTED_STALENESS
+    elif age < max_age_hours:
+        return None
+    else:
+        staleness = min(age / max_age_hours, MAX_STALENESS) if max_age_hours > 0 else MAX_STALENESS
+
+    priority = staleness
+    if assigned:
+        priority *= ASSIGNED_WEIGHT
+    if rule_relevant:
+        priority *= RULE_RELEVANT_WEIGHT
+    return priority
+
+
+class StatsRefresher:
+    """Tests stale streams in the background within an hourly budget"""
+
+    def __init__(self, client: DispatcharrClient, store: ExecutionStore,
+                 rules_manager: Optional[RulesManager] = None,
+                 sorting_manager: Optional[SortingRulesManager] = None,
+                 budget_per_hour: int = STATS_REFRESH_BUDGET_PER_HOUR,
+                 max_age_hours: float = STATS_REFRESH_MAX_AGE_HOURS,
+                 quiet_hours: str = STATS_REFRESH_QUIET_HOURS,
+                 verbose: bool = False):
+        """
+        Initialize the refresher
+
+        Args:
+            client: Dispatcharr client used to load and test streams
+            store: Execution store whose database holds the lease and test history
+            rules_manager: Auto-assignment rules (for rule relevance)
+            sorting_manager: Sorting rules (for rule relevance)
+            budget_per_hour: Maximum stream tests per hour
+            max_age_hours: Stats older than this are refreshed
+            quiet_hours: Local time ranges without tests ("HH:MM-HH:MM,...")
+            verbose: Log every planned and tested stream
+        """
+        self.client = client
+        # Each result is written right away (PATCH of the stats only, skipped when unchanged)
+        self.stats_buffer = StatsWriteBuffer(client, batch_size=1)
+        self.store = store
+        self.rules_manager = rules_manager or RulesManager()
+        self.sorting_manager = sorting_manager or SortingRulesManager()
+        self.budget_per_hour = budget_per_hour
+        self.max_age_hours = max_age_hours
+        self.quiet_hours = parse_quiet_hours(quiet_hours)
+        self.verbose = verbose
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._local = threading.local()
+        self._queue: List[Tuple[float, int, str, Optional[int]]] = []
+        self._planned_at = 0.0
+        self._last_test_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the SQLite connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.store.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        """Creates the lease and test history tables if they don't exist"""
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS service_leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stats_refresh_tests (
+                stream_id INTEGER PRIMARY KEY,
+                tested_at REAL NOT NULL,
+                success INTEGER NOT NULL,
+                message TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_stats_refresh_tests_time ON stats_refresh_tests (tested_at);
+        """)
+
+    def acquire_lease(self) -> bool:
+        """
+        Takes or renews the refresher lease
+
+        Returns:
+            True if this process holds the lease
+        """
+        conn = self._connect()
+        now = time.time()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT owner, expires_at FROM service_leases WHERE name = ?',
+                               (LEASE_NAME,)).fetchone()
+            if row and row['owner'] != self.owner and row['expires_at'] > now:
+                conn.execute('COMMIT')
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO service_leases (name, owner, expires_at) VALUES (?, ?, ?)',
+                (LEASE_NAME, self.owner, now + STATS_REFRESH_LEASE_TTL)
+            )
+            conn.execute('COMMIT')
+            return True
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            print(f"Error acquiring stats refresher lease: {e}")
+            return False
+
+    def release_lease(self):
+        """Releases the lease if this process holds it"""
+        try:
+            self._connect().execute('DELETE FROM service_leases WHERE name = ? AND owner = ?',
+                                    (LEASE_NAME, self.owner))
+        except sqlite3.Error as e:
+            print(f"Error releasing stats refresher lease: {e}")
+
+    def lease_owner(self) -> Optional[str]:
+        """Owner of the current (unexpired) lease, if any"""
+        row = self._connect().execute(
+            'SELECT owner FROM service_leases WHERE name = ? AND expires_at > ?', (LEASE_NAME, time.time())
+        ).fetchone()
+        return row['owner'] if row else None
+
+    def tests_in_last_hour(self) -> int:
+        """Number of tests run by the refresher in the last hour"""
+        row = self._connect().execute(
+            'SELECT COUNT(*) AS n FROM stats_refresh_tests WHERE tested_at > ?', (time.time() - 3600,)
+        ).fetchone()
+        return row['n']
+
+    def _record_test(self, stream_id: int, success: bool, message: Optional[str]):
+        """Stores the outcome of a test"""
+        self._connect().execute(
+            'INSERT OR REPLACE INTO stats_refresh_tests (stream_id, tested_at, success, message) VALUES (?, ?, ?, ?)',
+            (stream_id, time.time(), 1 if success else 0, message)
+        )
+
+    def _recently_failed(self) -> Set[int]:
+        """Streams whose last test failed within the retry window"""
+        rows = self._connect().execute(
+            'SELECT stream_id FROM stats_refresh_tests WHERE success = 0 AND tested_at > ?',
+            (time.time() - STATS_REFRESH_FAILED_RETRY_HOURS * 3600,)
+        ).fetchall()
+        return {row['stream_id'] for row in rows}
+
+    def _budget_wait(self) -> float:
+        """
+        Seconds to wait before the next test is allowed
+
+        Tests are spread evenly over the hour and never exceed the hourly budget.
+        """
+        if self.budget_per_hour <= 0:
+            return STATS_REFRESH_IDLE_SLEEP
+        if self.tests_in_last_hour() >= self.budget_per_hour:
+            return STATS_REFRESH_IDLE_SLEEP
+        spacing = 3600 / self.budget_per_hour
+        return max(self._last_test_at + spacing - time.time(), 0.0)
+
+    def _rule_relevant_streams(self, streams: List[Dict[str, Any]], channels: List[Dict[str, Any]]) -> Set[int]:
+        """
+        Streams used by enabled rules
+
+        A stream is relevant if it passes the basic conditions of an enabled
+        auto-assignment rule, or belongs to a channel sorted by an enabled
+        sorting rule.
+        """
+        relevant = set()
+
+        for rule in self.rules_manager.load_rules():
+            if not rule.enabled:
+                continue
+            relevant.update(rule.force_include_stream_ids)
+            for stream in streams:
+                if stream['id'] in rule.force_exclude_stream_ids:
+                    continue
+                if StreamMatcher._stream_matches_basic_conditions(rule, stream):
+                    relevant.add(stream['id'])
+
+        sorted_channel_ids: Set[int] = set()
+        sort_all_channels = False
+        for rule in self.sorting_manager.load_rules():
+            if not rule.enabled:
+                continue
+            if rule.all_channels or (not rule.channel_ids and not rule.channel_group_ids):
+                sort_all_channels = True
+                break
+            sorted_channel_ids.update(rule.channel_ids)
+            sorted_channel_ids.update(self.sorting_manager.expand_channel_groups(rule.channel_group_ids))
+
+        for channel in channels:
+            if sort_all_channels or channel.get('id') in sorted_channel_ids:
+                relevant.update(channel.get('streams') or [])
+
+        return relevant
+
+    def plan(self) -> int:
+        """
+        Rebuilds the refresh queue from the current catalog
+
+        Returns:
+            Number of streams queued
+        """
+        streams = [s for s in self.client.get_streams() if isinstance(s, dict) and 'id' in s]
+        channels = self.client.get_channels()
+
+        assigned = set()
+        for channel in channels:
+            assigned.update(channel.get('streams') or [])
+        relevant = self._rule_relevant_streams(streams, channels)
+        recently_failed = self._recently_failed()
+
+        now = datetime.now(timezone.utc)
+        queue = []
+        for stream in streams:
+            if stream['id'] in recently_failed:
+                continue
+            priority = stream_priority(stream, stream['id'] in assigned, stream['id'] in relevant,
+                                       self.max_age_hours, now)
+            if priority is not None:
+                # heapq is a min-heap: negate so the most urgent stream comes first
+                queue.append((-priority, stream['id'], stream.get('name', 'Unknown'), stream_provider(stream)))
+        heapq.heapify(queue)
+
+        self._queue = queue
+        self._planned_at = time.time()
+        if self.verbose or queue:
+            print(f"📋 Stats refresh queue: {len(queue)} stale stream(s) "
+                  f"({len(assigned)} assigned, {len(relevant)} rule-relevant, "
+                  f"{len(recently_failed)} waiting after a failed test)")
+        return len(queue)
+
+    def refresh_next(self) -> Optional[Dict[str, Any]]:
+        """
+        Tests the most urgent stream of the queue
+
+        The stream is reloaded first and skipped if something else (e.g. a rule
+        execution) refreshed its stats since the queue was planned.
+
+        Returns:
+            Dictionary with 'stream_id', 'name', 'success' and 'message', or None if the queue is empty
+        """
+        while self._queue:
+            _, stream_id, name, provider = heapq.heappop(self._queue)
+            # Provider down: leave the stream for a later plan
+            if not provider_breakers.allow({'m3u_account': provider}):
+                continue
+            try:
+                stream = self.client.get_stream(stream_id)
+            except Exception as e:
+                if self.verbose:
+                    print(f"   ⚠️  Skipping stream {stream_id}: {e}")
+                continue
+            age = stats_age_hours(stream)
+            if age is not None and age < self.max_age_hours:
+                continue
+
+            self._last_test_at = time.time()
+            if self.verbose:
+                print(f"🔬 Refreshing stats: {name} (ID: {stream_id})")
+            try:
+                result = self.client.test_stream(stream_id, stream=stream, stats_buffer=self.stats_buffer)
+                success = bool(result and result.get('success'))
+                message = result.get('message') if result else 'No result'
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                success, message = False, str(e)
+            provider_breakers.record(stream, success, message)
+            self._record_test(stream_id, success, message)
+            if not success:
+                print(f"   ❌ Stats refresh failed for {name} (ID: {stream_id}): {message}")
+            return {'stream_id': stream_id, 'name': name, 'success': success, 'message': message}
+        return None
+
+    def run_once(self, max_tests: Optional[int] = None) -> Dict[str, int]:
+        """
+        Plans the queue and tests stale streams until the queue is empty or the budget is used
+
+        Args:
+            max_tests: Maximum tests in this pass (default: remaining hourly budget)
+
+        Returns:
+            Dictionary with 'queued', 'tested' and 'failed' counts
+        """
+        queued = self.plan()
+        remaining = max(self.budget_per_hour - self.tests_in_last_hour(), 0)
+        limit = remaining if max_tests is None else min(max_tests, remaining)
+
+        tested = failed = 0
+        while tested + failed < limit:
+            result = self.refresh_next()
+            if result is None:
+                break
+            if result['success']:
+                tested += 1
+            else:
+                failed += 1
+        return {'queued': queued, 'tested': tested, 'failed': failed}
+
+    def start(self):
+        """Starts the refresher thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='stats-refresher', daemon=True)
+        self._thread.start()
+        quiet = f", quiet hours {STATS_REFRESH_QUIET_HOURS}" if self.quiet_hours else ''
+        print(f"🩺 Stats refresher started ({self.budget_per_hour} test(s)/hour, "
+              f"max age {self.max_age_hours:g}h{quiet})")
+
+    def stop(self, timeout: float = 10):
+        """Stops the refresher (a running test is killed) and releases the lease"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.release_lease()
+
+    def _loop(self):
+        """Refresher loop: hold the lease, respect quiet hours and budget, test the next stream"""
+        # Stopping the refresher kills the ffprobe/ffmpeg process of a running test
+        set_cancel_event(self._stop)
+        try:
+            while not self._stop.is_set():
+                try:
+                    wait = self._step()
+                except OperationCancelled:
+                    break
+                except Exception as e:
+                    print(f"❌ Stats refresher error: {e}")
+                    wait = STATS_REFRESH_IDLE_SLEEP
+                if wait > 0:
+                    self._stop.wait(wait)
+        finally:
+            set_cancel_event(None)
+            self.release_lease()
+
+    def _step(self) -> float:
+        """
+        Runs one iteration of the loop
+
+        Returns:
+            Seconds to wait before the next iteration
+        """
+        if not self.acquire_lease():
+            return STATS_REFRESH_LEASE_TTL / 2
+        if in_quiet_hours(self.quiet_hours):
+            return STATS_REFRESH_IDLE_SLEEP
+
+        wait = self._budget_wait()
+        if wait > 0:
+            return min(wait, STATS_REFRESH_LEASE_TTL / 2)
+
+        # Replan periodically; with an empty queue, wait for the next plan (renewing the lease)
+        if time.time() - self._planned_at >= STATS_REFRESH_PLAN_INTERVAL:
+            self.plan()
+        if not self._queue:
+            return STATS_REFRESH_LEASE_TTL / 2
+
+        self.refresh_next()
+        return 0
+
+    def status(self) -> Dict[str, Any]:
+        """Current state of the refresher"""
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'lease_owner': self.lease_owner(),
+            'owner': self.owner,
+            'quiet': in_quiet_hours(self.quiet_hours),
+            'queued': len(self._queue),
+            'planned_at': self._planned_at or None,
+            'tests_last_hour': self.tests_in_last_hour(),
+            'budget_per_hour': self.budget_per_hour,
+            'max_age_hours': self.max_age_hours
+        }
+
+
+def main():
+    """Standalone entry point"""
+    parser = argparse.ArgumentParser(
+        description='Keep Stream Plus stream stats fresh by testing stale streams in the background',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Run continuously (same as the refresher started by the web app)
+  python stats_refresher.py
+
+  # Test the stale streams allowed by the hourly budget once and exit
+  python stats_refresher.py --once --verbose
+        """
+    )
+    parser.add_argument('--once', action='store_true', help='Run a single pass and exit')
+    parser.add_argument('--max-tests', type=int, help='Maximum tests in a single pass (with --once)')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Show detailed output')
+    args = parser.parse_args()
+
+    client = DispatcharrClient(
+        base_url=os.getenv('DISPATCHARR_API_URL', 'http://localhost:8080'),
+        username=os.getenv('DISPATCHARR_API_USER'),
+        password=os.getenv('DISPATCHARR_API_PASSWORD')
+    )
+    refresher = StatsRefresher(
+        client, ExecutionStore(),
+        sorting_manager=SortingRulesManager(dispatcharr_client=client),
+        verbose=args.verbose
+    )
+
+    if args.once:
+        if not refresher.acquire_lease():
+            print(f"❌ Another stats refresher is running ({refresher.lease_owner()})")
+            sys.exit(1)
+        try:
+            result = refresher.run_once(args.max_tests)
+        finally:
+            refresher.release_lease()
+        print(f"✅ Stats refresh: {result['tested']} refreshed, {result['failed']} failed, "
+              f"{result['queued']} stale stream(s) queued")
+        sys.exit(0)
+
+    refresher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopping stats refresher...")
+        refresher.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""
+Stream health time series for Stream Plus
+
+Dispatcharr only keeps the latest stats of a stream, so a stream that dropped
+to 800 kbps once looks the same as one that is always at 800 kbps. Every
+stream test is also recorded here (success, bitrate, resolution, startup
+latency and test duration) in a local SQLite database. Recent samples are kept
+as they are; older ones are downsampled into one row per stream and day, and
+rows older than the retention period are deleted.
+
+Sorting rules read rolling health figures from this store (success rate,
+10th percentile bitrate, startup latency), so stable streams can be favored
+without probing anything at sort time.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+# Record stream test results in the health store
+STREAM_HEALTH_ENABLED = os.getenv('STREAM_HEALTH_ENABLED', 'true').lower() == 'true'
+
+# Stream health database file
+STREAM_HEALTH_DB = os.getenv('STREAM_HEALTH_DB', 'stream_health.db')
+
+# Days of history used for the health figures of sorting conditions
+STREAM_HEALTH_WINDOW_DAYS = float(os.getenv('STREAM_HEALTH_WINDOW_DAYS', '7'))
+
+# Days individual test samples are kept before being downsampled to daily rows
+STREAM_HEALTH_RAW_DAYS = int(os.getenv('STREAM_HEALTH_RAW_DAYS', '14'))
+
+# Days daily rows are kept
+STREAM_HEALTH_RETENTION_DAYS = int(os.getenv('STREAM_HEALTH_RETENTION_DAYS', '180'))
+
+# Tests needed in the window before health conditions apply to a stream
+STREAM_HEALTH_MIN_TESTS = int(os.getenv('STREAM_HEALTH_MIN_TESTS', '2'))
+
+# Seconds between downsampling passes of a process
+MAINTENANCE_INTERVAL = 3600
+
+# Maximum stream IDs per SQL query (SQLite variable limit)
+QUERY_CHUNK_SIZE = 500
+
+# Sorting condition types that read the health store, with the health field they compare
+HEALTH_CONDITION_FIELDS = {
+    'success_rate': 'success_rate',
+    'bitrate_p10': 'bitrate_p10',
+    'startup_latency': 'startup_ms'
+}
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of values (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def resolution_height(resolution: Optional[str]) -> Optional[int]:
+    """Height of a 'WIDTHxHEIGHT' resolution"""
+    try:
+        return int(str(resolution).lower().split('x')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _day(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+class StreamHealthStore:
+    """SQLite-backed time series of stream test results"""
+
+    def __init__(self, db_file: Optional[str] = None):
+        """
+        Initialize the health store
+
+        Args:
+            db_file: Path to the SQLite database file (default: STREAM_HEALTH_DB)
+        """
+        self.db_file = db_file or STREAM_HEALTH_DB
+        self._local = threading.local()
+        self._last_maintenance = 0.0
+        self._maintenance_lock = threading.Lock()
+        self._ensure_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the SQLite connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        """Creates the store tables if they don't exist"""
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS stream_tests (
+                stream_id INTEGER NOT NULL,
+                tested_at REAL NOT NULL,
+                success INTEGER NOT NULL,
+                bitrate REAL,
+                height INTEGER,
+                startup_ms REAL,
+                duration_ms REAL,
+                probe_method TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_stream_tests_stream
+                ON stream_tests (stream_id, tested_at);
+            CREATE INDEX IF NOT EXISTS idx_stream_tests_time
+                ON stream_tests (tested_at);
+            CREATE TABLE IF NOT EXISTS stream_health_daily (
+                stream_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                tests INTEGER NOT NULL,
+                successes INTEGER NOT NULL,
+                bitrate_p10 REAL,
+                bitrate_avg REAL,
+                height INTEGER,
+                startup_ms REAL,
+                duration_ms REAL,
+                PRIMARY KEY (stream_id, day)
+            );
+        """)
+
+    def record(self, stream_id: int, success: bool, bitrate: Optional[float] = None,
+               height: Optional[int] = None, startup_ms: Optional[float] = None,
+               duration_ms: Optional[float] = None, probe_method: Optional[str] = None,
+               tested_at: Optional[float] = None):
+        """
+        Records the result of a stream test
+
+        Args:
+            stream_id: Tested stream
+            success: Whether the test succeeded
+            bitrate: Measured bitrate in kbps
+            height: Video height in pixels
+            startup_ms: Milliseconds until the stream delivered data
+            duration_ms: Milliseconds the whole test took
+            probe_method: Probe that produced the result (hls, mpegts, ffmpeg)
+            tested_at: Unix time of the test (default: now)
+        """
+        self._connect().execute(
+            'INSERT INTO stream_tests (stream_id, tested_at, success, bitrate, height, startup_ms, duration_ms, '
+            'probe_method) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (stream_id, tested_at or time.time(), 1 if success else 0, bitrate, height, startup_ms,
+             duration_ms, probe_method)
+        )
+        if time.time() - self._last_maintenance >= MAINTENANCE_INTERVAL:
+            self.downsample()
+
+    def downsample(self, now: Optional[float] = None) -> int:
+        """
+        Moves samples older than STREAM_HEALTH_RAW_DAYS into daily rows and
+        deletes daily rows older than STREAM_HEALTH_RETENTION_DAYS
+
+        Whole UTC days are downsampled at once, so a day never has both
+        samples and a daily row.
+
+        Returns:
+            Number of samples downsampled
+        """
+        if not self._maintenance_lock.acquire(blocking=False):
+            return 0
+        try:
+            now = now or time.time()
+            self._last_maintenance = now
+            today = datetime.fromtimestamp(now, timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+            cutoff = (today - timedelta(days=STREAM_HEALTH_RAW_DAYS)).timestamp()
+            retention_day = (today - timedelta(days=STREAM_HEALTH_RETENTION_DAYS)).strftime('%Y-%m-%d')
+
+            conn = self._connect()
+            rows = conn.execute(
+                'SELECT * FROM stream_tests WHERE tested_at < ? ORDER BY stream_id, tested_at', (cutoff,)
+            ).fetchall()
+
+            groups: Dict[tuple, List[sqlite3.Row]] = {}
+            for row in rows:
+                groups.setdefault((row['stream_id'], _day(row['tested_at'])), []).append(row)
+
+            daily = []
+            for (stream_id, day), samples in groups.items():
+                bitrates = [s['bitrate'] for s in samples if s['success'] and s['bitrate']]
+                startups = [s['startup_ms'] for s in samples if s['success'] and s['startup_ms']]
+                durations = [s['duration_ms'] for s in samples if s['duration_ms']]
+                heights = [s['height'] for s in samples if s['height']]
+                daily.append((
+                    stream_id, day, len(samples), sum(1 for s in samples if s['success']),
+                    percentile(bitrates, 0.1), sum(bitrates) / len(bitrates) if bitrates else None,
+                    max(heights) if heights else None, percentile(startups, 0.5),
+                    sum(durations) / len(durations) if durations else None
+                ))
+
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO stream_health_daily (stream_id, day, tests, successes, bitrate_p10, '
+                    'bitrate_avg, height, startup_ms, duration_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', daily
+                )
+                conn.execute('DELETE FROM stream_tests WHERE tested_at < ?', (cutoff,))
+                conn.execute('DELETE FROM stream_health_daily WHERE day < ?', (retention_day,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return len(rows)
+        finally:
+            self._maintenance_lock.release()
+
+    @staticmethod
+    def _chunks(stream_ids: List[int]) -> Iterable[List[int]]:
+        for start in range(0, len(stream_ids), QUERY_CHUNK_SIZE):
+            yield stream_ids[start:start + QUERY_CHUNK_SIZE]
+
+    def health(self, stream_ids: Iterable[int], window_days: Optional[float] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Rolling health figures of streams
+
+        Daily rows count as one sample of their day's percentile/median, so
+        windows longer than STREAM_HEALTH_RAW_DAYS are approximations.
+
+        Args:
+            stream_ids: Streams to read
+            window_days: Days of history (default: STREAM_HEALTH_WINDOW_DAYS)
+
+        Returns:
+            Dictionary of stream ID to {'tests', 'successes', 'success_rate' (%),
+            'bitrate_p10' (kbps), 'startup_ms' (median), 'last_tested_at'} for
+            streams tested within the window
+        """
+        window_days = STREAM_HEALTH_WINDOW_DAYS if window_days is None else window_days
+        since = time.time() - window_days * 86400
+        since_day = _day(since)
+        ids = sorted({int(stream_id) for stream_id in stream_ids if stream_id is not None})
+
+        samples: Dict[int, Dict[str, Any]] = {}
+
+        def entry(stream_id):
+            return samples.setdefault(stream_id, {'tests': 0, 'successes': 0, 'bitrates': [],
+                                                  'startups': [], 'last_tested_at': None})
+
+        conn = self._connect()
+        for chunk in self._chunks(ids):
+            placeholders = ','.join('?' * len(chunk))
+            for row in conn.execute(
+                    f'SELECT stream_id, tested_at, success, bitrate, startup_ms FROM stream_tests '
+                    f'WHERE stream_id IN ({placeholders}) AND tested_at >= ?', (*chunk, since)):
+                data = entry(row['stream_id'])
+                data['tests'] += 1
+                if row['success']:
+                    data['successes'] += 1
+                    if row['bitrate']:
+                        data['bitrates'].append(row['bitrate'])
+                    if row['startup_ms']:
+                        data['startups'].append(row['startup_ms'])
+                data['last_tested_at'] = max(data['last_tested_at'] or 0, row['tested_at'])
+            for row in conn.execute(
+                    f'SELECT stream_id, tests, successes, bitrate_p10, startup_ms FROM stream_health_daily '
+                    f'WHERE stream_id IN ({placeholders}) AND day >= ?', (*chunk, since_day)):
+                data = entry(row['stream_id'])
+                data['tests'] += row['tests']
+                data['successes'] += row['successes']
+                if row['bitrate_p10']:
+                    data['bitrates'].append(row['bitrate_p10'])
+                if row['startup_ms']:
+                    data['startups'].append(row['startup_ms'])
+
+        return {
+            stream_id: {
+                'tests': data['tests'],
+                'successes': data['successes'],
+                'success_rate': 100.0 * data['successes'] / data['tests'] if data['tests'] else None,
+                'bitrate_p10': percentile(data['bitrates'], 0.1),
+                'startup_ms': percentile(data['startups'], 0.5),
+                'last_tested_at': data['last_tested_at']
+            }
+            for stream_id, data in samples.items()
+        }
+
+    def history(self, stream_id: int, days: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Test history of a stream
+
+        Args:
+            stream_id: Stream to read
+            days: Days of history (default: STREAM_HEALTH_RETENTION_DAYS)
+
+        Returns:
+            Dictionary with 'samples' (recent tests) and 'daily' (downsampled days)
+        """
+        days = days or STREAM_HEALTH_RETENTION_DAYS
+        since = time.time() - days * 86400
+        conn = self._connect()
+        samples = conn.execute(
+            'SELECT tested_at, success, bitrate, height, startup_ms, duration_ms, probe_method FROM stream_tests '
+            'WHERE stream_id = ? AND tested_at >= ? ORDER BY tested_at', (stream_id, since)
+        ).fetchall()
+        daily = conn.execute(
+            'SELECT day, tests, successes, bitrate_p10, bitrate_avg, height, startup_ms, duration_ms '
+            'FROM stream_health_daily WHERE stream_id = ? AND day >= ? ORDER BY day', (stream_id, _day(since))
+        ).fetchall()
+        return {'samples': [dict(row) for row in samples], 'daily': [dict(row) for row in daily]}
+
+
+_store_lock = threading.Lock()
+_store: Optional[StreamHealthStore] = None
+
+
+def get_health_store() -> Optional[StreamHealthStore]:
+    """Health store shared by the process (None if STREAM_HEALTH_ENABLED is false)"""
+    global _store
+    if not STREAM_HEALTH_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = StreamHealthStore()
+        return _store
+
+
+def record_stream_test(stream_id: int, result: Optional[Dict[str, Any]], duration_ms: float):
+    """
+    Records the result of DispatcharrClient.test_stream in the health store
+
+    Errors are logged and ignored, so the health store never breaks a test.
+    """
+    try:
+        store = get_health_store()
+        if store is None:
+            return
+        result = result or {}
+        stats = result.get('statistics') or {}
+        store.record(
+            stream_id,
+            bool(result.get('success')),
+            bitrate=stats.get('ffmpeg_output_bitrate'),
+            height=resolution_height(stats.get('resolution')),
+            startup_ms=result.get('startup_ms'),
+            duration_ms=duration_ms,
+            probe_method=result.get('probe_method')
+        )
+    except Exception as e:
+        print(f"⚠️  Could not record health of stream {stream_id}: {e}")
@@ -9,6 +9,17 @@ import re
 from typing import List, Optional, Dict, Any
 from dataclasses import dataclass, asdict, field
 
+from stream_health import HEALTH_CONDITION_FIELDS, STREAM_HEALTH_MIN_TESTS, get_health_store
+
+# Startup latency and stall condition types, with the stream_stats field they compare
+STARTUP_CONDITION_FIELDS = {
+    'connect_time': 'connect_time_ms',
+    'time_to_first_byte': 'ttfb_ms',
+    'time_to_first_keyframe': 'first_keyframe_ms',
+    'stall_count': 'stall_count',
+    'stall_duration': 'stall_total_ms'
+}
+
 
 @dataclass
 class ChannelGroup:
@@ -45,12 +56,15 @@ class SortingCondition:
     
     Attributes:
         condition_type: Type of condition (m3u_source, video_bitrate, video_resolution, 
-                       video_codec, audio_codec, video_fps)
+                       video_codec, audio_codec, video_fps, pixel_format), of startup and
+                       stalls in the last test (connect_time, time_to_first_byte,
+                       time_to_first_keyframe and stall_duration in ms, stall_count) or of
+                       stream health (success_rate in %, bitrate_p10 in kbps, startup_latency in ms)
         operator: Comparison operator (>, >=, <, <=, ==, !=) - not used for m3u_source
         value: Value to compare against (depends on condition_type)
         points: Points awarded if condition is met
     """
-    condition_type: str  # m3u_source, video_bitrate, video_resolution, video_codec, audio_codec, video_fps, pixel_format
+    condition_type: str  # m3u_source, video_bitrate, video_resolution, video_codec, audio_codec, video_fps, pixel_format, connect_time, time_to_first_byte, time_to_first_keyframe, stall_count, stall_duration, success_rate, bitrate_p10, startup_latency
     operator: Optional[str] = None  # >, >=, <, <=, ==, !=
     value: Optional[Any] = None
     points: int = 1
@@ -79,6 +93,7 @@ class SortingRule:
         conditions: List of scoring conditions
         description: Optional description of the rule
         test_streams_before_sorting: Whether to test streams to obtain stats before sorting
+        probe_mode: How streams are tested ('auto', 'fast' or 'full', see AutoAssignmentRule)
         execution_order: Order in which this rule should be executed (lower numbers = higher priority)
         all_channels: Whether this rule applies to all available channels
     """
@@ -92,6 +107,7 @@ class SortingRule:
     test_streams_before_sorting: bool = False
     force_retest_old_streams: bool = False
     retest_days_threshold: int = 7
+    probe_mode: str = 'auto'
     execution_order: int = 999  # Default high number for new rules
     all_channels: bool = False  # Whether this rule applies to all channels
     
@@ -497,6 +513,25 @@ class StreamSorter:
                     if pixel_format.lower() != str(condition.value).lower():
                         return condition.points
         
+        # Startup latency and stall conditions (measured by the last stream test)
+        elif condition.condition_type in STARTUP_CONDITION_FIELDS:
+            value = stream_stats.get(STARTUP_CONDITION_FIELDS[condition.condition_type])
+            # 0 is a valid measurement (e.g. no stalls)
+            if value is not None and condition.operator and condition.value not in (None, ''):
+                if StreamSorter._compare_value(value, condition.operator, float(condition.value)):
+                    return condition.points
+        
+        # Stream health conditions (rolling figures from the stream health store)
+        elif condition.condition_type in HEALTH_CONDITION_FIELDS:
+            health = stream.get('stream_health') or {}
+            # Too few tests in the window to judge the stream's stability
+            if health.get('tests', 0) < STREAM_HEALTH_MIN_TESTS:
+                return 0
+            value = health.get(HEALTH_CONDITION_FIELDS[condition.condition_type])
+            if value is not None and condition.operator and condition.value not in (None, ''):
+                if StreamSorter._compare_value(value, condition.operator, float(condition.value)):
+                    return condition.points
+        
         return 0
     
     @staticmethod
@@ -524,17 +559,41 @@ class StreamSorter:
             'score_breakdown': score_breakdown
         }
     
+    @staticmethod
+    def _load_health(rule: SortingRule, streams: List[Dict[str, Any]]) -> Optional[Dict[int, Dict[str, Any]]]:
+        """
+        Loads the health figures of the streams if the rule has health conditions
+
+        Returns:
+            Dictionary of stream ID to health figures, or None if not needed or not available
+        """
+        if not any(condition.condition_type in HEALTH_CONDITION_FIELDS for condition in rule.conditions):
+            return None
+        store = get_health_store()
+        if store is None:
+            return None
+        try:
+            return store.health(stream.get('id') for stream in streams)
+        except Exception as e:
+            print(f"⚠️  Could not load stream health, health conditions are skipped: {e}")
+            return None
+
     @staticmethod
     def sort_streams(rule: SortingRule, streams: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Sorts streams by their total score (highest to lowest)
         Returns list of streams with added 'score' and 'score_breakdown' fields
+        (and 'stream_health' if the rule has health conditions)
         """
+        health = StreamSorter._load_health(rule, streams)
+
         # Calculate score for each stream
         scored_streams = []
         for stream in streams:
-            score_result = StreamSorter.score_stream(rule, stream)
             stream_with_score = stream.copy()
+            if health is not None:
+                stream_with_score['stream_health'] = health.get(stream.get('id'))
+            score_result = StreamSorter.score_stream(rule, stream_with_score)
             stream_with_score['score'] = score_result['total_score']
             stream_with_score['score_breakdown'] = score_result['score_breakdown']
             scored_streams.append(stream_with_score)
@@ -0,0 +1,239 @@
+"""
+Budget-aware planning of stream tests for Stream Plus rule executions
+
+An execution can be given a time budget and/or a maximum number of tests. The
+candidates are ordered by the value of testing them (streams without stats
+first, then the oldest stats, then the streams whose result is most likely to
+change the outcome of the rule) and tested while the budget allows. The rest
+are deferred: rules are evaluated with the stats they already have, and the
+deferred streams are reported in the execution summary. Streams of providers
+whose circuit is open (see circuit_breaker.py) are deferred as well, and
+streams whose URL was already tested in the run (see test_registry.py) get
+that result without using the budget.
+"""
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from circuit_breaker import ProviderCircuitBreakers, provider_breakers
+
+# Default time budget in seconds for the test phase of an execution (0 = unlimited)
+TEST_TIME_BUDGET = int(os.getenv('TEST_TIME_BUDGET', '0'))
+
+# Default maximum number of stream tests per execution (0 = unlimited)
+TEST_MAX_TESTS = int(os.getenv('TEST_MAX_TESTS', '0'))
+
+# Deferred stream IDs included in summaries (the count is always complete)
+DEFERRED_IDS_LIMIT = 50
+
+
+def stats_age_days(stream: Dict[str, Any], now: Optional[datetime] = None) -> Optional[float]:
+    """
+    Age of a stream's stats in days
+
+    Returns:
+        The age, or None if the stream has no stats (streams with stats but no
+        valid timestamp are treated as very old)
+    """
+    if not stream.get('stream_stats') or not isinstance(stream.get('stream_stats'), dict):
+        return None
+    updated_at = stream.get('stream_stats_updated_at')
+    try:
+        updated = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return float('inf')
+    if updated.tzinfo is None:
+        updated = updated.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max((now - updated).total_seconds() / 86400, 0.0)
+
+
+class TestBudget:
+    """Time and test-count budget of an execution (shared by all of its rules)"""
+
+    def __init__(self, time_budget: Optional[float] = None, max_tests: Optional[int] = None):
+        """
+        Initialize a budget
+
+        Args:
+            time_budget: Seconds available for testing (None/0 = unlimited)
+            max_tests: Maximum number of tests (None/0 = unlimited)
+        """
+        self.time_budget = time_budget or None
+        self.max_tests = max_tests or None
+        self.started_at = time.time()
+        self.tests_run = 0
+        self.time_spent = 0.0
+        self.exhausted_by: Optional[str] = None
+
+    @classmethod
+    def from_values(cls, time_budget: Optional[Any] = None, max_tests: Optional[Any] = None) -> 'TestBudget':
+        """
+        Creates a budget from request/CLI values, using the environment defaults for missing ones
+
+        Raises:
+            ValueError: If a value is not a non-negative number
+        """
+        time_budget = TEST_TIME_BUDGET if time_budget in (None, '') else float(time_budget)
+        max_tests = TEST_MAX_TESTS if max_tests in (None, '') else int(max_tests)
+        if time_budget < 0 or max_tests < 0:
+            raise ValueError('Test budget values must be zero (unlimited) or positive')
+        return cls(time_budget, max_tests)
+
+    @property
+    def limited(self) -> bool:
+        """Whether the budget limits testing at all"""
+        return self.time_budget is not None or self.max_tests is not None
+
+    def expected_test_seconds(self) -> float:
+        """Expected duration of the next test (average so far, or the configured test duration)"""
+        if self.tests_run:
+            return self.time_spent / self.tests_run
+        return float(os.getenv('STREAM_TEST_DURATION', '10'))
+
+    def remaining_seconds(self) -> Optional[float]:
+        """Seconds left in the time budget, or None if unlimited"""
+        if self.time_budget is None:
+            return None
+        return max(self.time_budget - (time.time() - self.started_at), 0.0)
+
+    def allows_test(self) -> bool:
+        """Whether another test fits in the budget (it must be expected to finish in time)"""
+        if self.max_tests is not None and self.tests_run >= self.max_tests:
+            self.exhausted_by = self.exhausted_by or 'max_tests'
+            return False
+        remaining = self.remaining_seconds()
+        if remaining is not None and remaining < self.expected_test_seconds():
+            self.exhausted_by = self.exhausted_by or 'time_budget'
+            return False
+        return True
+
+    def record_test(self, duration: float):
+        """Records a finished test"""
+        self.tests_run += 1
+        self.time_spent += duration
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary"""
+        return {
+            'time_budget': self.time_budget,
+            'max_tests': self.max_tests,
+            'tests_run': self.tests_run,
+            'elapsed': round(time.time() - self.started_at, 1),
+            'exhausted_by': self.exhausted_by
+        }
+
+
+class TestPlan:
+    """
+    Ordered test candidates of one rule, consumed while the budget allows
+
+    Iterating yields the streams to test in priority order and records the time
+    of each test (until the next stream is requested) in the budget. When the
+    budget runs out, the remaining streams that need a test become deferred.
+    Streams whose provider circuit is open are skipped and deferred; report each
+    test result with record_result() so the circuits see it. With a test
+    registry, streams whose URL already has a result in the run get it applied
+    and are skipped (also once the budget ran out), and on_reuse is told about them.
+    """
+
+    def __init__(self, streams: List[Dict[str, Any]], budget: Optional[TestBudget] = None,
+                 outcome_weight: Optional[Callable[[Dict[str, Any]], float]] = None,
+                 breakers: Optional[ProviderCircuitBreakers] = None, registry=None,
+                 on_reuse: Optional[Callable[[Dict[str, Any], Dict[str, Any]], None]] = None):
+        """
+        Initialize a plan
+
+        Args:
+            streams: Streams that need testing
+            budget: Budget shared by the execution (None = unlimited)
+            outcome_weight: How likely a stream's test is to change the rule's
+                outcome (higher first); breaks ties between streams of similar age
+            breakers: Provider circuit breakers (default: the process-wide ones)
+            registry: StreamTestRegistry of the run (None = no deduplication)
+            on_reuse: Called with each skipped stream and the result it got from the
+                registry (e.g. to record it in a checkpoint like a tested stream)
+        """
+        self.budget = budget or TestBudget()
+        self.breakers = breakers if breakers is not None else provider_breakers
+        self.streams = self.order(streams, outcome_weight)
+        self.tested: List[int] = []
+        self.deferred: List[Dict[str, Any]] = []
+        self.circuit_deferred: List[Dict[str, Any]] = []
+        self.registry = registry
+        self.on_reuse = on_reuse
+        self.reused: List[int] = []
+
+    @staticmethod
+    def order(streams: List[Dict[str, Any]],
+              outcome_weight: Optional[Callable[[Dict[str, Any]], float]] = None) -> List[Dict[str, Any]]:
+        """
+        Orders streams by the value of testing them
+
+        Streams without stats come first, then stats by age (whole days, oldest
+        first), then by outcome weight.
+        """
+        now = datetime.now(timezone.utc)
+
+        def priority(stream):
+            age = stats_age_days(stream, now)
+            weight = outcome_weight(stream) if outcome_weight else 0.0
+            if age is None:
+                return (0, 0.0, -weight)
+            return (1, -(age if age == float('inf') else int(age)), -weight)
+
+        return sorted(streams, key=priority)
+
+    def __len__(self) -> int:
+        return len(self.streams)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        exhausted = False
+        for stream in self.streams:
+            result = self.registry.reuse(stream) if self.registry is not None else None
+            if result is not None:
+                self.reused.append(stream['id'])
+                if self.on_reuse is not None:
+                    self.on_reuse(stream, result)
+                continue
+            # Once the budget ran out, only streams with a reusable result are still applied
+            exhausted = exhausted or not self.budget.allows_test()
+            if exhausted:
+                self.deferred.append(stream)
+                continue
+            if not self.breakers.allow(stream):
+                self.deferred.append(stream)
+                self.circuit_deferred.append(stream)
+                continue
+            started = time.time()
+            yield stream
+            self.budget.record_test(time.time() - started)
+            self.tested.append(stream['id'])
+
+    def record_result(self, stream: Dict[str, Any], success: bool, message: Optional[str] = None):
+        """Reports the result of a test to the provider circuit breakers"""
+        self.breakers.record(stream, success, message)
+
+    def describe_deferred(self) -> str:
+        """Human readable explanation of the deferred streams"""
+        parts = []
+        budget_deferred = len(self.deferred) - len(self.circuit_deferred)
+        if budget_deferred:
+            parts.append(f'{budget_deferred} stream(s) deferred by the test budget ({self.budget.exhausted_by})')
+        if self.circuit_deferred:
+            parts.append(f'{len(self.circuit_deferred)} stream(s) deferred by open provider circuits')
+        return ', '.join(parts)
+
+    def summary(self) -> Dict[str, Any]:
+        """Planned, tested and deferred counts (with the first deferred stream IDs)"""
+        budget_deferred = len(self.deferred) - len(self.circuit_deferred)
+        return {
+            'planned': len(self.streams),
+            'tested': len(self.tested),
+            'reused': len(self.reused),
+            'deferred': len(self.deferred),
+            'circuit_deferred': len(self.circuit_deferred),
+            'deferred_stream_ids': [s['id'] for s in self.deferred[:DEFERRED_IDS_LIMIT]],
+            'exhausted_by': self.budget.exhausted_by if budget_deferred else None
+        }
@@ -0,0 +1,178 @@
+"""
+Run-scoped registry of stream tests for Stream Plus
+
+A stream can be a candidate of several rules (or of several channels of one
+rule) in the same run, and providers often list the same URL under several
+M3U accounts. The StreamTestRegistry of a run collapses this work: streams are
+keyed by their normalized URL (or their ID when they have none), each key is
+tested at most once per run, concurrent requests for a key wait for the test
+in flight instead of starting another one, and the result is applied to every
+stream of the run that shares the URL through the run's stats buffer.
+"""
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from api.dispatcharr_client import DispatcharrClient
+from stats_buffer import StatsWriteBuffer
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_stream_url(url: Optional[str]) -> Optional[str]:
+    """
+    Normalizes a stream URL for deduplication
+
+    Scheme and host are lowercased, default ports and fragments removed and
+    query parameters sorted; the path is kept as is (it is case sensitive).
+
+    Returns:
+        The normalized URL, or None for an empty URL
+    """
+    url = (url or '').strip()
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if not parsed.netloc:
+        return url
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    try:
+        port = parsed.port
+    except ValueError:
+        return url
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f'{host}:{port}'
+    if parsed.username is not None:
+        credentials = parsed.username + (f':{parsed.password}' if parsed.password is not None else '')
+        netloc = f'{credentials}@{netloc}'
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((scheme, netloc, parsed.path or '/', parsed.params, query, ''))
+
+
+class StreamTestRegistry:
+    """Stream tests of one run, deduplicated by URL (thread-safe)"""
+
+    def __init__(self, client: DispatcharrClient, stats_buffer: StatsWriteBuffer,
+                 streams: Optional[Iterable[Dict[str, Any]]] = None):
+        """
+        Initialize an empty registry
+
+        Args:
+            client: Dispatcharr client used for the tests
+            stats_buffer: Stats buffer of the run (results are applied through it)
+            streams: Streams of the run that receive the results of streams sharing their URL
+        """
+        self.client = client
+        self.stats_buffer = stats_buffer
+        self.tested = 0
+        self.reused = 0
+        self.fanned_out = 0
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._sources: Dict[str, Dict[str, Any]] = {}
+        self._streams: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        if streams is not None:
+            self.add_streams(streams)
+
+    @staticmethod
+    def key(stream_id: int, stream: Optional[Dict[str, Any]] = None) -> str:
+        """Deduplication key of a stream: its normalized URL, or its ID if it has no URL"""
+        url = normalize_stream_url((stream or {}).get('url'))
+        return url or f'id:{stream_id}'
+
+    def add_streams(self, streams: Iterable[Dict[str, Any]]):
+        """Registers streams that receive the results of tests of their URL"""
+        with self._lock:
+            for stream in streams:
+                if stream and 'id' in stream:
+                    self._streams.setdefault(self.key(stream['id'], stream), {})[stream['id']] = stream
+
+    def _result_for(self, stream_id: int, stream: Optional[Dict[str, Any]], key: str) -> Optional[Dict[str, Any]]:
+        """Applies a finished result of the key to a stream and returns it for that stream"""
+        with self._lock:
+            future = self._futures.get(key)
+            source = self._sources.get(key)
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        result = future.result()
+        if source['stream'] is not stream:
+            self._apply(stream, result, source)
+        with self._lock:
+            self.reused += 1
+        return dict(result, stream_id=stream_id, reused_from=source['stream_id'])
+
+    def reuse(self, stream: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Applies the result of a test of the stream's URL made earlier in the run
+
+        Returns:
+            The result for this stream, or None if the URL wasn't tested yet
+        """
+        return self._result_for(stream['id'], stream, self.key(stream['id'], stream))
+
+    def test(self, stream_id: int, stream: Optional[Dict[str, Any]] = None,
+             probe_mode: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Tests a stream, unless its URL was already tested (or is being tested) in this run
+
+        Args:
+            stream_id: ID of the stream
+            stream: The stream as loaded by the caller (updated in place with the result)
+            probe_mode: Probe mode of the test (see DispatcharrClient.test_stream)
+
+        Returns:
+            Result of DispatcharrClient.test_stream; results of earlier tests of the
+            same URL have 'reused_from' set to the ID of the tested stream
+        """
+        key = self.key(stream_id, stream)
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+                self._sources[key] = {'stream_id': stream_id, 'stream': stream}
+
+        if not owner:
+            # Tested (or being tested) for another stream of this run: wait for that result
+            future.result()
+            return self._result_for(stream_id, stream, key)
+
+        try:
+            result = self.client.test_stream(stream_id, probe_mode=probe_mode, stream=stream,
+                                             stats_buffer=self.stats_buffer)
+        except BaseException as e:
+            # Let waiting callers fail too, and allow a new test later in the run
+            future.set_exception(e)
+            with self._lock:
+                self._futures.pop(key, None)
+                self._sources.pop(key, None)
+            raise
+
+        with self._lock:
+            self.tested += 1
+            targets = [other for other in self._streams.get(key, {}).values() if other is not stream]
+        for other in targets:
+            self._apply(other, result, self._sources[key])
+        with self._lock:
+            self.fanned_out += len(targets)
+        future.set_result(result)
+        return result
+
+    def _apply(self, stream: Optional[Dict[str, Any]], result: Dict[str, Any], source: Dict[str, Any]):
+        """Records the stats of a result for another stream sharing the URL"""
+        if stream is None or 'id' not in stream:
+            return
+        if result.get('success'):
+            stats = result.get('statistics') or {}
+            updated_at = (source['stream'] or {}).get('stream_stats_updated_at') or \
+                datetime.now(timezone.utc).isoformat()
+        else:
+            stats, updated_at = {}, None
+        self.stats_buffer.record(stream, stats, updated_at)
+
+    def summary(self) -> Dict[str, int]:
+        """Counters of the registry"""
+        with self._lock:
+            return {'tested': self.tested, 'reused': self.reused, 'fanned_out': self.fanned_out}
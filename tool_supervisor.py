@@ -0,0 +1,343 @@
+"""
+Supervisor of the ffmpeg/ffprobe processes started by stream tests
+
+Every stream test starts ffprobe and ffmpeg, each holding sockets, buffers
+and CPU time. Concurrent executions (or the stats refresher running next to
+one) could start any number of them. The supervisor of the process:
+
+- caps the number of concurrent tool processes (TOOL_MAX_CONCURRENT), and
+  lowers the cap while the host load average per CPU is above
+  TOOL_LOAD_THRESHOLD
+- starts each tool with a lower CPU (TOOL_NICE) and I/O (ionice) priority and
+  with address space and CPU time limits (TOOL_MEMORY_LIMIT_MB,
+  TOOL_CPU_LIMIT_SECONDS)
+- runs each tool in its own process group, killed as a whole on timeout or
+  cancellation
+- records the CPU time and peak RSS of each tool (wait4), for the test result
+  and the totals of /api/tool-processes
+"""
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Maximum concurrent ffmpeg/ffprobe processes (0 = unlimited)
+TOOL_MAX_CONCURRENT = int(os.getenv('TOOL_MAX_CONCURRENT', '4'))
+
+# Niceness added to tool processes (0 = same priority as Stream Plus)
+TOOL_NICE = int(os.getenv('TOOL_NICE', '10'))
+
+# I/O scheduling class of tool processes with ionice: 2 (best-effort, lowest level), 3 (idle) or 0 (unchanged)
+TOOL_IONICE_CLASS = int(os.getenv('TOOL_IONICE_CLASS', '2'))
+
+# Address space limit of a tool process in MB (0 = unlimited)
+TOOL_MEMORY_LIMIT_MB = int(os.getenv('TOOL_MEMORY_LIMIT_MB', '2048'))
+
+# CPU time limit of a tool process in seconds (0 = unlimited)
+TOOL_CPU_LIMIT_SECONDS = int(os.getenv('TOOL_CPU_LIMIT_SECONDS', '120'))
+
+# 1-minute load average per CPU above which fewer tools run concurrently (0 = disabled);
+# above the threshold the cap is halved, above twice the threshold only one tool runs
+TOOL_LOAD_THRESHOLD = float(os.getenv('TOOL_LOAD_THRESHOLD', '1.5'))
+
+# Seconds between load average checks
+LOAD_CHECK_INTERVAL = 5.0
+
+# Seconds between cancellation/timeout checks while a tool runs or waits for a slot
+POLL_INTERVAL = 0.25
+
+# Seconds between checks while a tool that closed its output exits
+REAP_INTERVAL = 0.01
+
+# Recent tool runs kept for the status endpoint
+RECENT_RUNS = 20
+
+
+class ToolCancelled(Exception):
+    """Raised when a tool is killed (or not started) because its job was cancelled"""
+    pass
+
+
+def _limit_resources(pid: int):
+    """Applies TOOL_NICE and the resource limits to a started tool (Linux)"""
+    if TOOL_NICE > 0 and hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, pid, min(19, os.getpriority(os.PRIO_PROCESS, pid) + TOOL_NICE))
+        except OSError:
+            pass
+    if resource is None or not hasattr(resource, 'prlimit'):
+        return
+    limits = []
+    if TOOL_MEMORY_LIMIT_MB > 0:
+        limit = TOOL_MEMORY_LIMIT_MB * 1024 * 1024
+        limits.append((resource.RLIMIT_AS, limit))
+    if TOOL_CPU_LIMIT_SECONDS > 0:
+        limits.append((resource.RLIMIT_CPU, TOOL_CPU_LIMIT_SECONDS))
+    for which, limit in limits:
+        try:
+            resource.prlimit(pid, which, (limit, limit))
+        except (OSError, ValueError):
+            pass
+
+
+class ToolSupervisor:
+    """Runs ffmpeg/ffprobe processes within the concurrency and resource limits (thread-safe)"""
+
+    def __init__(self, max_concurrent: int = TOOL_MAX_CONCURRENT, load_threshold: float = TOOL_LOAD_THRESHOLD):
+        """
+        Initialize a supervisor
+
+        Args:
+            max_concurrent: Maximum concurrent tool processes (0 = unlimited)
+            load_threshold: Load average per CPU above which the cap is lowered (0 = disabled)
+        """
+        self.max_concurrent = max_concurrent
+        self.load_threshold = load_threshold
+        self.ionice = shutil.which('ionice') if TOOL_IONICE_CLASS in (2, 3) and os.name == 'posix' else None
+        self.active = 0
+        self.waiting = 0
+        self.runs = 0
+        self.timeouts = 0
+        self.cancellations = 0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mb = 0.0
+        self.recent = deque(maxlen=RECENT_RUNS)
+        self._condition = threading.Condition()
+        self._load: Optional[float] = None
+        self._load_checked = 0.0
+
+    def _load_per_cpu(self) -> Optional[float]:
+        """1-minute load average per CPU (checked at most every LOAD_CHECK_INTERVAL)"""
+        now = time.time()
+        if now - self._load_checked >= LOAD_CHECK_INTERVAL:
+            self._load_checked = now
+            try:
+                self._load = os.getloadavg()[0] / (os.cpu_count() or 1)
+            except (AttributeError, OSError):
+                self._load = None
+        return self._load
+
+    def effective_limit(self) -> Optional[int]:
+        """Current cap of concurrent tools (None = unlimited)"""
+        limit = self.max_concurrent if self.max_concurrent > 0 else None
+        load = self._load_per_cpu() if self.load_threshold > 0 else None
+        if load is None or load <= self.load_threshold:
+            return limit
+        if load > 2 * self.load_threshold:
+            return 1
+        return max(1, (limit or os.cpu_count() or 2) // 2)
+
+    def _acquire(self, cancel_event: Optional[threading.Event]):
+        """Waits for a free slot"""
+        with self._condition:
+            self.waiting += 1
+            try:
+                while True:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise ToolCancelled()
+                    limit = self.effective_limit()
+                    if limit is None or self.active < limit:
+                        self.active += 1
+                        return
+                    self._condition.wait(POLL_INTERVAL)
+            finally:
+                self.waiting -= 1
+
+    def _release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _kill(process: subprocess.Popen):
+        """Kills a tool including its process group on POSIX"""
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def run(self, cmd: List[str], timeout: float, cancel_event: Optional[threading.Event] = None,
+            on_stdout_line: Optional[Callable[[str], None]] = None,
+            on_stderr_line: Optional[Callable[[str], None]] = None,
+            tail_lines: Optional[int] = None) -> subprocess.CompletedProcess:
+        """
+        Runs a tool like subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+
+        The call waits for a free slot first (the wait doesn't count towards the
+        timeout). The returned CompletedProcess has a 'usage' attribute with
+        'cpu_seconds', 'peak_rss_mb' and 'wall_seconds' (None where not measurable).
+
+        Args:
+            cmd: Command line
+            timeout: Seconds the tool may run
+            cancel_event: Kills the tool (or stops waiting for a slot) when set
+            on_stdout_line: Called with every stdout line as soon as it is written
+            on_stderr_line: Called with every stderr line as soon as it is written
+            tail_lines: Keep only the last lines of the output in the result (stderr,
+                and stdout when on_stdout_line consumes it), so memory stays constant
+                however much the tool writes
+
+        Raises:
+            subprocess.TimeoutExpired: If the tool ran longer than timeout (it was killed)
+            ToolCancelled: If cancel_event was set
+        """
+        self._acquire(cancel_event)
+        try:
+            return self._run(cmd, timeout, cancel_event, on_stdout_line, on_stderr_line, tail_lines)
+        finally:
+            self._release()
+
+    def _run(self, cmd: List[str], timeout: float, cancel_event: Optional[threading.Event],
+             on_stdout_line: Optional[Callable[[str], None]], on_stderr_line: Optional[Callable[[str], None]],
+             tail_lines: Optional[int]) -> subprocess.CompletedProcess:
+        popen_kwargs = {}
+        if os.name == 'posix':
+            # Own process group, so the whole tree can be killed at once
+            popen_kwargs['start_new_session'] = True
+        full_cmd = [self.ionice, '-c', str(TOOL_IONICE_CLASS)] + (['-n', '7'] if TOOL_IONICE_CLASS == 2 else []) \
+            + list(cmd) if self.ionice else list(cmd)
+        started = time.time()
+        process = subprocess.Popen(full_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **popen_kwargs)
+        _limit_resources(process.pid)
+
+        # Read both pipes line by line in threads, so lines are handled as they arrive
+        # and the process can be reaped with wait4 (which reports its resource usage)
+        output = {
+            'stdout': deque(maxlen=tail_lines) if tail_lines and on_stdout_line is not None else [],
+            'stderr': deque(maxlen=tail_lines) if tail_lines else []
+        }
+
+        def read(name: str, on_line: Optional[Callable[[str], None]]):
+            for line in getattr(process, name):
+                output[name].append(line)
+                if on_line is not None:
+                    try:
+                        on_line(line)
+                    except Exception as e:
+                        print(f"   ⚠️  Error processing {os.path.basename(cmd[0])} output: {e}")
+
+        readers = [threading.Thread(target=read, args=('stdout', on_stdout_line), daemon=True),
+                   threading.Thread(target=read, args=('stderr', on_stderr_line), daemon=True)]
+        for reader in readers:
+            reader.start()
+
+        deadline = started + timeout
+        outcome = None
+
+        def check():
+            nonlocal outcome
+            if outcome:
+                return outcome
+            if cancel_event is not None and cancel_event.is_set():
+                outcome = 'cancelled'
+            elif time.time() >= deadline:
+                outcome = 'timeout'
+            if outcome:
+                self._kill(process)
+            return outcome
+
+        while not outcome:
+            alive = [reader for reader in readers if reader.is_alive()]
+            if not alive:
+                break
+            alive[0].join(POLL_INTERVAL)
+            check()
+
+        usage = self._reap(process, check)
+        for reader in readers:
+            reader.join()
+        usage['wall_seconds'] = round(time.time() - started, 2)
+        self._record(cmd, usage, outcome)
+
+        if outcome == 'cancelled':
+            print(f"   ⛔ Cancelled: killed {os.path.basename(cmd[0])} (pid {process.pid})")
+            raise ToolCancelled()
+        if outcome == 'timeout':
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        completed = subprocess.CompletedProcess(cmd, process.returncode, ''.join(output['stdout']),
+                                                ''.join(output['stderr']))
+        completed.usage = usage
+        return completed
+
+    @staticmethod
+    def _reap(process: subprocess.Popen, check: Callable[[], Optional[str]]) -> Dict[str, Any]:
+        """
+        Waits for the tool to exit and returns its resource usage
+
+        The tool has closed its output (or was killed) by now, so it exits right
+        away; check() still kills it on timeout or cancellation if it lingers.
+        """
+        if not hasattr(os, 'wait4'):
+            while process.poll() is None:
+                check()
+                time.sleep(REAP_INTERVAL)
+            return {'cpu_seconds': None, 'peak_rss_mb': None}
+        try:
+            while True:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    break
+                check()
+                time.sleep(REAP_INTERVAL)
+        except ChildProcessError:
+            # Already reaped
+            process.wait()
+            return {'cpu_seconds': None, 'peak_rss_mb': None}
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return {
+            'cpu_seconds': round(rusage.ru_utime + rusage.ru_stime, 3),
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': round(rusage.ru_maxrss / 1024, 1)
+        }
+
+    def _record(self, cmd: List[str], usage: Dict[str, Any], outcome: Optional[str]):
+        with self._condition:
+            self.runs += 1
+            if outcome == 'timeout':
+                self.timeouts += 1
+            elif outcome == 'cancelled':
+                self.cancellations += 1
+            self.cpu_seconds += usage.get('cpu_seconds') or 0.0
+            self.peak_rss_mb = max(self.peak_rss_mb, usage.get('peak_rss_mb') or 0.0)
+            self.recent.append(dict(usage, tool=os.path.basename(cmd[0]), outcome=outcome or 'exited',
+                                    finished_at=time.time()))
+
+    def status(self) -> Dict[str, Any]:
+        """Limits, current load and totals of the supervisor"""
+        with self._condition:
+            return {
+                'max_concurrent': self.max_concurrent or None,
+                'effective_limit': self.effective_limit(),
+                'load_per_cpu': round(self._load, 2) if self._load is not None else None,
+                'load_threshold': self.load_threshold or None,
+                'active': self.active,
+                'waiting': self.waiting,
+                'runs': self.runs,
+                'timeouts': self.timeouts,
+                'cancellations': self.cancellations,
+                'cpu_seconds': round(self.cpu_seconds, 1),
+                'peak_rss_mb': self.peak_rss_mb,
+                'limits': {
+                    'nice': TOOL_NICE,
+                    'ionice_class': TOOL_IONICE_CLASS if self.ionice else None,
+                    'memory_limit_mb': TOOL_MEMORY_LIMIT_MB or None,
+                    'cpu_limit_seconds': TOOL_CPU_LIMIT_SECONDS or None
+                },
+                'recent': list(self.recent)
+            }
+
+
+# Supervisor shared by every test of the process (executions, stats refresher)
+tool_supervisor = ToolSupervisor()
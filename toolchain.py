@@ -0,0 +1,178 @@
+"""
+ffmpeg/ffprobe toolchain used by the stream tests
+
+The executables are located, verified and inspected once per process instead
+of on every test: get_toolchain() resolves the paths (Docker path file, local
+Windows build, then PATH), reads the ffmpeg and ffprobe versions and the
+capabilities the tests depend on (-progress, -stats_period, input protocols).
+The application resolves it at startup, so missing tools are reported once,
+and tests fail right away with the same message instead of searching again.
+"""
+import os
+import re
+import shutil
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# File with the ffprobe path, written by the Docker image
+FFPROBE_PATH_FILE = os.path.join(BASE_DIR, 'tools', 'ffprobe_path.txt')
+
+# Local ffmpeg build (Windows development environment)
+LOCAL_BIN_DIR = os.path.join(BASE_DIR, 'tools', 'ffmpeg', 'ffmpeg-7.1-essentials_build', 'bin')
+
+# Seconds to wait for the version/capability queries
+TOOLCHAIN_QUERY_TIMEOUT = 10
+
+VERSION_PATTERN = re.compile(r'^\S+ version (\S+)')
+
+
+@dataclass
+class ProbeToolchain:
+    """Resolved ffmpeg/ffprobe executables and their capabilities"""
+    ffprobe: Optional[str] = None
+    ffmpeg: Optional[str] = None
+    ffprobe_version: Optional[str] = None
+    ffmpeg_version: Optional[str] = None
+    supports_progress: bool = False
+    supports_stats_period: bool = False
+    protocols: List[str] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def available(self) -> bool:
+        """True if both tools were found and run"""
+        return not self.errors
+
+    @property
+    def error(self) -> Optional[str]:
+        """Why the tools can't be used (None if they can)"""
+        return '; '.join(self.errors) if self.errors else None
+
+    def supports_protocol(self, url: str) -> bool:
+        """
+        Whether ffmpeg can read a URL's protocol
+
+        Unknown protocol lists (the query failed) and URLs without a scheme are
+        assumed to be supported.
+        """
+        scheme = url.split('://', 1)[0].lower() if '://' in url else None
+        return not scheme or not self.protocols or scheme in self.protocols
+
+    def status(self) -> Dict[str, Any]:
+        """State for the diagnostics endpoint"""
+        return {
+            'available': self.available,
+            'error': self.error,
+            'ffprobe': {'path': self.ffprobe, 'version': self.ffprobe_version},
+            'ffmpeg': {
+                'path': self.ffmpeg,
+                'version': self.ffmpeg_version,
+                'supports_progress': self.supports_progress,
+                'supports_stats_period': self.supports_stats_period,
+                'protocols': self.protocols
+            }
+        }
+
+
+def _query(cmd: List[str]) -> str:
+    """Output of a quick tool query ('' if it failed)"""
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=TOOLCHAIN_QUERY_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return ''
+    return result.stdout or ''
+
+
+def _version(executable: str) -> Optional[str]:
+    match = VERSION_PATTERN.match(_query([executable, '-hide_banner', '-version']))
+    return match.group(1) if match else None
+
+
+def _input_protocols(ffmpeg: str) -> List[str]:
+    """Input protocols listed by `ffmpeg -protocols`"""
+    protocols = []
+    section = None
+    for line in _query([ffmpeg, '-hide_banner', '-protocols']).splitlines():
+        line = line.strip()
+        if line.endswith(':'):
+            section = line[:-1].lower()
+        elif line and section == 'input':
+            protocols.append(line.lower())
+    return protocols
+
+
+def _locate(name: str, candidates: List[str]) -> Optional[str]:
+    """First existing candidate path, or the tool from PATH"""
+    for candidate in candidates:
+        if candidate and os.path.exists(candidate):
+            return candidate
+    return shutil.which(name)
+
+
+def resolve_toolchain() -> ProbeToolchain:
+    """Locates ffprobe/ffmpeg and inspects their versions and capabilities"""
+    toolchain = ProbeToolchain()
+
+    ffprobe_candidates = []
+    if os.path.exists(FFPROBE_PATH_FILE):
+        try:
+            with open(FFPROBE_PATH_FILE, 'r') as f:
+                ffprobe_candidates.append(f.read().strip())
+        except OSError as e:
+            print(f"⚠️  Error reading ffprobe path file: {e}, using system ffprobe")
+    ffprobe_candidates.append(os.path.join(LOCAL_BIN_DIR, 'ffprobe.exe'))
+
+    toolchain.ffprobe = _locate('ffprobe', ffprobe_candidates)
+    toolchain.ffmpeg = _locate('ffmpeg', [os.path.join(LOCAL_BIN_DIR, 'ffmpeg.exe')])
+    if not toolchain.ffprobe:
+        toolchain.errors.append('ffprobe executable not found')
+    if not toolchain.ffmpeg:
+        toolchain.errors.append('ffmpeg executable not found')
+
+    if toolchain.ffprobe:
+        toolchain.ffprobe_version = _version(toolchain.ffprobe)
+        if toolchain.ffprobe_version is None:
+            toolchain.errors.append(f'ffprobe at {toolchain.ffprobe} does not run')
+    if toolchain.ffmpeg:
+        toolchain.ffmpeg_version = _version(toolchain.ffmpeg)
+        if toolchain.ffmpeg_version is None:
+            toolchain.errors.append(f'ffmpeg at {toolchain.ffmpeg} does not run')
+        options = _query([toolchain.ffmpeg, '-hide_banner', '-h', 'long'])
+        toolchain.supports_progress = '-progress' in options
+        toolchain.supports_stats_period = '-stats_period' in options
+        toolchain.protocols = _input_protocols(toolchain.ffmpeg)
+    return toolchain
+
+
+_toolchain: Optional[ProbeToolchain] = None
+_toolchain_lock = threading.Lock()
+
+
+def get_toolchain(refresh: bool = False) -> ProbeToolchain:
+    """
+    Gets the toolchain of the process (resolved on first use)
+
+    Args:
+        refresh: Resolve the tools again (e.g. after installing them)
+    """
+    global _toolchain
+    with _toolchain_lock:
+        if _toolchain is None or refresh:
+            _toolchain = resolve_toolchain()
+        return _toolchain
+
+
+def log_toolchain(toolchain: ProbeToolchain):
+    """Prints the resolved toolchain (at startup)"""
+    if toolchain.available:
+        print(f"🎬 ffprobe {toolchain.ffprobe_version or '?'} ({toolchain.ffprobe}), "
+              f"ffmpeg {toolchain.ffmpeg_version or '?'} ({toolchain.ffmpeg})")
+        if not toolchain.supports_progress:
+            print("   ⚠️  ffmpeg doesn't support -progress: startup and stall metrics are not measured")
+    else:
+        print(f"❌ Stream testing unavailable: {toolchain.error}. Install ffmpeg (with ffprobe) or "
+              f"set its path in tools/ffprobe_path.txt; stream tests will fail until then")
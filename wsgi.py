@@ -0,0 +1,8 @@
+"""
+WSGI entry point for Stream Plus
+
+Used by production servers, e.g. `gunicorn --worker-class gthread wsgi:app`
+"""
+from app import app
+
+application = app